@@ -1,3 +1,11 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import OutboxEvent
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'created_at', 'dispatched_at', 'attempts', 'leased_until', 'last_error')
+    list_filter = ('kind', 'dispatched_at')
+    ordering = ('-id',)
+    readonly_fields = ('kind', 'payload', 'created_at', 'dispatched_at', 'leased_until', 'last_error')
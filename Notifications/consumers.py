@@ -1,7 +1,15 @@
+import asyncio
+
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
 
+from . import presence
+
+
 class NotificationConsumer(AsyncJsonWebsocketConsumer):
+    group_name = None
+    heartbeat_task = None
+
     async def connect(self):
         user = self.scope.get("user")
 
@@ -9,14 +17,35 @@ class NotificationConsumer(AsyncJsonWebsocketConsumer):
         if user is None or not user.is_authenticated:
             await self.close()
             return
-        
+
+        self.user_id = user.id
         self.group_name = f"user_{user.id}"
+        # Mark online before joining so no send in between is skipped.
+        await presence.amark_connected(self.user_id)
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
+        self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
 
     async def disconnect(self, close_code):
+        if self.group_name is None:
+            return
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+        await presence.amark_disconnected(self.user_id)
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
+    async def heartbeat(self):
+        # Server-side refresh, so presence does not depend on clients pinging.
+        interval = presence.get_presence_settings()['HEARTBEAT_INTERVAL']
+        while True:
+            await asyncio.sleep(interval)
+            await presence.arefresh(self.user_id)
+
+    async def receive_json(self, content, **kwargs):
+        if content.get("type") == "heartbeat":
+            await presence.arefresh(self.user_id)
+            await self.send_json({"type": "heartbeat"})
+
     async def notify(self, event):
         await self.send_json({
             "message": event["message"]
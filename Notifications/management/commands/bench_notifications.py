@@ -0,0 +1,93 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import wait
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from Notifications import presence
+from Notifications.models import Notification
+from Notifications.utils import (
+    asend_notification,
+    asend_to_user,
+    send_to_user,
+)
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Compare per-notification overhead of the legacy, background-loop and native async send paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help='Notifications per path.')
+        parser.add_argument('--persist', action='store_true',
+                            help='Also write Notification rows (needs --email). Rows are deleted afterwards.')
+        parser.add_argument('--email', help='Recipient for --persist runs.')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        user = None
+        if options['persist']:
+            if not options['email']:
+                raise CommandError("--persist requires --email")
+            try:
+                user = User.objects.get(email=options['email'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user with email {options['email']}")
+
+        marker = f"bench-{uuid.uuid4().hex[:8]}"
+        user_id = user.id if user else uuid.uuid4()
+        channel_layer = get_channel_layer()
+
+        def legacy():
+            for _ in range(count):
+                if user:
+                    Notification.objects.create(user=user, message=marker)
+                async_to_sync(channel_layer.group_send)(
+                    f"user_{user_id}", {"type": "notify", "message": marker}
+                )
+
+        def background():
+            # Same work as send_notification() and its outbox delivery, but
+            # keeps the futures so the timing includes the channel layer.
+            futures = []
+            for _ in range(count):
+                if user:
+                    Notification.objects.create(user=user, message=marker)
+                futures.append(send_to_user(user_id, marker))
+            wait([future for future in futures if future is not None])
+
+        async def native():
+            for _ in range(count):
+                if user:
+                    await asend_notification(user, marker)
+                else:
+                    await asend_to_user(user_id, marker)
+
+        # Presence gating would otherwise skip every send for a user with no socket.
+        presence.mark_connected(user_id)
+        results = {}
+        try:
+            results['legacy async_to_sync'] = self._time(legacy)
+            results['background loop'] = self._time(background)
+            results['native async'] = self._time(lambda: asyncio.run(native()))
+        finally:
+            presence.mark_disconnected(user_id)
+            if user:
+                Notification.objects.filter(user=user, message=marker).delete()
+
+        baseline = results['legacy async_to_sync']
+        for name, elapsed in results.items():
+            per_call = elapsed / count * 1_000_000
+            self.stdout.write(
+                f"{name:<22} {per_call:10.1f} us/notification  ({baseline / elapsed:5.2f}x vs legacy)"
+            )
+
+    def _time(self, fn):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import platform
+import time
+import tracemalloc
+import uuid
+
+import django
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from Notifications.routing import websocket_urlpatterns
+from Notifications.utils import asend_to_user
+from services.benchmarks import percentile
+
+IN_MEMORY_SETTINGS = {
+    'CHANNEL_LAYERS': {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    'CACHES': {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+}
+
+
+class BenchUser:
+    """Stand-in for scope["user"] so the run needs no database rows."""
+    is_authenticated = True
+
+    def __init__(self):
+        self.id = uuid.uuid4()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test NotificationConsumer: open N concurrent sockets, fan out M messages to each, "
+        "and report connect rate, delivery latency percentiles and memory per connection as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=500)
+        parser.add_argument('--messages', type=int, default=20, help='Messages sent to every connection.')
+        parser.add_argument('--payload-bytes', type=int, default=64)
+        parser.add_argument('--timeout', type=float, default=10.0, help='Per-operation timeout in seconds.')
+        parser.add_argument('--output', help='Write the JSON result to this file.')
+        parser.add_argument('--baseline', help='Earlier result file to compare against.')
+        parser.add_argument('--use-configured-layers', action='store_true',
+                            help='Use the configured channel layer and cache instead of in-memory ones.')
+
+    def handle(self, *args, **options):
+        if options['use_configured_layers']:
+            result = asyncio.run(self.run(options))
+        else:
+            with override_settings(**IN_MEMORY_SETTINGS):
+                result = asyncio.run(self.run(options))
+
+        output = json.dumps(result, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + "\n")
+            self.stdout.write(f"Saved results to {options['output']}")
+        self.stdout.write(output)
+        if options['baseline']:
+            self.compare(options['baseline'], result)
+
+    def compare(self, path, result):
+        with open(path) as fh:
+            baseline = json.load(fh)
+        rows = [
+            ('connects_per_second', baseline.get('connects_per_second'), result['connects_per_second']),
+            ('deliveries_per_second', baseline.get('deliveries_per_second'), result['deliveries_per_second']),
+            ('memory_per_connection_bytes', baseline.get('memory_per_connection_bytes'),
+             result['memory_per_connection_bytes']),
+        ]
+        for name in ('p50', 'p90', 'p99'):
+            rows.append((f'latency_{name}_ms', baseline.get('delivery_latency_ms', {}).get(name),
+                         result['delivery_latency_ms'][name]))
+        self.stdout.write(f"\nCompared with {path}:")
+        for name, before, after in rows:
+            if before in (None, 0) or after is None:
+                continue
+            self.stdout.write(f"  {name:<30} {before:>12} -> {after:>12}  ({(after - before) / before:+.1%})")
+
+    async def run(self, options):
+        connections = options['connections']
+        messages = options['messages']
+        timeout = options['timeout']
+        padding = "x" * options['payload_bytes']
+        application = URLRouter(websocket_urlpatterns)
+
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+
+        users = [BenchUser() for _ in range(connections)]
+
+        async def open_socket(user):
+            communicator = WebsocketCommunicator(application, "/ws/notifications/")
+            communicator.scope["user"] = user
+            connected, _ = await communicator.connect(timeout=timeout)
+            return communicator if connected else None
+
+        started = time.perf_counter()
+        communicators = await asyncio.gather(*(open_socket(user) for user in users))
+        connect_seconds = time.perf_counter() - started
+        memory_connected = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        open_sockets = [(user, comm) for user, comm in zip(users, communicators) if comm is not None]
+        latencies = []
+        missed = 0
+
+        async def drain(communicator):
+            nonlocal missed
+            for _ in range(messages):
+                try:
+                    event = await communicator.receive_json_from(timeout=timeout)
+                except asyncio.TimeoutError:
+                    missed += 1
+                    continue
+                sent_at = json.loads(event["message"])["sent_at"]
+                latencies.append(time.perf_counter() - sent_at)
+
+        receivers = [asyncio.ensure_future(drain(comm)) for _, comm in open_sockets]
+        started = time.perf_counter()
+        for seq in range(messages):
+            message = json.dumps({"seq": seq, "sent_at": time.perf_counter(), "pad": padding})
+            await asyncio.gather(*(asend_to_user(user.id, message) for user, _ in open_sockets))
+        await asyncio.gather(*receivers)
+        fanout_seconds = time.perf_counter() - started
+
+        await asyncio.gather(*(comm.disconnect() for _, comm in open_sockets))
+
+        latencies.sort()
+        latency_ms = {
+            name: round(percentile(latencies, pct) * 1000, 3) if latencies else None
+            for name, pct in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100))
+        }
+        return {
+            'timestamp': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'connections_requested': connections,
+            'connections_opened': len(open_sockets),
+            'messages_per_connection': messages,
+            'payload_bytes': options['payload_bytes'],
+            'connect_seconds': round(connect_seconds, 4),
+            'connects_per_second': round(len(open_sockets) / connect_seconds, 1) if connect_seconds else None,
+            'deliveries': len(latencies),
+            'missed_deliveries': missed,
+            'fanout_seconds': round(fanout_seconds, 4),
+            'deliveries_per_second': round(len(latencies) / fanout_seconds, 1) if fanout_seconds else None,
+            'delivery_latency_ms': latency_ms,
+            'memory_per_connection_bytes': (
+                round((memory_connected - memory_before) / len(open_sockets)) if open_sockets else None
+            ),
+        }
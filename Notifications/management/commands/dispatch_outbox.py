@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Notifications import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the side effects recorded in the outbox (cache invalidation, feed "
+        "messages, emails, notification fan-out), in batches, until stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Events per batch; defaults to settings.OUTBOX.')
+        parser.add_argument('--sleep', type=float, help='Seconds to wait when idle; defaults to settings.OUTBOX.')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit.')
+
+    def handle(self, *args, **options):
+        config = outbox.get_outbox_settings()
+        batch_size = options['batch_size'] or config['BATCH_SIZE']
+        pause = config['POLL_INTERVAL'] if options['sleep'] is None else options['sleep']
+        totals = {'dispatched': 0, 'failed': 0}
+        try:
+            while True:
+                dispatched, failed = outbox.dispatch(batch_size)
+                totals['dispatched'] += dispatched
+                totals['failed'] += failed
+                if dispatched + failed < batch_size:
+                    # Caught up: tidy up, then stop or wait for more.
+                    outbox.purge(batch_size=batch_size)
+                    if options['once']:
+                        break
+                    time.sleep(pause)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            f"Dispatched {totals['dispatched']} events, {totals['failed']} failed."
+        ))
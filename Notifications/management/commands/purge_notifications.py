@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from Notifications.retention import RetentionRun
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply notification retention: compact old read notifications into a summary row, "
+        "delete expired ones and enforce the per-user cap. Defaults come from "
+        "settings.NOTIFICATION_RETENTION."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-per-user', type=int, help='Keep at most this many notifications per user (0 disables).')
+        parser.add_argument('--max-age-days', type=int, help='Delete notifications older than this (0 disables).')
+        parser.add_argument('--compact-after-days', type=int, help='Compact read notifications older than this (0 disables).')
+        parser.add_argument('--batch-size', type=int, help='Rows deleted per transaction.')
+        parser.add_argument('--batch-sleep', type=float, help='Seconds to sleep between batches.')
+        parser.add_argument('--time-limit', type=int, help='Stop after this many seconds.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be removed.')
+
+    def handle(self, *args, **options):
+        run = RetentionRun(
+            dry_run=options['dry_run'],
+            MAX_PER_USER=options['max_per_user'],
+            MAX_AGE_DAYS=options['max_age_days'],
+            COMPACT_READ_AFTER_DAYS=options['compact_after_days'],
+            BATCH_SIZE=options['batch_size'],
+            BATCH_SLEEP=options['batch_sleep'],
+            TIME_LIMIT=options['time_limit'],
+        )
+        stats = run.run()
+
+        prefix = "Would remove" if options['dry_run'] else "Removed"
+        self.stdout.write(
+            f"{prefix}: {stats['compacted']} compacted, {stats['expired']} expired, "
+            f"{stats['over_cap']} over per-user cap."
+        )
+        if run.out_of_time():
+            self.stdout.write(self.style.WARNING("Time limit reached; run again to continue."))
@@ -11,6 +11,38 @@ class Notification(models.Model):
     message = models.TextField()
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set on the single row per user that stands in for compacted read notifications.
+    is_summary = models.BooleanField(default=False)
+    summarized_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='notif_user_created_idx'),
+            models.Index(fields=['created_at'], name='notif_created_idx'),
+            models.Index(fields=['is_read', 'created_at'], name='notif_read_created_idx'),
+        ]
+
+
+class OutboxEvent(models.Model):
+    """
+    A side effect to run once the write that caused it has committed;
+    written in that write's transaction (see Notifications/outbox.py).
+    """
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    # Until when a dispatch worker holds it; after that another may retry it.
+    leased_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(dispatched_at__isnull=True), name='outbox_pending_idx'),
+            models.Index(fields=['dispatched_at'], name='outbox_dispatched_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id}"
@@ -0,0 +1,136 @@
+"""
+Transactional outbox for side effects.
+
+Request handlers only make their write. Whatever has to follow it (cache
+invalidation, live-feed messages, emails, notification fan-out) is recorded
+as an OutboxEvent with emit(), in the same transaction, so it happens if and
+only if the write commits, and never holds up the response.
+
+Nothing runs them but `manage.py dispatch_outbox`, so it is a required
+process next to the web workers: without it, emails aren't sent, the live
+feed goes quiet, and the cached product list never sees a change, as its
+generation is only bumped by the ProductChanged handler.
+
+A worker claims pending events in id order, BATCH_SIZE at a time, by
+leasing them for LEASE_SECONDS in one short transaction. The handlers run
+after that commits, outside any claim: each payload goes to the handler
+settings.OUTBOX['HANDLERS'] names for its kind:
+
+    ProductChanged   services.events      feed diffs, the catalog generation bump, repricing
+    CartsRepriced    services.cart_totals one batch of carts' totals, then the rest queued
+    CartChanged      services.events      feed subscription changes
+    UserApproved     authentication.utils password setup email
+    UserVerified     authentication.utils password setup email
+    UserNotified     Notifications.utils  channel-layer fan-out
+
+A second short transaction then marks the batch. Each handler runs in a
+transaction of its own, so one that raises has only its own writes and
+on_commit callbacks rolled back, and is retried on later passes, up to
+MAX_ATTEMPTS; after that the event stays undispatched with its last
+error, for the admin to look at. Delivery is at least once: a worker that
+dies before marking its batch leaves the leases to expire, and the events
+run again. Dispatched events are deleted after KEEP_DAYS.
+
+Several workers can run. Events of ORDERED_KINDS (the feed diffs, where a
+later one must not overtake an earlier one) are only claimed while no
+other worker holds a lease on that kind.
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'HANDLERS': {
+        'ProductChanged': 'services.events.deliver_product_changed',
+        'CartsRepriced': 'services.cart_totals.deliver_carts_repriced',
+        'CartChanged': 'services.events.deliver_cart_changed',
+        'UserApproved': 'authentication.utils.deliver_password_setup',
+        'UserVerified': 'authentication.utils.deliver_password_setup',
+        'UserNotified': 'Notifications.utils.deliver_notification',
+    },
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 5,
+    'LEASE_SECONDS': 300,  # must exceed how long a batch's handlers take
+    'ORDERED_KINDS': ['ProductChanged', 'CartChanged'],
+    'POLL_INTERVAL': 1.0,  # seconds a worker waits when the outbox is empty
+    'KEEP_DAYS': 7,
+}
+
+
+def get_outbox_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'OUTBOX', {}))
+    return config
+
+
+def emit(kind, payload):
+    """Record an event in the current transaction. payload must be JSON-serializable."""
+    return OutboxEvent.objects.create(kind=kind, payload=payload)
+
+
+def claim(batch_size, config):
+    """Lease up to batch_size pending events to this worker, in id order, and return them."""
+    now = timezone.now()
+    pending = OutboxEvent.objects.filter(dispatched_at__isnull=True)
+    with transaction.atomic():
+        # Not SKIP LOCKED: claims queue up behind each other, so the kinds
+        # in flight below are read after any claim ahead of this one.
+        events = list(
+            pending.select_for_update()
+            .filter(attempts__lt=config['MAX_ATTEMPTS'])
+            .filter(Q(leased_until__isnull=True) | Q(leased_until__lte=now))
+            .order_by('id')[:batch_size]
+        )
+        in_flight = set(
+            pending.filter(kind__in=config['ORDERED_KINDS'], leased_until__gt=now).values_list('kind', flat=True)
+        )
+        events = [event for event in events if event.kind not in in_flight]
+        leased_until = now + datetime.timedelta(seconds=config['LEASE_SECONDS'])
+        for event in events:
+            event.attempts += 1
+            event.leased_until = leased_until
+        OutboxEvent.objects.bulk_update(events, ['attempts', 'leased_until'])
+    return events
+
+
+def dispatch(batch_size=None):
+    """Run one batch of pending events. Returns (dispatched, failed)."""
+    config = get_outbox_settings()
+    events = claim(batch_size or config['BATCH_SIZE'], config)
+    dispatched = failed = 0
+    for event in events:
+        try:
+            with transaction.atomic():
+                import_string(config['HANDLERS'][event.kind])(event.payload)
+        except Exception as exc:
+            logger.exception("Outbox event %s (%s) failed", event.id, event.kind)
+            event.last_error = f"{type(exc).__name__}: {exc}"
+            failed += 1
+        else:
+            event.dispatched_at = timezone.now()
+            dispatched += 1
+        event.leased_until = None
+    with transaction.atomic():
+        OutboxEvent.objects.bulk_update(events, ['dispatched_at', 'last_error', 'leased_until'])
+    return dispatched, failed
+
+
+def purge(keep_days=None, batch_size=None):
+    """Delete up to batch_size events dispatched more than keep_days ago. Returns how many."""
+    config = get_outbox_settings()
+    keep_days = config['KEEP_DAYS'] if keep_days is None else keep_days
+    cutoff = timezone.now() - datetime.timedelta(days=keep_days)
+    ids = list(
+        OutboxEvent.objects.filter(dispatched_at__lt=cutoff).order_by('id')
+        .values_list('id', flat=True)[:batch_size or config['BATCH_SIZE']]
+    )
+    return OutboxEvent.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,105 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from SaaS_Practice.metrics import registry
+
+DEFAULTS = {
+    'TTL': 90,                 # seconds a connection count survives without a refresh
+    'HEARTBEAT_INTERVAL': 30,  # how often each open socket refreshes it
+}
+
+
+def get_presence_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'NOTIFICATION_PRESENCE', {}))
+    return config
+
+
+def presence_key(user_id):
+    return f"presence:user:{user_id}"
+
+
+def record_fanout(sent):
+    registry.inc('notification_fanout_total', (('result', 'sent' if sent else 'skipped_offline'),))
+
+
+def fanout_metrics():
+    """Process-local counts of channel-layer sends made and skipped."""
+    values = registry.counter_values('notification_fanout_total')
+    return {
+        'sent': values.get((('result', 'sent'),), 0),
+        'skipped_offline': values.get((('result', 'skipped_offline'),), 0),
+    }
+
+
+# The count is per user, not per connection. A crashed worker never
+# decrements it, but it also stops refreshing the TTL, so the key expires
+# and the user drops back to offline. Only atomic incr/decr change it: a
+# count that reaches 0 is left for the TTL, since deleting it could drop a
+# connect that landed in between.
+
+def mark_connected(user_id):
+    ttl = get_presence_settings()['TTL']
+    key = presence_key(user_id)
+    if not cache.add(key, 1, ttl):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr().
+            cache.add(key, 1, ttl)
+    cache.touch(key, ttl)
+
+
+def mark_disconnected(user_id):
+    key = presence_key(user_id)
+    try:
+        remaining = cache.decr(key)
+    except ValueError:
+        return
+    if remaining < 0:
+        # More disconnects than connects counted (the key expired and was
+        # re-added by a heartbeat); take ours back rather than go negative.
+        cache.incr(key)
+
+
+def refresh(user_id):
+    ttl = get_presence_settings()['TTL']
+    key = presence_key(user_id)
+    if not cache.touch(key, ttl):
+        cache.add(key, 1, ttl)
+
+
+def is_online(user_id):
+    return (cache.get(presence_key(user_id)) or 0) > 0
+
+
+async def amark_connected(user_id):
+    ttl = get_presence_settings()['TTL']
+    key = presence_key(user_id)
+    if not await cache.aadd(key, 1, ttl):
+        try:
+            await cache.aincr(key)
+        except ValueError:
+            await cache.aadd(key, 1, ttl)
+    await cache.atouch(key, ttl)
+
+
+async def amark_disconnected(user_id):
+    key = presence_key(user_id)
+    try:
+        remaining = await cache.adecr(key)
+    except ValueError:
+        return
+    if remaining < 0:
+        await cache.aincr(key)
+
+
+async def arefresh(user_id):
+    ttl = get_presence_settings()['TTL']
+    key = presence_key(user_id)
+    if not await cache.atouch(key, ttl):
+        await cache.aadd(key, 1, ttl)
+
+
+async def ais_online(user_id):
+    return (await cache.aget(presence_key(user_id)) or 0) > 0
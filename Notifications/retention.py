@@ -0,0 +1,156 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Notification
+
+DEFAULTS = {
+    'MAX_PER_USER': 500,
+    'MAX_AGE_DAYS': 180,
+    'COMPACT_READ_AFTER_DAYS': 30,
+    'BATCH_SIZE': 1000,
+    'BATCH_SLEEP': 0.05,
+    'TIME_LIMIT': 300,
+}
+
+
+def get_retention_settings(**overrides):
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'NOTIFICATION_RETENTION', {}))
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    return config
+
+
+def summary_message(count):
+    return f"{count} older read notifications were archived."
+
+
+class RetentionRun:
+    """
+    Deletes notifications in small batches, each in its own short transaction,
+    so no statement holds locks on more than BATCH_SIZE rows. Every phase stops
+    once TIME_LIMIT is used up; the next run continues where this one left off.
+    """
+
+    def __init__(self, dry_run=False, **overrides):
+        self.config = get_retention_settings(**overrides)
+        self.dry_run = dry_run
+        self.deadline = time.monotonic() + self.config['TIME_LIMIT']
+        self.stats = {'compacted': 0, 'expired': 0, 'over_cap': 0}
+
+    def out_of_time(self):
+        return time.monotonic() >= self.deadline
+
+    def run(self):
+        now = timezone.now()
+        if self.config['COMPACT_READ_AFTER_DAYS']:
+            self.compact_read(now - timedelta(days=self.config['COMPACT_READ_AFTER_DAYS']))
+        if self.config['MAX_AGE_DAYS']:
+            self.purge_expired(now - timedelta(days=self.config['MAX_AGE_DAYS']))
+        if self.config['MAX_PER_USER']:
+            self.enforce_user_cap(self.config['MAX_PER_USER'])
+        return self.stats
+
+    def _pause(self):
+        if self.config['BATCH_SLEEP']:
+            time.sleep(self.config['BATCH_SLEEP'])
+
+    def _delete_in_batches(self, queryset):
+        if self.dry_run:
+            return queryset.count()
+        batch_size = self.config['BATCH_SIZE']
+        deleted = 0
+        while not self.out_of_time():
+            ids = list(queryset.order_by('created_at').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                count, _ = Notification.objects.filter(id__in=ids).delete()
+            deleted += count
+            if len(ids) < batch_size:
+                break
+            self._pause()
+        return deleted
+
+    def compact_read(self, cutoff):
+        """Fold read notifications older than cutoff into one summary row per user."""
+        candidates = Notification.objects.filter(is_read=True, is_summary=False, created_at__lt=cutoff)
+        user_ids = candidates.order_by('user_id').values_list('user_id', flat=True).distinct()
+        batch_size = self.config['BATCH_SIZE']
+
+        for user_id in user_ids.iterator():
+            if self.dry_run:
+                self.stats['compacted'] += candidates.filter(user_id=user_id).count()
+                continue
+            while not self.out_of_time():
+                with transaction.atomic():
+                    rows = list(
+                        candidates.filter(user_id=user_id)
+                        .order_by('created_at')
+                        .values_list('id', 'created_at')[:batch_size]
+                    )
+                    if not rows:
+                        break
+                    ids = [row_id for row_id, _ in rows]
+                    # The summary sits where the oldest row it stands for was,
+                    # not at the top of the inbox.
+                    oldest = rows[0][1]
+                    count, _ = Notification.objects.filter(id__in=ids).delete()
+                    summary = (
+                        Notification.objects.select_for_update()
+                        .filter(user_id=user_id, is_summary=True)
+                        .first()
+                    )
+                    if summary is None:
+                        summary = Notification.objects.create(
+                            user_id=user_id,
+                            is_summary=True,
+                            is_read=True,
+                            summarized_count=count,
+                            message=summary_message(count),
+                        )
+                        # created_at is auto_now_add, so it's set after the insert.
+                        Notification.objects.filter(id=summary.id).update(created_at=oldest)
+                    else:
+                        summary.summarized_count += count
+                        summary.message = summary_message(summary.summarized_count)
+                        summary.created_at = min(summary.created_at, oldest)
+                        summary.save(update_fields=['summarized_count', 'message', 'created_at'])
+                self.stats['compacted'] += count
+                if len(ids) < batch_size:
+                    break
+                self._pause()
+            if self.out_of_time():
+                break
+
+    def purge_expired(self, cutoff):
+        queryset = Notification.objects.filter(is_summary=False, created_at__lt=cutoff)
+        self.stats['expired'] += self._delete_in_batches(queryset)
+
+    def enforce_user_cap(self, cap):
+        over_cap = (
+            Notification.objects.filter(is_summary=False)
+            .order_by()
+            .values('user_id')
+            .annotate(total=Count('id'))
+            .filter(total__gt=cap)
+        )
+        for row in over_cap.iterator():
+            if self.out_of_time():
+                break
+            user_notifications = Notification.objects.filter(user_id=row['user_id'], is_summary=False)
+            # (created_at, id) of the oldest row we keep, so rows sharing its
+            # timestamp are cut too; served by notif_user_created_idx.
+            boundary_at, boundary_id = (
+                user_notifications.order_by('-created_at', '-id')
+                .values_list('created_at', 'id')[cap - 1]
+            )
+            self.stats['over_cap'] += self._delete_in_batches(
+                user_notifications.filter(
+                    Q(created_at__lt=boundary_at) | Q(created_at=boundary_at, id__lt=boundary_id)
+                )
+            )
@@ -1,3 +1,442 @@
-from django.test import TestCase
+import datetime
+import time
+from contextlib import contextmanager
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from SaaS_Practice.testing import IN_MEMORY_CHANNEL_LAYERS, LOCMEM_CACHES, make_user
+from services.catalog import catalog_generation
+from . import outbox, presence
+from .consumers import NotificationConsumer
+from .models import Notification, OutboxEvent
+from .retention import RetentionRun
+from .utils import _BackgroundLoop, asend_to_user, send_to_user
+
+FAILING = 'Notifications.tests.fail'
+
+
+def fail(payload):
+    raise RuntimeError(f"no {payload['to']}")
+
+
+def record_depth(payload):
+    # How many atomic blocks the handler runs in; see test_handlers_run_outside_the_claim.
+    depths.append(len(connection.savepoint_ids))
+
+
+depths = []
+
+
+def write_then_fail(payload):
+    outbox.emit('CartChanged', {'subscriptions': []})
+    transaction.on_commit(lambda: mail.send_mail('Sent', '', None, [payload['to']]))
+    raise IntegrityError('duplicate')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class OutboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.approved = {'user_id': 1, 'email': 'vendor@example.com', 'set_password_url': 'https://example.com/set'}
+
+    def test_dispatches_in_order_and_once(self):
+        outbox.emit('UserApproved', self.approved)
+        generation = catalog_generation()
+        outbox.emit('ProductChanged', {'products': {}})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(outbox.dispatch(), (2, 0))
+        self.assertEqual([message.to for message in mail.outbox], [['vendor@example.com']])
+        self.assertIn('https://example.com/set', mail.outbox[0].body)
+        self.assertNotEqual(catalog_generation(), generation)
+        self.assertFalse(OutboxEvent.objects.filter(dispatched_at__isnull=True).exists())
+
+        self.assertEqual(outbox.dispatch(), (0, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_batch_size(self):
+        for _ in range(3):
+            outbox.emit('CartChanged', {'subscriptions': []})
+        self.assertEqual(outbox.dispatch(batch_size=2), (2, 0))
+        self.assertEqual(outbox.dispatch(batch_size=2), (1, 0))
+
+    def test_failed_events_are_retried_up_to_max_attempts(self):
+        handlers = {**outbox.DEFAULTS['HANDLERS'], 'Broken': FAILING}
+        event = outbox.emit('Broken', {'to': 'anyone'})
+        outbox.emit('UserApproved', self.approved)
+        with override_settings(OUTBOX={'HANDLERS': handlers, 'MAX_ATTEMPTS': 2}), \
+                self.assertLogs('Notifications.outbox', 'ERROR') as logs:
+            # A failure doesn't hold up the events after it.
+            self.assertEqual(outbox.dispatch(), (1, 1))
+            self.assertEqual(outbox.dispatch(), (0, 1))
+            self.assertEqual(outbox.dispatch(), (0, 0))
+        self.assertEqual(len(logs.records), 2)
+        event.refresh_from_db()
+        self.assertEqual((event.attempts, event.dispatched_at), (2, None))
+        self.assertEqual(event.last_error, 'RuntimeError: no anyone')
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_a_failing_handler_only_rolls_back_its_own_writes(self):
+        handlers = {**outbox.DEFAULTS['HANDLERS'], 'Broken': 'Notifications.tests.write_then_fail'}
+        outbox.emit('UserApproved', self.approved)
+        broken = outbox.emit('Broken', {'to': 'anyone@example.com'})
+        outbox.emit('UserApproved', self.approved)
+        with override_settings(OUTBOX={'HANDLERS': handlers}), self.assertLogs('Notifications.outbox', 'ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(outbox.dispatch(), (2, 1))
+        self.assertEqual([message.to for message in mail.outbox], [['vendor@example.com']] * 2)
+        self.assertEqual(OutboxEvent.objects.count(), 3)
+        broken.refresh_from_db()
+        self.assertEqual((broken.attempts, broken.last_error), (1, 'IntegrityError: duplicate'))
+
+    def test_handlers_run_outside_the_claim(self):
+        handlers = {**outbox.DEFAULTS['HANDLERS'], 'Probe': 'Notifications.tests.record_depth'}
+        outbox.emit('Probe', {})
+        depths.clear()
+        with transaction.atomic():
+            outside = len(connection.savepoint_ids)
+        with override_settings(OUTBOX={'HANDLERS': handlers}):
+            self.assertEqual(outbox.dispatch(), (1, 0))
+        # Only the handler's own transaction, not the claim's around it.
+        self.assertEqual(depths, [outside])
+
+    def test_leased_events_wait_for_the_lease_to_expire(self):
+        event = outbox.emit('UserApproved', self.approved)
+        config = outbox.get_outbox_settings()
+        self.assertEqual(outbox.claim(10, config), [event])   # another worker
+        self.assertEqual(outbox.dispatch(), (0, 0))
+        self.assertEqual(len(mail.outbox), 0)
+
+        OutboxEvent.objects.filter(id=event.id).update(leased_until=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(outbox.dispatch(), (1, 0))
+        event.refresh_from_db()
+        self.assertEqual((event.attempts, event.leased_until), (2, None))
+
+    def test_sent_events_are_not_rolled_back_if_marking_fails(self):
+        event = outbox.emit('UserApproved', self.approved)
+        calls = []
+        real_bulk_update = OutboxEvent.objects.bulk_update
+
+        def bulk_update(*args, **kwargs):
+            # The claim goes through; marking the batch afterwards doesn't.
+            calls.append(args)
+            if len(calls) > 1:
+                raise RuntimeError('gone')
+            return real_bulk_update(*args, **kwargs)
+
+        with mock.patch.object(OutboxEvent.objects, 'bulk_update', bulk_update):
+            with self.assertRaises(RuntimeError):
+                outbox.dispatch()
+        self.assertEqual(len(mail.outbox), 1)
+        # Still leased: sent again only if nobody marks it before the lease runs out.
+        event.refresh_from_db()
+        self.assertIsNone(event.dispatched_at)
+        self.assertGreater(event.leased_until, timezone.now())
+        self.assertEqual(outbox.dispatch(), (0, 0))
+
+    def test_ordered_kinds_wait_for_the_worker_ahead(self):
+        first = outbox.emit('ProductChanged', {'products': {}})
+        config = outbox.get_outbox_settings()
+        self.assertEqual(outbox.claim(1, config), [first])     # another worker
+        outbox.emit('ProductChanged', {'products': {}})
+        outbox.emit('UserApproved', self.approved)
+        # The second diff can't overtake the first; the email can go.
+        self.assertEqual(outbox.dispatch(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        OutboxEvent.objects.filter(id=first.id).update(leased_until=None, dispatched_at=timezone.now())
+        self.assertEqual(outbox.dispatch(), (1, 0))
+
+    def test_purge_keeps_recent_and_pending_events(self):
+        old, recent, pending = [outbox.emit('CartChanged', {'subscriptions': []}) for _ in range(3)]
+        OutboxEvent.objects.filter(id=old.id).update(dispatched_at=timezone.now() - datetime.timedelta(days=8))
+        OutboxEvent.objects.filter(id=recent.id).update(dispatched_at=timezone.now())
+        self.assertEqual(outbox.purge(), 1)
+        self.assertEqual(set(OutboxEvent.objects.values_list('id', flat=True)), {recent.id, pending.id})
+
+    def test_command_drains_the_outbox(self):
+        for _ in range(3):
+            outbox.emit('UserApproved', self.approved)
+        out = StringIO()
+        call_command('dispatch_outbox', '--once', '--batch-size', '2', stdout=out)
+        self.assertIn('Dispatched 3 events, 0 failed.', out.getvalue())
+        self.assertEqual(len(mail.outbox), 3)
+
+
+class RetentionTests(TestCase):
+    # Each phase on its own unless a test turns it on.
+    OFF = {'MAX_PER_USER': 0, 'MAX_AGE_DAYS': 0, 'COMPACT_READ_AFTER_DAYS': 0, 'BATCH_SLEEP': 0}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('customer@example.com')
+        cls.other = make_user('other@example.com')
+
+    def notify(self, days_ago, is_read=False, user=None, count=1):
+        now = timezone.now()
+        for i in range(count):
+            notification = Notification.objects.create(user=user or self.user, message='Hi', is_read=is_read)
+            # Distinct times, newest first, like real notifications.
+            created_at = now - datetime.timedelta(days=days_ago, minutes=i)
+            Notification.objects.filter(id=notification.id).update(created_at=created_at)
+
+    def run_retention(self, **config):
+        run = RetentionRun(**{**self.OFF, **config})
+        return run.run()
+
+    def deletes(self, queries):
+        return [query['sql'] for query in queries.captured_queries if query['sql'].startswith('DELETE')]
+
+    def test_compacts_old_read_notifications_into_one_summary(self):
+        self.notify(40, is_read=True, count=5)
+        oldest = Notification.objects.filter(user=self.user).earliest('created_at').created_at
+        self.notify(10, is_read=True)   # too recent
+        self.notify(40)                 # unread
+        self.notify(40, is_read=True, user=self.other)
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = self.run_retention(COMPACT_READ_AFTER_DAYS=30, BATCH_SIZE=2)
+        self.assertEqual(stats, {'compacted': 6, 'expired': 0, 'over_cap': 0})
+        # 2 + 2 + 1 for the first user, 1 for the other.
+        self.assertEqual(len(self.deletes(queries)), 4)
+
+        summary = Notification.objects.get(user=self.user, is_summary=True)
+        self.assertEqual((summary.summarized_count, summary.message), (5, '5 older read notifications were archived.'))
+        # Where the oldest of them was, below the user's newer notifications.
+        self.assertEqual(summary.created_at, oldest)
+        self.assertEqual(Notification.objects.filter(user=self.user).last(), summary)
+        self.assertEqual(Notification.objects.filter(user=self.user, is_summary=False).count(), 2)
+
+        # A later run adds to the same summary.
+        self.notify(40, is_read=True, count=2)
+        self.run_retention(COMPACT_READ_AFTER_DAYS=30)
+        summary.refresh_from_db()
+        self.assertEqual(summary.summarized_count, 7)
+        self.assertEqual(Notification.objects.filter(user=self.user, is_summary=True).count(), 1)
+
+    def test_expires_notifications_past_the_cutoff_in_batches(self):
+        self.notify(200, count=5)
+        self.notify(170)
+        Notification.objects.create(user=self.user, message='summary', is_summary=True, is_read=True)
+        Notification.objects.filter(is_summary=True).update(created_at=timezone.now() - datetime.timedelta(days=400))
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = self.run_retention(MAX_AGE_DAYS=180, BATCH_SIZE=2)
+        self.assertEqual(stats['expired'], 5)
+        self.assertEqual(len(self.deletes(queries)), 3)
+        # The summary stays however old it is.
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 2)
+
+    def test_caps_notifications_per_user_keeping_the_newest(self):
+        self.notify(1, count=5)
+        self.notify(1, user=self.other, count=2)
+        newest = list(Notification.objects.filter(user=self.user).order_by('-created_at').values_list('id', flat=True))
+
+        stats = self.run_retention(MAX_PER_USER=3, BATCH_SIZE=1)
+        self.assertEqual(stats['over_cap'], 2)
+        self.assertEqual(list(Notification.objects.filter(user=self.user).values_list('id', flat=True)), newest[:3])
+        self.assertEqual(Notification.objects.filter(user=self.other).count(), 2)
+
+    def test_cap_breaks_timestamp_ties(self):
+        self.notify(1, count=5)
+        Notification.objects.filter(user=self.user).update(created_at=timezone.now())
+        stats = self.run_retention(MAX_PER_USER=3)
+        self.assertEqual(stats['over_cap'], 2)
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 3)
+
+    def test_dry_run_only_counts(self):
+        self.notify(40, is_read=True, count=2)
+        self.notify(200, count=3)
+        out = StringIO()
+        call_command('purge_notifications', '--dry-run', '--max-per-user', '1', '--batch-sleep', '0', stdout=out)
+        self.assertIn('Would remove: 2 compacted, 3 expired, 4 over per-user cap.', out.getvalue())
+        self.assertEqual(Notification.objects.count(), 5)
+        self.assertFalse(Notification.objects.filter(is_summary=True).exists())
+
+    def test_stops_at_the_time_limit(self):
+        self.notify(200, count=3)
+        out = StringIO()
+        call_command('purge_notifications', '--time-limit', '0', stdout=out)
+        self.assertIn('Removed: 0 compacted, 0 expired, 0 over per-user cap.', out.getvalue())
+        self.assertIn('Time limit reached; run again to continue.', out.getvalue())
+        self.assertEqual(Notification.objects.count(), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class PresenceTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('customer@example.com')
+
+    def setUp(self):
+        cache.clear()
+
+    def connection_count(self):
+        return cache.get(presence.presence_key(self.user.id))
+
+    @contextmanager
+    def later(self, seconds):
+        """Run the cache's clock seconds ahead."""
+        now = time.time()
+        clock = SimpleNamespace(time=lambda: now + seconds)
+        with mock.patch('django.core.cache.backends.base.time', clock), \
+                mock.patch('django.core.cache.backends.locmem.time', clock):
+            yield
+
+    def skipped(self):
+        return presence.fanout_metrics()['skipped_offline']
+
+    def test_counts_connections(self):
+        presence.mark_connected(self.user.id)
+        presence.mark_connected(self.user.id)
+        self.assertEqual(self.connection_count(), 2)
+        presence.mark_disconnected(self.user.id)
+        self.assertTrue(presence.is_online(self.user.id))
+        presence.mark_disconnected(self.user.id)
+        self.assertFalse(presence.is_online(self.user.id))
+        # Left at 0 for the TTL, so a connect racing the last disconnect still counts.
+        self.assertEqual(self.connection_count(), 0)
+        presence.mark_connected(self.user.id)
+        self.assertEqual(self.connection_count(), 1)
+
+    def test_extra_disconnects_do_not_go_negative(self):
+        presence.mark_connected(self.user.id)
+        presence.mark_disconnected(self.user.id)
+        presence.mark_disconnected(self.user.id)
+        self.assertEqual(self.connection_count(), 0)
+        presence.mark_connected(self.user.id)
+        self.assertTrue(presence.is_online(self.user.id))
+        cache.delete(presence.presence_key(self.user.id))
+        presence.mark_disconnected(self.user.id)  # already gone
+        self.assertFalse(presence.is_online(self.user.id))
+        self.assertIsNone(self.connection_count())
+
+    def test_expires_without_a_refresh(self):
+        ttl = presence.get_presence_settings()['TTL']
+        presence.mark_connected(self.user.id)
+        with self.later(ttl + 1):
+            self.assertFalse(presence.is_online(self.user.id))
+            # A heartbeat from a socket that outlived the key brings it back.
+            presence.refresh(self.user.id)
+            self.assertEqual(self.connection_count(), 1)
+
+    def test_sends_to_offline_users_are_skipped(self):
+        skipped = self.skipped()
+        self.assertIsNone(send_to_user(self.user.id, 'Hi'))
+        self.assertEqual(self.skipped(), skipped + 1)
+
+        presence.mark_connected(self.user.id)
+        future = send_to_user(self.user.id, 'Hi')
+        self.assertIsNotNone(future)
+        future.result(timeout=5)
+        self.assertEqual(self.skipped(), skipped + 1)
+
+    async def test_socket_lifecycle(self):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/')
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertTrue(await presence.ais_online(self.user.id))
+
+        self.assertTrue(await asend_to_user(self.user.id, 'Hello'))
+        self.assertEqual(await communicator.receive_json_from(), {'message': 'Hello'})
+        await communicator.send_json_to({'type': 'heartbeat'})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'heartbeat'})
+
+        await communicator.disconnect()
+        self.assertFalse(await presence.ais_online(self.user.id))
+        skipped = self.skipped()
+        self.assertFalse(await asend_to_user(self.user.id, 'Hello'))
+        self.assertEqual(self.skipped(), skipped + 1)
+
+    async def test_anonymous_sockets_are_refused(self):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/')
+        communicator.scope['user'] = AnonymousUser()
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+
+async def answer(value):
+    return value
+
+
+async def explode():
+    raise RuntimeError('boom')
+
+
+class BackgroundLoopTests(SimpleTestCase):
+
+    def setUp(self):
+        self.background = _BackgroundLoop('test-loop')
+        self.addCleanup(self.background.shutdown)
+
+    def test_submissions_share_one_loop(self):
+        self.assertEqual(self.background.submit(answer(1)).result(timeout=1), 1)
+        loop, thread = self.background._loop, self.background._thread
+        self.assertEqual(self.background.submit(answer(2)).result(timeout=1), 2)
+        self.assertIs(self.background._loop, loop)
+        self.assertIs(self.background._thread, thread)
+        self.assertEqual(thread.name, 'test-loop')
+
+    def test_loop_is_recreated_after_fork(self):
+        self.background.submit(answer(1)).result(timeout=1)
+        parent_loop, parent_thread = self.background._loop, self.background._thread
+
+        # The child sees a new pid and none of the parent's threads.
+        with mock.patch('Notifications.utils.os.getpid', return_value=-1):
+            self.assertEqual(self.background.submit(answer(2)).result(timeout=1), 2)
+            child_loop, child_thread = self.background._loop, self.background._thread
+            self.assertIsNot(child_loop, parent_loop)
+            self.assertIsNot(child_thread, parent_thread)
+            self.background.shutdown()
+        self.assertFalse(child_thread.is_alive())
+        self.assertTrue(child_loop.is_closed())
+        parent_loop.call_soon_threadsafe(parent_loop.stop)
+        parent_thread.join(1)
+        parent_loop.close()
+
+    def test_shutdown_stops_the_thread(self):
+        self.background.submit(answer(1)).result(timeout=1)
+        loop, thread = self.background._loop, self.background._thread
+
+        self.background.shutdown()
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(loop.is_closed())
+        self.background.shutdown()
+
+        # A later submit starts a fresh loop.
+        self.assertEqual(self.background.submit(answer(2)).result(timeout=1), 2)
+        self.assertIsNot(self.background._loop, loop)
+        self.assertTrue(self.background._thread.is_alive())
+
+    def test_forked_child_leaves_the_parent_loop_alone(self):
+        self.background.submit(answer(1)).result(timeout=1)
+        loop, thread = self.background._loop, self.background._thread
+
+        with mock.patch('Notifications.utils.os.getpid', return_value=-1):
+            self.background.shutdown()
+        self.assertTrue(thread.is_alive())
+        self.assertFalse(loop.is_closed())
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(1)
+        loop.close()
+
+    def test_failures_are_logged(self):
+        with self.assertLogs('Notifications.utils', 'ERROR') as logs:
+            future = self.background.submit(explode())
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=1)
+            # The done callback runs on the loop thread, after result() returns.
+            self.background.shutdown()
+        self.assertIn('Notification fan-out failed', logs.output[0])
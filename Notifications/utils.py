@@ -1,19 +1,151 @@
 # notifications/utils.py
 
+import asyncio
+import atexit
+import logging
+import os
+import threading
+
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from . import outbox, presence
 from .models import Notification  # optional DB model
 
-def send_notification(user, message):
-    
-    Notification.objects.create(user=user, message=message)
+logger = logging.getLogger(__name__)
+
+# Seconds an outbox handler waits for its channel-layer send.
+DELIVERY_TIMEOUT = 10
+
+
+def _group_name(user_id):
+    return f"user_{user_id}"
+
+
+def _notify_event(message):
+    return {
+        "type": "notify",
+        "message": message,
+    }
+
+
+class _BackgroundLoop:
+    """
+    One long-lived event loop per process, running in a daemon thread.
+
+    Sync callers submit coroutines here instead of wrapping every call in
+    async_to_sync, which spins up a fresh loop (and, with channels_redis,
+    a fresh connection pool) each time.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+
+    def _get_loop(self):
+        # Re-create after a fork: the thread does not survive into the child.
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name=self._name, daemon=True)
+                thread.start()
+                self._loop = loop
+                self._thread = thread
+                self._pid = os.getpid()
+        return self._loop
+
+    def submit(self, coro):
+        future = asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+        future.add_done_callback(_log_failure)
+        return future
+
+    def shutdown(self, timeout=5):
+        """Stop the loop and join its thread; a later submit starts a new one."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            # A forked child never owned the parent's thread; just forget it.
+            owned = loop is not None and self._pid == os.getpid()
+            self._loop = self._thread = self._pid = None
+        if not owned:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Notification fan-out failed", exc_info=future.exception())
+
+
+_background_loop = _BackgroundLoop("notifications-loop")
+atexit.register(_background_loop.shutdown)
 
 
+def submit_background(coro):
+    """Run a coroutine on the shared background loop from sync code."""
+    return _background_loop.submit(coro)
+
+
+async def _group_send(user_id, message):
     channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"user_{user.id}",
-        {
-            "type": "notify",
-            "message": message,
-        }
+    await channel_layer.group_send(_group_name(user_id), _notify_event(message))
+    presence.record_fanout(sent=True)
+
+
+# Async API (use these from consumers and async views)
+
+async def asend_to_user(user_id, message):
+    # Offline users have no socket in the group; the stored row is enough.
+    if not await presence.ais_online(user_id):
+        presence.record_fanout(sent=False)
+        return False
+    await _group_send(user_id, message)
+    return True
+
+
+async def asend_notification(user, message):
+    notification = await Notification.objects.acreate(user=user, message=message)
+    await asend_to_user(user.id, message)
+    return notification
+
+
+async def asend_notifications(users, message):
+    notifications = await Notification.objects.abulk_create(
+        [Notification(user=user, message=message) for user in users]
     )
+    await asyncio.gather(*(asend_to_user(user.id, message) for user in users))
+    return notifications
+
+
+# Sync API (views, admin actions, management commands)
+
+def send_to_user(user_id, message):
+    """
+    Queue the channel-layer send; returns a concurrent.futures.Future, or
+    None when the user is offline and nothing was queued.
+    """
+    if not presence.is_online(user_id):
+        presence.record_fanout(sent=False)
+        return None
+    return _background_loop.submit(_group_send(user_id, message))
+
+
+def send_notification(user, message):
+    # The row and the fan-out's outbox event are written on the caller's
+    # connection, so they join any open transaction; the fan-out itself is
+    # run by the outbox dispatcher once it commits.
+    notification = Notification.objects.create(user=user, message=message)
+    outbox.emit('UserNotified', {'user_id': str(user.id), 'message': message})
+    return notification
+
+
+def deliver_notification(payload):
+    """Outbox handler for UserNotified."""
+    future = send_to_user(payload['user_id'], payload['message'])
+    if future is not None:
+        future.result(timeout=DELIVERY_TIMEOUT)
@@ -11,19 +11,22 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SaaS_Practice.settings')
+
+# Initialise Django before importing consumers, which import models.
+django_asgi_app = get_asgi_application()
+
 from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 import Notifications.routing
-
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SaaS_Practice.settings')
+import services.routing
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             Notifications.routing.websocket_urlpatterns
+            + services.routing.websocket_urlpatterns
         )
     ),
 })
-
-
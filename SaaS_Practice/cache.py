@@ -0,0 +1,392 @@
+"""
+Cache backends.
+
+InstrumentedRedisCache is django_redis with hit/miss counting for the
+per-view metrics. TwoLevelRedisCache puts a bounded in-process LRU (L1) in
+front of it for a configured set of hot keys, such as the product list,
+so those are served from worker memory without a network round trip or
+unpickling. Every write or delete of an L1 key is broadcast on a Redis
+pub/sub channel and every worker drops its copy.
+
+    "OPTIONS": {
+        "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        "LOCAL_KEY_PREFIXES": ["product_list"],  # only these keys use L1
+        "LOCAL_MAX_ENTRIES": 256,
+        "LOCAL_TTL": 60,          # upper bound on L1 staleness if a message is lost
+        "INVALIDATION_BUS": "redis",  # or "local" (one process, for tests)
+        "INVALIDATION_CHANNEL": "cache-invalidation",
+        "LOCAL_NAME": "default",  # backends sharing a name share one L1 per process
+    }
+
+Django builds a backend instance per thread (and per async context), so the
+L1 and its subscription live in a LocalTier shared by every instance with
+the same LOCAL_NAME in the process.
+
+Values served from L1 are shared between requests: treat them as
+read-only. Counters, locks and anything else that must be exact across
+workers (throttles, presence, pins) should stay out of LOCAL_KEY_PREFIXES.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django_redis.cache import RedisCache
+
+from .metrics import record_cache_lookup, registry
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class InstrumentedCacheMixin:
+    """Counts get() hits and misses for the per-view metrics."""
+
+    def get(self, key, default=None, version=None, **kwargs):
+        value = super().get(key, _MISSING, version=version, **kwargs)
+        if value is _MISSING:
+            record_cache_lookup(hit=False)
+            return default
+        record_cache_lookup(hit=True)
+        return value
+
+
+class InstrumentedRedisCache(InstrumentedCacheMixin, RedisCache):
+    pass
+
+
+class LRUCache:
+    """A thread-safe, size-bounded mapping whose entries expire after a TTL."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def discard(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LocalInvalidationBus:
+    """
+    In-process stand-in for Redis pub/sub. Caches configured with the same
+    channel share one bus, so tests can run several "workers" side by side.
+    """
+    _buses = {}
+    _buses_lock = threading.Lock()
+
+    @classmethod
+    def for_channel(cls, channel):
+        with cls._buses_lock:
+            if channel not in cls._buses:
+                cls._buses[channel] = cls()
+            return cls._buses[channel]
+
+    def __init__(self):
+        self._subscribers = []
+
+    @property
+    def ready(self):
+        return True
+
+    def subscribe(self, origin, callback):
+        self._subscribers.append((origin, callback))
+
+    def publish(self, origin, keys):
+        """keys=None means drop everything."""
+        for subscriber, callback in list(self._subscribers):
+            if subscriber != origin:
+                callback(keys)
+
+
+class RedisInvalidationBus:
+    """
+    Redis pub/sub with one listener thread per process. Delivery is
+    at-most-once, so the listener drops all of L1 whenever its connection
+    breaks, and L1 is only filled while the subscription is up.
+    """
+    RECONNECT_DELAY = 1.0
+    _buses = {}
+    _buses_lock = threading.Lock()
+
+    @classmethod
+    def for_channel(cls, channel, get_client):
+        with cls._buses_lock:
+            if channel not in cls._buses:
+                cls._buses[channel] = cls(get_client, channel)
+            return cls._buses[channel]
+
+    def __init__(self, get_client, channel):
+        self._get_client = get_client
+        self.channel = channel
+        self._subscribers = []
+        self._pid = None
+        self._connected = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        self._ensure_listener()
+        return self._connected.is_set()
+
+    def subscribe(self, origin, callback):
+        # The listener starts on the first L1 lookup, not at import time.
+        self._subscribers.append((origin, callback))
+
+    def publish(self, origin, keys):
+        try:
+            self._get_client().publish(self.channel, json.dumps({'origin': origin, 'keys': keys}))
+        except Exception:
+            logger.exception("Could not publish cache invalidation on %s", self.channel)
+
+    def _ensure_listener(self):
+        # A forked worker inherits the pid but not the thread.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._connected.clear()
+            threading.Thread(target=self._listen, name='cache-invalidation', daemon=True).start()
+
+    def _notify(self, origin, keys):
+        for subscriber, callback in list(self._subscribers):
+            if subscriber != origin:
+                callback(keys)
+
+    def _listen(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = self._get_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self._connected.set()
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None or message['type'] != 'message':
+                        continue
+                    payload = json.loads(message['data'])
+                    self._notify(payload['origin'], payload['keys'])
+            except Exception as exc:
+                logger.warning("Cache invalidation listener on %s disconnected (%s); retrying", self.channel, exc)
+            finally:
+                self._connected.clear()
+                # Messages may have been missed while disconnected.
+                self._notify(None, None)
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            time.sleep(self.RECONNECT_DELAY)
+
+
+class LocalTier:
+    """One process's L1 for a LOCAL_NAME, subscribed to invalidations once."""
+    _tiers = {}
+    _tiers_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name, max_entries, bus):
+        with cls._tiers_lock:
+            if name not in cls._tiers:
+                cls._tiers[name] = cls(max_entries, bus)
+            return cls._tiers[name]
+
+    def __init__(self, max_entries, bus):
+        self.entries = LRUCache(max_entries)
+        self.bus = bus
+        self.origin = uuid.uuid4().hex
+        # Bumped by every invalidation; a fill that raced one is not kept.
+        self.epoch = 0
+        bus.subscribe(self.origin, self.invalidated)
+
+    def invalidated(self, keys):
+        self.epoch += 1
+        if keys is None:
+            self.entries.clear()
+        else:
+            self.entries.discard(keys)
+
+    def invalidate(self, keys):
+        self.invalidated(keys)
+        self.bus.publish(self.origin, keys)
+
+
+class TwoLevelCacheMixin:
+    """
+    L1 in front of any cache backend for keys matching LOCAL_KEY_PREFIXES.
+    Reads check L1 first; every write, delete, incr or touch of such a key
+    goes to the backend, drops the local copy and is broadcast to the
+    other workers.
+    """
+
+    def __init__(self, server, params):
+        params = dict(params)
+        options = dict(params.get('OPTIONS') or {})
+        self.local_prefixes = tuple(options.pop('LOCAL_KEY_PREFIXES', ()))
+        self.local_ttl = options.pop('LOCAL_TTL', 60)
+        max_entries = options.pop('LOCAL_MAX_ENTRIES', 256)
+        bus = options.pop('INVALIDATION_BUS', 'redis')
+        channel = options.pop('INVALIDATION_CHANNEL', 'cache-invalidation')
+        name = options.pop('LOCAL_NAME', 'default')
+        params['OPTIONS'] = options
+        super().__init__(server, params)
+
+        if bus == 'local':
+            bus = LocalInvalidationBus.for_channel(channel)
+        else:
+            bus = RedisInvalidationBus.for_channel(channel, lambda: self.client.get_client(write=True))
+        self.tier = LocalTier.get(name, max_entries, bus)
+
+    def _is_local(self, key):
+        return bool(self.local_prefixes) and str(key).startswith(self.local_prefixes)
+
+    def _local_ttl(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return self.local_ttl
+        return min(timeout, self.local_ttl)
+
+    def _fill_token(self):
+        # Taken before reading the backend: only keep what was read while
+        # subscribed and with no invalidation arriving in between.
+        return self.tier.epoch if self.tier.bus.ready else None
+
+    def _remember(self, key, version, value, timeout, token):
+        ttl = self._local_ttl(timeout)
+        if ttl > 0 and token is not None and token == self.tier.epoch:
+            self.tier.entries.set(self.make_key(key, version=version), value, ttl)
+
+    def _invalidate(self, keys, version=None):
+        made = [self.make_key(key, version=version) for key in keys if self._is_local(key)]
+        if made:
+            self.tier.invalidate(made)
+
+    def _local_get(self, key, version):
+        value = self.tier.entries.get(self.make_key(key, version=version))
+        hit = value is not _MISSING
+        registry.inc('cache_local_requests_total', (('result', 'hit' if hit else 'miss'),))
+        if hit:
+            record_cache_lookup(hit=True)
+        return value
+
+    def get(self, key, default=None, version=None, **kwargs):
+        if not self._is_local(key):
+            return super().get(key, default, version=version, **kwargs)
+        value = self._local_get(key, version)
+        if value is not _MISSING:
+            return value
+        token = self._fill_token()
+        value = super().get(key, _MISSING, version=version, **kwargs)
+        if value is _MISSING:
+            return default
+        # The backend's remaining TTL isn't known here; LOCAL_TTL bounds it.
+        self._remember(key, version, value, None, token)
+        return value
+
+    async def aget(self, key, default=None, version=None):
+        # An L1 hit needs no thread hop; a miss goes through get() as usual.
+        if self._is_local(key):
+            value = self.tier.entries.get(self.make_key(key, version=version))
+            if value is not _MISSING:
+                registry.inc('cache_local_requests_total', (('result', 'hit'),))
+                record_cache_lookup(hit=True)
+                return value
+        return await super().aget(key, default, version=version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, **kwargs):
+        result = super().set(key, value, timeout=timeout, version=version, **kwargs)
+        if self._is_local(key):
+            self._invalidate([key], version)
+            self._remember(key, version, value, timeout, self._fill_token())
+        return result
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, **kwargs):
+        added = super().add(key, value, timeout=timeout, version=version, **kwargs)
+        if added:
+            self._invalidate([key], version)
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, **kwargs):
+        result = super().set_many(data, timeout=timeout, version=version, **kwargs)
+        self._invalidate(data, version)
+        return result
+
+    def delete(self, key, version=None, **kwargs):
+        result = super().delete(key, version=version, **kwargs)
+        self._invalidate([key], version)
+        return result
+
+    def delete_many(self, keys, version=None, **kwargs):
+        keys = list(keys)
+        result = super().delete_many(keys, version=version, **kwargs)
+        self._invalidate(keys, version)
+        return result
+
+    def incr(self, key, delta=1, version=None, **kwargs):
+        result = super().incr(key, delta, version=version, **kwargs)
+        self._invalidate([key], version)
+        return result
+
+    def decr(self, key, delta=1, version=None, **kwargs):
+        result = super().decr(key, delta, version=version, **kwargs)
+        self._invalidate([key], version)
+        return result
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None, **kwargs):
+        result = super().touch(key, timeout=timeout, version=version, **kwargs)
+        self._invalidate([key], version)
+        return result
+
+    def clear(self):
+        result = super().clear()
+        self._invalidate_everything()
+        return result
+
+    def _invalidate_everything(self):
+        self.tier.invalidate(None)
+
+
+class TwoLevelRedisCache(TwoLevelCacheMixin, InstrumentedRedisCache):
+
+    def delete_pattern(self, pattern, **kwargs):
+        result = super().delete_pattern(pattern, **kwargs)
+        self._invalidate_everything()
+        return result
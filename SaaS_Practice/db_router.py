@@ -0,0 +1,170 @@
+"""
+Primary/replica routing with read-your-writes pinning.
+
+Writes always go to the primary. Reads go to a replica only inside a
+request handled by ReplicaPinningMiddleware, and only while nothing has
+pinned that request to the primary:
+
+* any write, select_for_update or get_or_create during the request (the
+  router sees those through db_for_write),
+* an open transaction on the primary,
+* a write by the same client within the last PIN_SECONDS, remembered in
+  the cache so the follow-up GET after a cart or product edit does not
+  read a lagging replica.
+
+Everything outside a request (management commands, the shell, background
+jobs) reads from the primary unless it opts in with use_replicas().
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+DEFAULTS = {
+    'PRIMARY': 'default',
+    'REPLICAS': [],
+    'PIN_SECONDS': 15,   # longer than the worst replication lag we tolerate
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_replica_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'DATABASE_REPLICAS', {}))
+    return config
+
+
+class ReadState:
+    def __init__(self, replica=None, pinned=False):
+        self.replica = replica
+        self.pinned = pinned
+        self.wrote = False
+
+
+# A mutable object rather than a bool: sync_to_async copies the context into
+# worker threads, and a write seen there must still pin the whole request.
+_read_state = ContextVar('db_read_state', default=None)
+
+
+@contextmanager
+def use_replicas(pinned=False):
+    config = get_replica_settings()
+    replica = random.choice(config['REPLICAS']) if config['REPLICAS'] else None
+    state = ReadState(replica, pinned)
+    token = _read_state.set(state)
+    try:
+        yield state
+    finally:
+        _read_state.reset(token)
+
+
+@contextmanager
+def use_primary():
+    token = _read_state.set(None)
+    try:
+        yield
+    finally:
+        _read_state.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        primary = get_replica_settings()['PRIMARY']
+        state = _read_state.get()
+        if state is None or state.pinned or state.replica is None:
+            return primary
+        if connections[primary].in_atomic_block:
+            return primary
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _read_state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return get_replica_settings()['PRIMARY']
+
+    def allow_relation(self, obj1, obj2, **hints):
+        config = get_replica_settings()
+        pool = {config['PRIMARY'], *config['REPLICAS']}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+
+def pin_key(identity):
+    return f"db_pin:{identity}"
+
+
+def client_identity(request):
+    """The JWT's user id when there is a valid one, otherwise the client address."""
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+    if raw_token:
+        try:
+            token = authentication.get_validated_token(raw_token)
+            return f"user:{token[jwt_settings.USER_ID_CLAIM]}"
+        except (InvalidToken, TokenError, KeyError):
+            pass
+    return f"ip:{request.META.get('REMOTE_ADDR')}"
+
+
+class ReplicaPinningMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        config = get_replica_settings()
+        if not config['REPLICAS']:
+            return self.get_response(request)
+
+        identity = client_identity(request)
+        pinned = request.method not in SAFE_METHODS or bool(cache.get(pin_key(identity)))
+        with use_replicas(pinned) as state:
+            response = self.get_response(request)
+
+        if state.wrote:
+            self.pin(request, identity, config)
+        return response
+
+    async def __acall__(self, request):
+        config = get_replica_settings()
+        if not config['REPLICAS']:
+            return await self.get_response(request)
+
+        identity = client_identity(request)
+        pinned = request.method not in SAFE_METHODS or bool(await cache.aget(pin_key(identity)))
+        with use_replicas(pinned) as state:
+            response = await self.get_response(request)
+
+        if state.wrote:
+            # request.user may still be the session middleware's lazy user,
+            # which needs the database to resolve.
+            await sync_to_async(self.pin)(request, identity, config)
+        return response
+
+    def pin(self, request, identity, config):
+        # DRF copies the user it authenticated onto the Django request;
+        # pin that account as well as the identity the request came in as.
+        user = getattr(request, 'user', None)
+        identities = {identity}
+        if user is not None and user.is_authenticated:
+            identities.add(f"user:{user.pk}")
+        cache.set_many({pin_key(each): 1 for each in identities}, config['PIN_SECONDS'])
@@ -0,0 +1,197 @@
+"""
+Idempotency-Key support for retried writes.
+
+A client that may retry a write (mobile apps on a timeout) sends an
+Idempotency-Key header. The first request with a given key runs normally
+and its response is stored in the cache for TTL seconds under the caller's
+identity and the key; a retry gets that stored response back, marked
+Idempotent-Replayed, without the view running again. So a retried "add 2
+to cart" adds 2 once.
+
+While the first request is still running, a short cache lock (add() is
+atomic) makes a concurrent duplicate get 409 with Retry-After instead of
+running the view a second time. Reusing a key for a different request
+(method, path or body) gets 422.
+
+Only completed outcomes are stored: 5xx, 401, 409 and 429 responses are
+worth retrying with the same key, so they are not kept.
+"""
+import hashlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.urls import Resolver404, resolve
+
+from .db_router import client_identity
+from .metrics import registry
+
+DEFAULTS = {
+    'PATH_PREFIXES': ['/Products/'],
+    'METHODS': ['POST', 'PUT', 'PATCH', 'DELETE'],
+    'TTL': 86400,        # how long a key is remembered
+    'LOCK_TIMEOUT': 30,  # longer than the slowest write it guards
+}
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+# Never stored: the same request may well succeed when retried.
+RETRYABLE_STATUSES = {401, 409, 429}
+REPLAYED_HEADERS = ('Content-Type', 'Location', 'Allow')
+
+
+def get_idempotency_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'IDEMPOTENCY', {}))
+    return config
+
+
+def response_key(identity, key):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f"idempotency:{identity}:{digest}"
+
+
+def lock_key(identity, key):
+    return f"{response_key(identity, key)}:lock"
+
+
+def fingerprint(request):
+    digest = hashlib.sha256(request.body)
+    return f"{request.method} {request.get_full_path()} {digest.hexdigest()}"
+
+
+def is_storable(response):
+    return (
+        not response.streaming
+        and response.status_code < 500
+        and response.status_code not in RETRYABLE_STATUSES
+    )
+
+
+def freeze(request_fingerprint, response):
+    return {
+        'fingerprint': request_fingerprint,
+        'status': response.status_code,
+        'headers': {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)},
+        'content': response.content,
+    }
+
+
+def replay(stored):
+    response = HttpResponse(stored['content'], status=stored['status'])
+    for name, value in stored['headers'].items():
+        response[name] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+class IdempotencyMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def applies_to(self, request, config):
+        return (
+            request.method in config['METHODS']
+            and HEADER in request.META
+            and any(request.path.startswith(prefix) for prefix in config['PATH_PREFIXES'])
+        )
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        config = get_idempotency_settings()
+        if not self.applies_to(request, config):
+            return self.get_response(request)
+
+        key = request.META[HEADER].strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return self.invalid_key()
+        identity = client_identity(request)
+        stored_key = response_key(identity, key)
+        # Read the body now; once the view has consumed the stream it's gone.
+        request_fingerprint = fingerprint(request)
+
+        stored = cache.get(stored_key)
+        if stored is not None:
+            return self.replay(request, request_fingerprint, stored)
+
+        if not cache.add(lock_key(identity, key), 1, config['LOCK_TIMEOUT']):
+            # Either a duplicate is running right now, or it finished between
+            # our two reads.
+            stored = cache.get(stored_key)
+            if stored is not None:
+                return self.replay(request, request_fingerprint, stored)
+            return self.in_progress()
+
+        try:
+            response = self.get_response(request)
+            if is_storable(response):
+                cache.set(stored_key, freeze(request_fingerprint, response), config['TTL'])
+                registry.inc('idempotency_requests_total', (('result', 'stored'),))
+        finally:
+            cache.delete(lock_key(identity, key))
+        return response
+
+    async def __acall__(self, request):
+        # __call__ with the cache calls awaited.
+        config = get_idempotency_settings()
+        if not self.applies_to(request, config):
+            return await self.get_response(request)
+
+        key = request.META[HEADER].strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return self.invalid_key()
+        identity = client_identity(request)
+        stored_key = response_key(identity, key)
+        request_fingerprint = fingerprint(request)
+
+        stored = await cache.aget(stored_key)
+        if stored is not None:
+            return self.replay(request, request_fingerprint, stored)
+
+        if not await cache.aadd(lock_key(identity, key), 1, config['LOCK_TIMEOUT']):
+            stored = await cache.aget(stored_key)
+            if stored is not None:
+                return self.replay(request, request_fingerprint, stored)
+            return self.in_progress()
+
+        try:
+            response = await self.get_response(request)
+            if is_storable(response):
+                await cache.aset(stored_key, freeze(request_fingerprint, response), config['TTL'])
+                registry.inc('idempotency_requests_total', (('result', 'stored'),))
+        finally:
+            await cache.adelete(lock_key(identity, key))
+        return response
+
+    def invalid_key(self):
+        return JsonResponse({"error": f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"}, status=400)
+
+    def in_progress(self):
+        registry.inc('idempotency_requests_total', (('result', 'in_progress'),))
+        response = JsonResponse(
+            {"error": "A request with this Idempotency-Key is still being processed"}, status=409
+        )
+        response['Retry-After'] = '1'
+        return response
+
+    def replay(self, request, request_fingerprint, stored):
+        if stored['fingerprint'] != request_fingerprint:
+            registry.inc('idempotency_requests_total', (('result', 'mismatch'),))
+            return JsonResponse(
+                {"error": "Idempotency-Key was already used for a different request"}, status=422
+            )
+        registry.inc('idempotency_requests_total', (('result', 'replayed'),))
+        # So the metrics middleware still attributes the replay to its view.
+        try:
+            request.resolver_match = resolve(request.path_info)
+        except Resolver404:
+            pass
+        return replay(stored)
@@ -0,0 +1,325 @@
+"""
+Process-local request metrics with a Prometheus text endpoint.
+
+Counters and histograms live in plain dicts guarded by one lock, so
+recording costs a few dictionary updates per request. With
+METRICS['MULTIPROC_DIR'] set, each worker periodically writes its
+snapshot to <dir>/metrics-<pid>.json and /metrics merges every file, so
+the numbers add up across gunicorn/uvicorn workers. /metrics answers 403
+unless the request carries METRICS['TOKEN'] as a bearer token or comes
+from one of METRICS['ALLOWED_IPS'].
+"""
+import atexit
+import contextvars
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MULTIPROC_DIR': None,
+    'FLUSH_INTERVAL': 5,  # seconds between snapshot writes per worker
+    # Who may read /metrics: a bearer token, client addresses, or both.
+    'TOKEN': None,
+    'ALLOWED_IPS': [],
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def get_metrics_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'METRICS', {}))
+    return config
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._counters = {}
+        self._histograms = {}
+        self._last_flush = 0.0
+
+    def declare(self, name, kind, help_text, buckets=None):
+        self._meta[name] = {'type': kind, 'help': help_text, 'buckets': buckets}
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = self._meta[name]['buckets']
+        key = (name, labels)
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def counter_values(self, name):
+        with self._lock:
+            return {labels: value for (metric, labels), value in self._counters.items() if metric == name}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [
+                    [name, list(labels), list(entry[0]), entry[1], entry[2]]
+                    for (name, labels), entry in self._histograms.items()
+                ],
+            }
+
+    def flush(self, directory):
+        path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as fh:
+            json.dump(self.snapshot(), fh)
+        os.replace(tmp_path, path)
+        self._last_flush = time.monotonic()
+
+    def maybe_flush(self, directory, interval):
+        if time.monotonic() - self._last_flush >= interval:
+            self.flush(directory)
+
+    def render(self, snapshots):
+        counters = {}
+        histograms = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, bucket_counts, total, count in snapshot['histograms']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                entry = histograms.setdefault(key, [[0] * len(bucket_counts), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], bucket_counts)]
+                entry[1] += total
+                entry[2] += count
+
+        lines = []
+        for name, meta in self._meta.items():
+            lines.append(f"# HELP {name} {meta['help']}")
+            lines.append(f"# TYPE {name} {meta['type']}")
+            if meta['type'] == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            for (metric, labels), (bucket_counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(meta['buckets'], bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+registry = Registry()
+registry.declare('http_requests_total', 'counter', 'Requests by view, method and status.')
+registry.declare('http_request_duration_seconds', 'histogram', 'Request latency by view.', LATENCY_BUCKETS)
+registry.declare('http_db_queries_per_request', 'histogram', 'Database queries per request by view.',
+                 QUERY_COUNT_BUCKETS)
+registry.declare('http_db_query_duration_seconds_total', 'counter', 'Time spent in database queries by view.')
+registry.declare('http_response_size_bytes', 'histogram', 'Response body size by view.', SIZE_BUCKETS)
+registry.declare('cache_requests_total', 'counter', 'Cache lookups by view and result (hit/miss).')
+registry.declare('cache_local_requests_total', 'counter', 'Two-level cache in-process (L1) lookups by result.')
+registry.declare('notification_fanout_total', 'counter', 'Notification channel-layer sends by result.')
+registry.declare('idempotency_requests_total', 'counter', 'Idempotency-Key requests by result (stored/replayed/in_progress/mismatch).')
+
+
+class RequestStats:
+    __slots__ = ('queries', 'query_time', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+_current_stats = contextvars.ContextVar('request_metrics', default=None)
+
+
+def record_cache_lookup(hit):
+    """Called by instrumented cache backends for every get()."""
+    stats = _current_stats.get()
+    if stats is None:
+        registry.inc('cache_requests_total', (('view', 'none'), ('result', 'hit' if hit else 'miss')))
+    elif hit:
+        stats.cache_hits += 1
+    else:
+        stats.cache_misses += 1
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'view_class', None) or getattr(match.func, 'cls', None)
+    if view_class is not None:
+        return view_class.__name__
+    return getattr(match.func, '__name__', match.view_name or 'unknown')
+
+
+def _track_query(execute, sql, params, many, context):
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started
+
+
+def _instrument(connection, **kwargs):
+    """
+    Give a connection the query tracker, once. Connections are per thread,
+    so every one gets it as it connects, in whichever thread runs the
+    request's queries; the request's stats follow the context there.
+    """
+    if _track_query not in connection.execute_wrappers:
+        # First, so execute_wrapper() blocks still pop their own wrapper.
+        connection.execute_wrappers.insert(0, _track_query)
+
+
+connection_created.connect(_instrument)
+for _connection in connections.all(initialized_only=True):
+    _instrument(_connection)
+
+
+@contextmanager
+def _tracking():
+    """Collect the enclosed request's query and cache stats; yields them."""
+    stats = RequestStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+class MetricsMiddleware:
+    """Records latency, query count/time, cache hits and response size per resolved view."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.config = get_metrics_settings()
+        if self.config['MULTIPROC_DIR']:
+            os.makedirs(self.config['MULTIPROC_DIR'], exist_ok=True)
+            atexit.register(registry.flush, self.config['MULTIPROC_DIR'])
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.config['ENABLED']:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        with _tracking() as stats:
+            response = self.get_response(request)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.config['ENABLED']:
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        with _tracking() as stats:
+            response = await self.get_response(request)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, stats, elapsed):
+        view = ('view', _view_name(request))
+        registry.inc('http_requests_total', (view, ('method', request.method), ('status', str(response.status_code))))
+        registry.observe('http_request_duration_seconds', (view,), elapsed)
+        registry.observe('http_db_queries_per_request', (view,), stats.queries)
+        if stats.query_time:
+            registry.inc('http_db_query_duration_seconds_total', (view,), stats.query_time)
+        if stats.cache_hits:
+            registry.inc('cache_requests_total', (view, ('result', 'hit')), stats.cache_hits)
+        if stats.cache_misses:
+            registry.inc('cache_requests_total', (view, ('result', 'miss')), stats.cache_misses)
+
+        if response.streaming:
+            size = int(response.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+        registry.observe('http_response_size_bytes', (view,), size)
+
+        if self.config['MULTIPROC_DIR']:
+            registry.maybe_flush(self.config['MULTIPROC_DIR'], self.config['FLUSH_INTERVAL'])
+
+
+def _may_scrape(request, config):
+    if config['TOKEN']:
+        header = request.headers.get('Authorization', '')
+        if hmac.compare_digest(header.encode(), f"Bearer {config['TOKEN']}".encode()):
+            return True
+    return request.META.get('REMOTE_ADDR') in config['ALLOWED_IPS']
+
+
+def metrics_view(request):
+    config = get_metrics_settings()
+    if not _may_scrape(request, config):
+        return HttpResponseForbidden()
+    directory = config['MULTIPROC_DIR']
+    snapshots = [registry.snapshot()]
+    if directory:
+        own_file = os.path.join(directory, f"metrics-{os.getpid()}.json")
+        for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+            if path == own_file:
+                continue
+            try:
+                with open(path) as fh:
+                    snapshots.append(json.load(fh))
+            except (OSError, ValueError):
+                continue
+    return HttpResponse(registry.render(snapshots), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,34 @@
+try:
+    import orjson
+except ImportError:  # optional: without it FastJSONRenderer is plain JSONRenderer
+    orjson = None
+
+from rest_framework.renderers import JSONRenderer
+
+# orjson's defaults already match JSONRenderer's compact, non-ASCII output.
+# Datetimes and dataclasses are handed back to DRF's encoder so they come
+# out exactly as before.
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS) if orjson else 0
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Byte-for-byte the output of JSONRenderer, encoded with orjson.
+
+    The one difference is float formatting outside 1e-4 <= |x| < 1e16, where
+    orjson writes `5e-7` and the stdlib `5e-07`. Only use it for payloads
+    whose floats are prices (decimals rendered as numbers), as the catalog
+    and cart views do. Anything orjson can't encode (e.g. non-string dict
+    keys, huge ints) and indented output fall back to JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same strict-javascript-subset escaping as JSONRenderer.
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
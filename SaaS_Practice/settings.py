@@ -68,6 +68,8 @@ SIMPLE_JWT = {
 }
 
 MIDDLEWARE = [
+    'SaaS_Practice.metrics.MetricsMiddleware',
+    'SaaS_Practice.db_router.ReplicaPinningMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -76,6 +78,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'SaaS_Practice.idempotency.IdempotencyMiddleware',
 ]
 
 ROOT_URLCONF = 'SaaS_Practice.urls'
@@ -113,18 +116,112 @@ DATABASES = {
     }
 }
 
+# DB_ENGINE=sqlite runs against a local file, e.g. for benchmarks without Postgres.
+if os.getenv('DB_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# Read replicas of `default`, one per host in DB_REPLICA_HOSTS (comma-separated).
+# Safe reads inside requests go to them; see SaaS_Practice/db_router.py.
+for number, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['SaaS_Practice.db_router.ReplicaRouter']
+DATABASE_REPLICAS = {
+    'PRIMARY': 'default',
+    'REPLICAS': [alias for alias in DATABASES if alias != 'default'],
+    'PIN_SECONDS': int(os.getenv('DB_REPLICA_PIN_SECONDS', 15)),
+}
+
 CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
+        "BACKEND": "SaaS_Practice.cache.TwoLevelRedisCache",
         "LOCATION": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/1"),
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # Hot, read-mostly keys also kept in each worker's memory; see SaaS_Practice/cache.py.
+            "LOCAL_KEY_PREFIXES": ["product_list", "product_facets"],
+            "LOCAL_MAX_ENTRIES": 256,
+            "LOCAL_TTL": int(os.getenv("CACHE_LOCAL_TTL", 60)),
+            "INVALIDATION_CHANNEL": "cache-invalidation",
         }
     }
 }
 
+# Stock ledger (services/inventory.py). `manage.py stock_ledger verify`
+# compares every product's stock with its movements.
+INVENTORY = {
+    'BATCH_SIZE': 500,
+}
+
+# Per-tier price rules (services/pricing.py), e.g.
+# {'vip_wholesale': [{'class': 'services.pricing.VolumeDiscount', 'min_quantity': 10, 'percent': '5'}]}
+PRICING_RULES = {}
+
+# Facets of the public product list (services/facets.py): retail price band
+# edges, and the stock at or below which a product counts as low_stock.
+# Rebuild the counts after changing them: manage.py catalog_facets rebuild
+CATALOG_FACETS = {
+    'PRICE_BANDS': [10, 25, 50, 100, 250],
+    'LOW_STOCK': 5,
+}
+
+# Sweeping stale carts (services/cleanup.py, manage.py sweep_carts).
+CART_CLEANUP = {
+    'IDLE_DAYS': int(os.getenv('CART_IDLE_DAYS', 30)),
+    'BATCH_SIZE': 500,
+    'SLEEP': float(os.getenv('CART_CLEANUP_SLEEP', 0.5)),  # seconds between batches
+}
+
+# Bulk stock and price updates (services/bulk_update.py, PATCH vendor/products/bulk/).
+PRODUCT_BULK_UPDATE = {
+    'MAX_ROWS': int(os.getenv('PRODUCT_BULK_UPDATE_MAX_ROWS', 5000)),
+}
+
+# Archiving long-inactive products (services/archive.py, manage.py archive_products).
+PRODUCT_ARCHIVE = {
+    'AFTER_DAYS': int(os.getenv('PRODUCT_ARCHIVE_AFTER_DAYS', 90)),
+    'BATCH_SIZE': 500,
+    'SLEEP': float(os.getenv('PRODUCT_ARCHIVE_SLEEP', 0.5)),  # seconds between batches
+}
+
+# Vendor dashboards (services/analytics.py). Rebuild the rollups after
+# changing LOW_STOCK_THRESHOLD: manage.py rebuild_analytics
+ANALYTICS = {
+    'LOW_STOCK_THRESHOLD': int(os.getenv('ANALYTICS_LOW_STOCK_THRESHOLD', 5)),
+    'TOP_PRODUCTS': 20,
+    'BATCH_SIZE': 500,
+}
+
+# Replaying retried writes that carry an Idempotency-Key (see SaaS_Practice/idempotency.py).
+IDEMPOTENCY = {
+    'PATH_PREFIXES': ['/Products/'],
+    'METHODS': ['POST', 'PUT', 'PATCH', 'DELETE'],
+    'TTL': int(os.getenv('IDEMPOTENCY_TTL', 86400)),
+    'LOCK_TIMEOUT': 30,
+}
+
 ASGI_APPLICATION = "SaaS_Practice.asgi.application"
 
+# Request metrics served at /metrics (see SaaS_Practice/metrics.py). Set
+# METRICS_MULTIPROC_DIR when running several worker processes. Only scrapers
+# sending `Authorization: Bearer $METRICS_TOKEN`, or from ALLOWED_IPS, get them.
+METRICS = {
+    'ENABLED': True,
+    'MULTIPROC_DIR': os.getenv('METRICS_MULTIPROC_DIR'),
+    'FLUSH_INTERVAL': 5,
+    'TOKEN': os.getenv('METRICS_TOKEN'),
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+}
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
@@ -135,6 +232,33 @@ CHANNEL_LAYERS = {
 }
 
 
+# Notification retention, applied by `manage.py purge_notifications`.
+NOTIFICATION_RETENTION = {
+    'MAX_PER_USER': int(os.getenv('NOTIFICATION_MAX_PER_USER', 500)),
+    'MAX_AGE_DAYS': int(os.getenv('NOTIFICATION_MAX_AGE_DAYS', 180)),
+    'COMPACT_READ_AFTER_DAYS': int(os.getenv('NOTIFICATION_COMPACT_READ_AFTER_DAYS', 30)),
+    'BATCH_SIZE': 1000,
+    'BATCH_SLEEP': 0.05,  # seconds between batches
+    'TIME_LIMIT': 300,    # seconds per run
+}
+
+# WebSocket presence, used to skip channel-layer sends to offline users.
+NOTIFICATION_PRESENCE = {
+    'TTL': 90,                 # seconds; must exceed HEARTBEAT_INTERVAL
+    'HEARTBEAT_INTERVAL': 30,
+}
+
+# Side effects of writes (cache invalidation, feed, emails, notification
+# fan-out) go through the outbox. `manage.py dispatch_outbox` must run next
+# to the web workers (one or more): nothing else sends them, and the cached
+# product list doesn't change until it does. See Notifications/outbox.py.
+OUTBOX = {
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 5,
+    'POLL_INTERVAL': float(os.getenv('OUTBOX_POLL_INTERVAL', 1.0)),  # seconds, when idle
+    'KEEP_DAYS': 7,  # dispatched events are deleted after this
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -186,8 +310,8 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'authentication.throttles.AnonRateThrottle',
+        'authentication.throttles.UserRateThrottle'
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
@@ -0,0 +1,76 @@
+"""
+Shared test helpers, mainly the query-budget assertions used to keep N+1
+patterns out of the API.
+
+A budget is either an int or a callable taking the number of rows the
+endpoint returns. assertQueriesDoNotScale() additionally replays the same
+request at several data sizes and fails when the query count changes.
+"""
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authentication.models import User
+
+TEST_PASSWORD = 'Str0ng@Passw0rd'
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+FAST_PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def make_user(email, user_type='normal_customer', password=TEST_PASSWORD, **extra):
+    fields = {
+        'full_name': email.split('@')[0],
+        'user_type': user_type,
+        'is_verified': True,
+        'is_approved': True,
+        'approved_at': timezone.now(),
+    }
+    fields.update(extra)
+    return User.objects.create_user(email=email, password=password, **fields)
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    PASSWORD_HASHERS=FAST_PASSWORD_HASHERS,
+)
+class QueryBudgetTestCase(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def authenticate(self, user):
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def assertQueryBudget(self, budget, request, rows=None):
+        """Run request() and fail if it issues more queries than the budget allows."""
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        limit = budget(rows) if callable(budget) else budget
+        if len(queries) > limit:
+            executed = "\n".join(f"  {query['sql']}" for query in queries.captured_queries)
+            self.fail(f"{len(queries)} queries exceed the budget of {limit} (rows={rows}):\n{executed}")
+        return response, len(queries)
+
+    def assertQueriesDoNotScale(self, budget, request, grow, sizes=(1, 5, 20)):
+        """
+        grow(n) must leave the endpoint with n rows to return. The request is
+        replayed at each size; the query count has to stay within budget and
+        must not change between sizes.
+        """
+        counts = {}
+        for size in sizes:
+            grow(size)
+            cache.clear()
+            response, counts[size] = self.assertQueryBudget(budget, request, rows=size)
+            self.assertLess(response.status_code, 400, getattr(response, 'data', response))
+        if len(set(counts.values())) != 1:
+            self.fail(f"Query count grows with rows returned: {counts}")
+        return counts
@@ -0,0 +1,495 @@
+import asyncio
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from services.models import Cart, CartItem, Product
+from .cache import _MISSING, LRUCache, TwoLevelCacheMixin
+from .db_router import use_primary, use_replicas
+from .idempotency import lock_key
+from .metrics import MetricsMiddleware, Registry, metrics_view, record_cache_lookup, registry
+from .renderers import FastJSONRenderer
+from .testing import FAST_PASSWORD_HASHERS, IN_MEMORY_CHANNEL_LAYERS, LOCMEM_CACHES, QueryBudgetTestCase, make_user
+
+PRIMARY = 'router_primary'
+REPLICA = 'router_replica'
+
+
+@override_settings(
+    DATABASE_REPLICAS={'PRIMARY': PRIMARY, 'REPLICAS': [REPLICA], 'PIN_SECONDS': 60},
+    CACHES=LOCMEM_CACHES,
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    PASSWORD_HASHERS=FAST_PASSWORD_HASHERS,
+)
+class ReplicaRoutingTests(SimpleTestCase):
+    """
+    Two separate SQLite files stand in for a primary and a replica that never
+    catches up, so any read served by the replica shows stale data.
+    """
+    # The two aliases only exist once setUpClass has registered them, after
+    # the runner has resolved which databases the suite needs.
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        configured = connections.configure_settings({
+            'default': dict(connections.settings['default']),
+            **{
+                alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': f"{cls.directory}/{alias}.sqlite3"}
+                for alias in (PRIMARY, REPLICA)
+            },
+        })
+        for alias in (PRIMARY, REPLICA):
+            connections.settings[alias] = configured[alias]
+        super().setUpClass()
+        for alias in (PRIMARY, REPLICA):
+            call_command('migrate', database=alias, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in (PRIMARY, REPLICA):
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_user('vendor@example.com', 'vendor')
+        self.product = Product.objects.create(
+            name='Widget', vendor=self.vendor, retail_price=Decimal('10.00'),
+            whole_sale_price=Decimal('8.00'), stock_quantity=5,
+        )
+        self.replicate(self.vendor, self.product)
+        Product.objects.using(REPLICA).filter(id=self.product.id).update(name='Stale widget')
+        self.client = APIClient()
+
+    def tearDown(self):
+        for alias in (PRIMARY, REPLICA):
+            Product.objects.using(alias).all().delete()
+            self.vendor.__class__.objects.using(alias).all().delete()
+
+    def replicate(self, *instances):
+        for instance in instances:
+            instance.save(using=REPLICA, force_insert=True)
+
+    def product_names(self, client):
+        cache.clear()
+        return [product['name'] for product in client.get('/Products/products/').json()]
+
+    def vendor_stock(self, client):
+        return client.get('/Products/vendor/products/').json()[0]['stock_quantity']
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(Product.objects.get().name, 'Widget')
+        with use_replicas():
+            self.assertEqual(Product.objects.get().name, 'Stale widget')
+            with use_primary():
+                self.assertEqual(Product.objects.get().name, 'Widget')
+            with transaction.atomic(using=PRIMARY):
+                self.assertEqual(Product.objects.get().name, 'Widget')
+
+    def test_write_pins_the_rest_of_the_block(self):
+        with use_replicas() as state:
+            self.assertEqual(Product.objects.get().name, 'Stale widget')
+            Product.objects.filter(id=self.product.id).update(stock_quantity=9)
+            self.assertTrue(state.pinned)
+            self.assertEqual(Product.objects.get().stock_quantity, 9)
+
+    def test_anonymous_reads_go_to_replica(self):
+        self.assertEqual(self.product_names(self.client), ['Stale widget'])
+
+    def test_writer_reads_own_writes(self):
+        token = RefreshToken.for_user(self.vendor).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(self.vendor_stock(self.client), 5)
+
+        response = self.client.patch(
+            f'/Products/vendor/products/{self.product.id}/', {'stock_quantity': 7}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Product.objects.using(REPLICA).get().stock_quantity, 5)
+
+        # The vendor is pinned to the primary; everyone else still reads the replica.
+        self.assertEqual(self.vendor_stock(self.client), 7)
+        self.assertEqual(self.product_names(APIClient(REMOTE_ADDR='10.0.0.2')), ['Stale widget'])
+
+        cache.clear()  # the pin expired
+        self.assertEqual(self.vendor_stock(self.client), 5)
+
+    async def test_async_requests_are_routed_the_same_way(self):
+        token = await sync_to_async(RefreshToken.for_user)(self.vendor)
+        headers = {'Authorization': f"Bearer {token.access_token}"}
+        response = await self.async_client.patch(
+            f'/Products/vendor/products/{self.product.id}/', {'stock_quantity': 7},
+            content_type='application/json', headers=headers,
+        )
+        self.assertEqual(response.status_code, 200)
+
+        vendor_products = await self.async_client.get('/Products/async/vendor/products/', headers=headers)
+        self.assertEqual(vendor_products.json()[0]['stock_quantity'], 7)
+        await cache.aclear()
+        products = await self.async_client.get('/Products/async/products/')
+        self.assertEqual([product['name'] for product in products.json()], ['Stale widget'])
+
+
+class FastJSONRendererTests(SimpleTestCase):
+
+    def assertSameBytes(self, data, accepted_media_type=None):
+        self.assertEqual(
+            FastJSONRenderer().render(data, accepted_media_type),
+            JSONRenderer().render(data, accepted_media_type),
+        )
+
+    def test_matches_json_renderer(self):
+        self.assertSameBytes({
+            'text': 'é 漢 😀 "q" \\ \u2028 \u2029 ' + ''.join(chr(i) for i in range(32)),
+            'error': [ErrorDetail('Invalid', code='invalid')],
+            'decimal': Decimal('12.30'),
+            'id': uuid.UUID(int=1),
+            'when': datetime.datetime(2024, 1, 2, 3, 4, 5, 678000, tzinfo=datetime.timezone.utc),
+            'naive': datetime.datetime(2024, 1, 2, 3, 4, 5),
+            'day': datetime.date(2024, 1, 2),
+            'nested': ({'a': (1, 2.5, None, True)},),
+        })
+        self.assertSameBytes([])
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_falls_back_for_what_orjson_cannot_encode(self):
+        self.assertSameBytes({1: 'integer key'})
+        self.assertSameBytes({'big': 2 ** 70})
+        self.assertSameBytes({'a': [1, 2]}, 'application/json; indent=4')
+
+
+class TwoLevelLocMemCache(TwoLevelCacheMixin, LocMemCache):
+    pass
+
+
+class TwoLevelCacheTests(SimpleTestCase):
+    """Two "workers" with their own L1 over one shared locmem L2 and the local bus."""
+
+    def setUp(self):
+        self.location = uuid.uuid4().hex
+        self.first = self.worker()
+        self.second = self.worker()
+
+    def worker(self, **options):
+        options = {
+            'LOCAL_KEY_PREFIXES': ['hot'],
+            'INVALIDATION_BUS': 'local',
+            'INVALIDATION_CHANNEL': self.location,
+            'LOCAL_NAME': uuid.uuid4().hex,
+            **options,
+        }
+        return TwoLevelLocMemCache(self.location, {'OPTIONS': options})
+
+    def drop_from_l2(self, key):
+        LocMemCache.delete(self.first, key)
+
+    def test_hot_keys_are_served_from_process_memory(self):
+        self.first.set('hot:list', [1, 2, 3])
+        self.drop_from_l2('hot:list')
+        self.assertEqual(self.first.get('hot:list'), [1, 2, 3])
+        self.assertIsNone(self.second.get('hot:list'))
+
+    def test_other_keys_always_read_the_backend(self):
+        self.first.set('cold', 1)
+        self.drop_from_l2('cold')
+        self.assertIsNone(self.first.get('cold'))
+
+    def test_writes_invalidate_every_worker(self):
+        self.first.set('hot:list', 'v1')
+        self.assertEqual(self.second.get('hot:list'), 'v1')
+        self.first.set('hot:list', 'v2')
+        self.assertEqual(self.second.get('hot:list'), 'v2')
+        self.second.delete('hot:list')
+        self.assertIsNone(self.first.get('hot:list'))
+        self.first.set('hot:list', 'v3')
+        self.second.get('hot:list')
+        self.first.clear()
+        self.assertIsNone(self.second.get('hot:list'))
+
+    def test_fill_racing_an_invalidation_is_not_kept(self):
+        self.first.set('hot:list', 'old')
+        self.second.tier.entries.clear()
+        original_get = LocMemCache.get
+
+        def get_then_overwrite(cache_self, key, *args, **kwargs):
+            value = original_get(cache_self, key, *args, **kwargs)
+            self.first.set('hot:list', 'new')
+            return value
+
+        with mock.patch.object(LocMemCache, 'get', get_then_overwrite):
+            self.assertEqual(self.second.get('hot:list'), 'old')
+        self.assertEqual(self.second.get('hot:list'), 'new')
+
+    def test_aget_hit_skips_the_backend(self):
+        self.first.set('hot:list', 'value')
+        with mock.patch.object(LocMemCache, 'get', side_effect=AssertionError('backend read')):
+            self.assertEqual(asyncio.run(self.first.aget('hot:list')), 'value')
+
+    def test_local_entries_expire_and_are_bounded(self):
+        entries = LRUCache(max_entries=2)
+        with mock.patch('SaaS_Practice.cache.time.monotonic', return_value=100.0):
+            entries.set('a', 1, ttl=10)
+            entries.set('b', 2, ttl=None)
+            entries.get('a')
+            entries.set('c', 3, ttl=None)  # evicts 'b', the least recently used
+            self.assertIs(entries.get('b'), _MISSING)
+            self.assertEqual(entries.get('a'), 1)
+        with mock.patch('SaaS_Practice.cache.time.monotonic', return_value=110.0):
+            self.assertIs(entries.get('a'), _MISSING)
+            self.assertEqual(entries.get('c'), 3)
+
+
+class IdempotencyTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor')
+        cls.customer = make_user('customer@example.com', 'normal_customer')
+        cls.product = Product.objects.create(
+            name='Widget', vendor=cls.vendor, retail_price=Decimal('10.00'),
+            whole_sale_price=Decimal('8.00'), stock_quantity=5,
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.customer)
+
+    def add_to_cart(self, quantity=2, key='retry-1'):
+        return self.client.post(
+            '/Products/cart/', {'product_id': str(self.product.id), 'quantity': quantity},
+            format='json', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def quantity_in_cart(self):
+        return CartItem.objects.get(cart__user=self.customer).quantity
+
+    def test_retry_replays_without_running_the_view(self):
+        first = self.add_to_cart()
+        self.assertEqual(first.status_code, 201)
+        retry, _ = self.assertQueryBudget(0, self.add_to_cart)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(self.quantity_in_cart(), 2)
+
+        self.assertEqual(self.add_to_cart(key='retry-2').status_code, 201)
+        self.assertEqual(self.quantity_in_cart(), 4)
+
+    def test_keys_are_per_user(self):
+        self.add_to_cart()
+        other = make_user('other@example.com', 'normal_customer')
+        self.authenticate(other)
+        self.assertEqual(self.add_to_cart().status_code, 201)
+        self.assertEqual(CartItem.objects.get(cart__user=other).quantity, 2)
+
+    def test_key_reused_for_another_request(self):
+        self.add_to_cart()
+        self.assertEqual(self.add_to_cart(quantity=1).status_code, 422)
+        self.assertEqual(self.quantity_in_cart(), 2)
+
+    def test_concurrent_duplicate_waits_for_the_first(self):
+        identity = f"user:{self.customer.pk}"
+        cache.add(lock_key(identity, 'retry-1'), 1)
+        response = self.add_to_cart()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Cart.objects.filter(user=self.customer, items__isnull=False).exists())
+
+    async def test_async_stack_replays_too(self):
+        token = await sync_to_async(RefreshToken.for_user)(self.customer)
+        headers = {'Authorization': f"Bearer {token.access_token}", 'Idempotency-Key': 'retry-1'}
+        data = {'product_id': str(self.product.id), 'quantity': 2}
+        for _ in range(2):
+            response = await self.async_client.post(
+                '/Products/cart/', data, content_type='application/json', headers=headers,
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(await sync_to_async(self.quantity_in_cart)(), 2)
+
+    def test_requests_without_a_key_are_untouched(self):
+        for _ in range(2):
+            self.client.post('/Products/cart/', {'product_id': str(self.product.id), 'quantity': 2}, format='json')
+        self.assertEqual(self.quantity_in_cart(), 4)
+
+
+def histogram(name, view):
+    """(sum, count) of a per-view histogram in this process's registry."""
+    for metric, labels, _, total, count in registry.snapshot()['histograms']:
+        if metric == name and [tuple(pair) for pair in labels] == [('view', view)]:
+            return total, count
+    return 0, 0
+
+
+class AsyncMiddlewareTests(QueryBudgetTestCase):
+
+    @override_settings(DEBUG=True)
+    def test_asgi_stack_needs_no_sync_adapters(self):
+        # Django logs every middleware it has to wrap in sync_to_async.
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+    async def test_async_views_are_measured(self):
+        for view, url in (('AsyncProductListView', '/Products/async/products/'),
+                          ('ProductListView', '/Products/products/')):
+            with self.subTest(view):
+                await cache.aclear()
+                labels = (('view', view), ('method', 'GET'), ('status', '200'))
+                before = registry.counter_values('http_requests_total').get(labels, 0)
+                queries, observed = histogram('http_db_queries_per_request', view)
+                query_time = registry.counter_values('http_db_query_duration_seconds_total').get((('view', view),), 0)
+
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(registry.counter_values('http_requests_total')[labels], before + 1)
+                # The queries run in sync_to_async threads, not on the event loop.
+                self.assertEqual(histogram('http_db_queries_per_request', view)[1], observed + 1)
+                self.assertGreater(histogram('http_db_queries_per_request', view)[0], queries)
+                self.assertGreater(
+                    registry.counter_values('http_db_query_duration_seconds_total')[(('view', view),)], query_time,
+                )
+
+
+class MetricsRegistryTests(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+        self.registry.declare('requests_total', 'counter', 'Requests.')
+        self.registry.declare('latency_seconds', 'histogram', 'Latency.', (0.1, 1.0))
+
+    def test_renders_counters_and_cumulative_buckets(self):
+        labels = (('view', 'ProductList'),)
+        self.registry.inc('requests_total', labels)
+        self.registry.inc('requests_total', labels, 2)
+        for value in (0.05, 0.5, 3.0):
+            self.registry.observe('latency_seconds', labels, value)
+        self.assertEqual(self.registry.render([self.registry.snapshot()]).splitlines(), [
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{view="ProductList"} 3',
+            '# HELP latency_seconds Latency.',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{view="ProductList",le="0.1"} 1',
+            'latency_seconds_bucket{view="ProductList",le="1"} 2',
+            'latency_seconds_bucket{view="ProductList",le="+Inf"} 3',
+            'latency_seconds_sum{view="ProductList"} 3.55',
+            'latency_seconds_count{view="ProductList"} 3',
+        ])
+
+    def test_merges_worker_snapshots_and_escapes_labels(self):
+        labels = (('view', 'say "hi"\n'),)
+        self.registry.inc('requests_total', labels)
+        snapshot = self.registry.snapshot()
+        rendered = self.registry.render([snapshot, snapshot])
+        self.assertIn('requests_total{view="say \\"hi\\"\\n"} 2', rendered)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class MetricsMiddlewareTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def histogram_count(self, name, view):
+        return histogram(name, view)[1]
+
+    def histogram_sum(self, name, view):
+        return histogram(name, view)[0]
+
+    def test_records_each_request_by_view(self):
+        labels = (('view', 'ProductListView'), ('method', 'GET'), ('status', '200'))
+        requests = registry.counter_values('http_requests_total').get(labels, 0)
+        observed = self.histogram_count('http_db_queries_per_request', 'ProductListView')
+
+        self.assertEqual(self.client.get('/Products/products/').status_code, 200)
+        self.assertEqual(registry.counter_values('http_requests_total')[labels], requests + 1)
+        self.assertEqual(self.histogram_count('http_db_queries_per_request', 'ProductListView'), observed + 1)
+
+        with self.settings(METRICS={'ENABLED': False}):
+            # Read when the middleware is built, so this needs a fresh stack.
+            MetricsMiddleware(lambda request: HttpResponse())(RequestFactory().get('/'))
+        self.assertEqual(registry.counter_values('http_requests_total')[labels], requests + 1)
+
+    def test_counts_queries_and_cache_lookups_of_the_request(self):
+        def view(request):
+            list(Product.objects.all()[:1])
+            list(Product.objects.all()[:1])
+            record_cache_lookup(hit=True)
+            record_cache_lookup(hit=False)
+            record_cache_lookup(hit=False)
+            return HttpResponse('x' * 300)
+
+        cache_lookups = registry.counter_values('cache_requests_total')
+        before = self.histogram_sum('http_db_queries_per_request', 'unresolved')
+        sizes = self.histogram_sum('http_response_size_bytes', 'unresolved')
+        MetricsMiddleware(view)(RequestFactory().get('/'))
+        after = registry.counter_values('cache_requests_total')
+        for result, count in (('hit', 1), ('miss', 2)):
+            key = (('view', 'unresolved'), ('result', result))
+            self.assertEqual(after[key], cache_lookups.get(key, 0) + count)
+        self.assertEqual(self.histogram_sum('http_db_queries_per_request', 'unresolved'), before + 2)
+        self.assertEqual(self.histogram_sum('http_response_size_bytes', 'unresolved'), sizes + 300)
+
+    def test_endpoint_merges_every_worker(self):
+        other = Registry()
+        other.declare('http_requests_total', 'counter', 'Requests.')
+        other.inc('http_requests_total', (('view', 'FromAnotherWorker'), ('method', 'GET'), ('status', '200')), 4)
+        with open(f"{self.directory}/metrics-1.json", 'w') as fh:
+            json.dump(other.snapshot(), fh)
+        with open(f"{self.directory}/metrics-2.json", 'w') as fh:
+            fh.write('{half a file')
+
+        self.assertEqual(reverse('metrics'), '/metrics')
+        with self.settings(METRICS={'MULTIPROC_DIR': self.directory, 'ALLOWED_IPS': ['127.0.0.1']}):
+            response = metrics_view(RequestFactory().get('/metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('http_requests_total{view="FromAnotherWorker",method="GET",status="200"} 4', body)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+
+    def test_endpoint_is_only_for_scrapers(self):
+        with self.settings(METRICS={'TOKEN': 's3cret', 'ALLOWED_IPS': ['10.0.0.5']}):
+            for headers, expected in (
+                ({}, 403),
+                ({'HTTP_AUTHORIZATION': 'Bearer wrong'}, 403),
+                ({'HTTP_AUTHORIZATION': 'Bearer s3cret'}, 200),
+                ({'REMOTE_ADDR': '10.0.0.5'}, 200),
+            ):
+                with self.subTest(**headers):
+                    self.assertEqual(self.client.get(reverse('metrics'), **headers).status_code, expected)
+        with self.settings(METRICS={}):
+            # Neither set: nobody.
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    def test_workers_flush_their_snapshot(self):
+        registry.flush(self.directory)
+        with open(f"{self.directory}/metrics-{os.getpid()}.json") as fh:
+            self.assertEqual(set(json.load(fh)), {'counters', 'histograms'})
@@ -25,8 +25,10 @@
 
 from django.contrib import admin
 from django.urls import path, include
+from .metrics import metrics_view
 
 urlpatterns = [
+    path('metrics', metrics_view, name='metrics'),
     path('admin/', admin.site.urls),
     path('api/', include('authentication.urls')),
     path('Products/', include('services.urls')),
@@ -1,3 +1,200 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from SaaS_Practice.testing import LOCMEM_CACHES, TEST_PASSWORD, QueryBudgetTestCase, make_user
+from .models import User
+from .throttles import AnonRateThrottle, OTPVerifyRateThrottle, UserRateThrottle
+from .urls import urlpatterns
+
+OTP = '123456'
+
+
+class AuthenticationQueryBudgetTests(QueryBudgetTestCase):
+    """Every route in authentication/urls.py with its query budget."""
+
+    COVERED_ROUTES = {
+        'register',
+        'verify-otp',
+        'resend-otp',
+        'token_obtain_pair',
+        'token_refresh',
+        'logout',
+        'admin-requests',
+        'set-password',
+        'forgot-password',
+        'reset-password',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_user('admin@example.com', 'admin', is_staff=True)
+        cls.customer = make_user('customer@example.com', 'normal_customer')
+
+    def with_otp(self, user):
+        user.otp_hash = make_password(OTP)
+        user.otp_created_at = timezone.now()
+        user.save(update_fields=['otp_hash', 'otp_created_at'])
+        return user
+
+    def grow_pending(self, size):
+        pending = User.objects.filter(is_approved=False, is_rejected=False, user_type='vendor')
+        for i in range(pending.count(), size):
+            make_user(f'pending{i}@example.com', 'vendor', is_approved=False, approved_at=None)
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual({pattern.name for pattern in urlpatterns}, self.COVERED_ROUTES)
+
+    def test_register(self):
+        data = {'email': 'new@example.com', 'full_name': 'New User'}
+        response, _ = self.assertQueryBudget(5, lambda: self.client.post(reverse('register'), data))
+        self.assertEqual(response.status_code, 201)
+
+    def test_verify_otp(self):
+        user = self.with_otp(make_user('unverified@example.com', is_verified=False))
+        data = {'email': user.email, 'otp': OTP}
+        response, _ = self.assertQueryBudget(5, lambda: self.client.post(reverse('verify-otp'), data))
+        self.assertEqual(response.status_code, 200)
+
+    def test_resend_otp(self):
+        data = {'email': self.customer.email}
+        response, _ = self.assertQueryBudget(2, lambda: self.client.post(reverse('resend-otp'), data))
+        self.assertEqual(response.status_code, 200)
+
+    def test_login(self):
+        data = {'email': self.customer.email, 'password': TEST_PASSWORD}
+        response, _ = self.assertQueryBudget(5, lambda: self.client.post(reverse('token_obtain_pair'), data))
+        self.assertEqual(response.status_code, 200)
+
+    def test_login_errors_are_logged_without_the_email(self):
+        data = {'email': self.customer.email, 'password': TEST_PASSWORD}
+        with mock.patch('authentication.views.TokenObtainPairView.post', side_effect=RuntimeError('boom')), \
+                self.assertLogs('authentication.views', 'ERROR') as logs:
+            response = self.client.post(reverse('token_obtain_pair'), data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(logs.records[0].getMessage(), f"Login failed for user {self.customer.pk}")
+        self.assertNotIn(self.customer.email, logs.output[0])
+
+    def test_refresh(self):
+        data = {'refresh': str(RefreshToken.for_user(self.customer))}
+        response, _ = self.assertQueryBudget(13, lambda: self.client.post(reverse('token_refresh'), data))
+        self.assertEqual(response.status_code, 200)
+
+    def test_logout(self):
+        self.authenticate(self.customer)
+        data = {'refresh_token': str(RefreshToken.for_user(self.customer))}
+        response, _ = self.assertQueryBudget(8, lambda: self.client.post(reverse('logout'), data))
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_dashboard_list(self):
+        self.authenticate(self.admin)
+        url = reverse('admin-requests')
+        self.assertQueriesDoNotScale(2, lambda: self.client.get(url), self.grow_pending)
+
+    def test_admin_dashboard_decision(self):
+        self.authenticate(self.admin)
+        self.grow_pending(1)
+        pending = User.objects.get(email='pending0@example.com')
+        data = {'id': str(pending.id), 'action': 'approve'}
+        response, _ = self.assertQueryBudget(6, lambda: self.client.post(reverse('admin-requests'), data))
+        self.assertEqual(response.status_code, 200)
+
+    def test_set_password(self):
+        user = make_user('nopassword@example.com', password=None)
+        data = {'password': 'An0ther@Secret', 'confirm_password': 'An0ther@Secret'}
+        url = reverse('set-password', kwargs={'user_id': user.id})
+        response, _ = self.assertQueryBudget(2, lambda: self.client.post(url, data))
+        self.assertEqual(response.status_code, 200)
+
+    def test_forgot_password(self):
+        data = {'email': self.customer.email}
+        response, _ = self.assertQueryBudget(2, lambda: self.client.post(reverse('forgot-password'), data))
+        self.assertEqual(response.status_code, 200)
+
+    def test_reset_password(self):
+        self.with_otp(self.customer)
+        data = {'email': self.customer.email, 'otp': OTP, 'new_password': 'An0ther@Secret'}
+        response, _ = self.assertQueryBudget(2, lambda: self.client.post(reverse('reset-password'), data))
+        self.assertEqual(response.status_code, 200)
+
+    def test_otp_checks_are_throttled(self):
+        user = self.with_otp(make_user('unverified@example.com', is_verified=False))
+        attempts = [
+            ('verify-otp', {'email': user.email, 'otp': '000000'}),
+            ('reset-password', {'email': user.email, 'otp': '000000', 'new_password': 'An0ther@Secret'}),
+        ]
+        for name, data in attempts:
+            with self.subTest(name), throttle_rates(otp_verify='2/min'):
+                cache.clear()
+                codes = [self.client.post(reverse(name), data).status_code for _ in range(3)]
+                self.assertNotIn(429, codes[:2])
+                self.assertEqual(codes[2], 429)
+
+
+def throttle_rates(**rates):
+    from django.conf import settings
+    return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SlidingWindowThrottleTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.request = APIRequestFactory().get('/', REMOTE_ADDR='10.0.0.1')
+        self.request.user = AnonymousUser()
+
+    def allowed(self, throttle_class, count, at=1000.0):
+        with mock.patch.object(throttle_class, 'timer', return_value=at):
+            throttle = throttle_class()
+            return [throttle.allow_request(self.request, None) for _ in range(count)].count(True), throttle
+
+    def test_rates_are_read_from_settings_per_request(self):
+        with throttle_rates(anon='3/min'):
+            self.assertEqual(self.allowed(AnonRateThrottle, 5)[0], 3)
+        cache.clear()
+        with throttle_rates(anon='4/min'):
+            self.assertEqual(self.allowed(AnonRateThrottle, 5)[0], 4)
+
+    def test_otp_throttle_uses_the_otp_verify_rate(self):
+        with throttle_rates(otp_verify='2/min'):
+            self.assertEqual(self.allowed(OTPVerifyRateThrottle, 3)[0], 2)
+
+    def test_previous_window_is_weighted_by_overlap(self):
+        with throttle_rates(anon='10/min'):
+            self.assertEqual(self.allowed(AnonRateThrottle, 10, at=600.0)[0], 10)
+            # 15s into the next window, 75% of the previous one still counts.
+            allowed, throttle = self.allowed(AnonRateThrottle, 10, at=675.0)
+            self.assertEqual(allowed, 2)
+            self.assertAlmostEqual(throttle.wait(), 3.0)
+            # Denied requests were not counted.
+            self.assertEqual(self.allowed(AnonRateThrottle, 10, at=681.0)[0], 1)
+
+    def test_full_window_waits_into_the_next(self):
+        with throttle_rates(anon='4/min'):
+            allowed, throttle = self.allowed(AnonRateThrottle, 5, at=630.0)
+            self.assertEqual(allowed, 4)
+            # 30s to the next window, then 25% more for 4 * 0.75 + 1 <= 4.
+            self.assertAlmostEqual(throttle.wait(), 45.0)
+
+    def test_counting_is_exact_under_concurrency(self):
+        with throttle_rates(user='25/min'), mock.patch.object(UserRateThrottle, 'timer', return_value=1000.0):
+            def attempt(_):
+                return UserRateThrottle().allow_request(self.request, None)
+
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                results = list(pool.map(attempt, range(200)))
+        self.assertEqual(results.count(True), 25)
+
+    def test_authenticated_users_are_not_anon_throttled(self):
+        self.request.user = mock.Mock(is_authenticated=True, pk=1)
+        with throttle_rates(anon='1/min'):
+            self.assertEqual(self.allowed(AnonRateThrottle, 3)[0], 3)
@@ -1,13 +1,136 @@
-from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
+"""
+Sliding-window-counter throttles on atomic cache increments.
+
+DRF's SimpleRateThrottle keeps a list of request timestamps per client and
+rewrites it on every request: O(n) work and a read-modify-write race
+between workers. Here each client has one integer counter per fixed
+window, bumped with cache.incr(). The previous window's count is weighted
+by how much of it still overlaps the sliding window:
+
+    estimate = previous * (1 - elapsed_fraction) + current
+
+That is two cache round trips per request whatever the rate. Rates come
+from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] by scope and are read on
+every request, so override_settings works.
+"""
+import time
+
+from django.core.cache import cache as default_cache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'100/day' -> (100, 86400); None -> (None, None)."""
+    if rate is None:
+        return None, None
+    num, period = rate.split('/')
+    return int(num), DURATIONS[period[0]]
+
+
+class SlidingWindowRateThrottle(BaseThrottle):
+    scope = None
+    cache = default_cache
+    cache_format = 'throttle:%(scope)s:%(ident)s:%(window)s'
+    timer = time.time
+
+    def __init__(self):
+        if not getattr(self, 'scope', None):
+            raise ImproperlyConfigured(f"You must set a scope for '{self.__class__.__name__}'")
+        self.num_requests, self.duration = parse_rate(self.get_rate())
+
+    def get_rate(self):
+        try:
+            return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+        except KeyError:
+            raise ImproperlyConfigured(f"No default throttle rate set for '{self.scope}' scope")
+
+    def get_cache_ident(self, request, view):
+        """The client identity to count against, or None to not throttle this request."""
+        raise NotImplementedError
+
+    def window_key(self, ident, window):
+        return self.cache_format % {'scope': self.scope, 'ident': ident, 'window': window}
+
+    def increment(self, key):
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # First request of the window. The key lives for two windows so
+            # the next one can still weigh it.
+            if self.cache.add(key, 1, timeout=2 * self.duration):
+                return 1
+            return self.cache.incr(key)
+
+    def allow_request(self, request, view):
+        if self.num_requests is None:
+            return True
+        ident = self.get_cache_ident(request, view)
+        if ident is None:
+            return True
+
+        self.now = self.timer()
+        window, offset = divmod(self.now, self.duration)
+        window = int(window)
+        self.fraction = offset / self.duration
+        current_key = self.window_key(ident, window)
+
+        self.current = self.increment(current_key)
+        self.previous = self.cache.get(self.window_key(ident, window - 1), 0)
+        if self.previous * (1 - self.fraction) + self.current <= self.num_requests:
+            return True
+
+        # Rejected requests don't use up the allowance.
+        try:
+            self.current = self.cache.decr(current_key)
+        except ValueError:
+            self.current = 0
+        return False
+
+    def wait(self):
+        """Seconds until one more request would fit, assuming no other traffic."""
+        if self.current < self.num_requests:
+            if not self.previous:
+                return 0
+            # Still in this window: wait for the previous one's weight to decay.
+            needed = 1 - (self.num_requests - self.current - 1) / self.previous
+            return max(0.0, (needed - self.fraction) * self.duration)
+        # This window is full; in the next one it becomes the decaying "previous".
+        remaining = (1 - self.fraction) * self.duration
+        needed = 1 - (self.num_requests - 1) / self.current if self.current else 0
+        return remaining + max(0.0, needed) * self.duration
+
+
+class AnonRateThrottle(SlidingWindowRateThrottle):
+    scope = 'anon'
+
+    def get_cache_ident(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.get_ident(request)
+
+
+class UserRateThrottle(SlidingWindowRateThrottle):
+    scope = 'user'
+
+    def get_cache_ident(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return self.get_ident(request)
 
 
 class LoginRateThrottle(UserRateThrottle):
  scope = 'login'
 
 
+# Every view that checks an OTP needs this, or a 6-digit code can be guessed.
+# The 'otp_verify' scope must keep a rate in DEFAULT_THROTTLE_RATES.
 class OTPVerifyRateThrottle(UserRateThrottle):
- scope = 'otp'
+ scope = 'otp_verify'
 
 
 class ResendOTPThrottle(UserRateThrottle):
- scope = 'resend_otp'
\ No newline at end of file
+ scope = 'resend_otp'
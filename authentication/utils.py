@@ -57,3 +57,8 @@ def send_password_setup_email(to_email, set_password_url):
         fail_silently=False,
     )
     return True
+
+
+def deliver_password_setup(payload):
+    """Outbox handler for UserApproved and UserVerified."""
+    send_password_setup_email(payload['email'], payload['set_password_url'])
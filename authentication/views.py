@@ -1,13 +1,16 @@
-import traceback
+import logging
 from datetime import timedelta
 from django.contrib.auth.hashers import make_password
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from rest_framework.permissions import AllowAny, IsAuthenticated 
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from Notifications import outbox
 from .models import User
 from .permissions import IsApprovedAndActive
 from .serializers import (
@@ -27,10 +30,11 @@ from .throttles import (
 )
 from .utils import (
     generate_and_send_otp,
-    send_password_setup_email,
     verify_otp,
 )
 
+logger = logging.getLogger(__name__)
+
 
 # Authentication Views
 
@@ -62,6 +66,7 @@ class ApprovedUserTokenObtainPairView(TokenObtainPairView):
     username_field = 'email'
 
     def post(self, request, *args, **kwargs):
+        user = None
         try:
             email = request.data.get('username') or request.data.get('email')
             user = User.objects.get(email=email)
@@ -116,8 +121,8 @@ class ApprovedUserTokenObtainPairView(TokenObtainPairView):
                 "error": "User not found"
             }, status=404)
         except Exception as e:
-            traceback_str = ''.join(traceback.format_exception(None, e, e.__traceback__))
-            print("LOGIN ERROR:\n", traceback_str)
+            # The id, never the email: logs are not the place for personal data.
+            logger.exception("Login failed for user %s", user.pk if user else None)
             return Response({
                 "error": str(e)
             }, status=400)
@@ -148,23 +153,14 @@ class AdminDashboardRequestApprovalView(APIView):
             return Response({"error": "Admin access required"}, status=403)
         
         
-        pending_users = User.objects.filter(
+        users_data = User.objects.filter(
             is_verified=True,
             is_approved=False,
             is_rejected=False,
             user_type__in=['vendor', 'vip_customer']
-        )
+        ).values('id', 'email', 'full_name', 'user_type', created_at=F('date_joined'))
 
-        users_data = []
-        for user in pending_users:
-            users_data.append({
-                'id': user.id,
-                'email': user.email,
-                'full_name': user.full_name,
-                'user_type': user.user_type,
-                'created_at': user.date_joined,
-            })
-        return Response(users_data, status=200)
+        return Response(list(users_data), status=200)
   
     def post(self, request):
         if not request.user.is_staff:
@@ -191,13 +187,14 @@ class AdminDashboardRequestApprovalView(APIView):
             user.is_active = True
             user.processed_by = request.user
             user.processed_at = timezone.now()
-            user.save(update_fields=['is_approved', 'approved_at', 'is_active', 'processed_by', 'processed_at'])
-            
-            
-            send_password_setup_email(
-                to_email=user.email,
-                set_password_url=f"http://localhost:8000/set-password/{user.id}/"
-            )
+            # The email is sent by the outbox dispatcher once this commits.
+            with transaction.atomic():
+                user.save(update_fields=['is_approved', 'approved_at', 'is_active', 'processed_by', 'processed_at'])
+                outbox.emit('UserApproved', {
+                    'user_id': str(user.id),
+                    'email': user.email,
+                    'set_password_url': f"http://localhost:8000/set-password/{user.id}/",
+                })
         elif action == 'reject':
             user.is_rejected = True
             user.rejected_at = timezone.now()
@@ -254,7 +251,7 @@ class RegisterView(APIView):
 
 class VerifyOTPView(APIView):
     permission_classes = [AllowAny]
-    # throttle_classes = [OTPVerifyRateThrottle]
+    throttle_classes = [OTPVerifyRateThrottle]
    
     def post(self, request):
         serializer = VerifyOTPSerializer(data=request.data)
@@ -273,17 +270,18 @@ class VerifyOTPView(APIView):
         if not verify_otp(otp_input, user.otp_hash, user.otp_created_at):
             return Response({"error": "Invalid or expired OTP."}, status=400)
 
-        user.is_verified = True
-        user.otp_hash = None
-        user.save(update_fields=["is_verified", "otp_hash"])
-
         message = "OTP verified successfully."
         if user.user_type == 'normal_customer':
             message += f" You can now set your password at: /set-password/{user.id}/"
-
-            send_password_setup_email(user.email , message  )
         else:
             message += " Please wait for admin approval."
+
+        user.is_verified = True
+        user.otp_hash = None
+        with transaction.atomic():
+            user.save(update_fields=["is_verified", "otp_hash"])
+            if user.user_type == 'normal_customer':
+                outbox.emit('UserVerified', {'user_id': str(user.id), 'email': user.email, 'set_password_url': message})
             
         return Response({"message": message}, status=200)
 
@@ -312,7 +310,7 @@ class ForgotPasswordView(APIView):
 
 class ResetPasswordView(APIView):
     permission_classes = [AllowAny]
-    # throttle_classes = [OTPVerifyRateThrottle]
+    throttle_classes = [OTPVerifyRateThrottle]
     
     def post(self, request):
         serializer = ResetPasswordSerializer(data=request.data)
@@ -1,5 +1,10 @@
 from django.contrib import admin
-from .models import Product, Cart, CartItem
+from django.db import transaction
+from django.utils import timezone
+from . import analytics, events, facets, feed
+from .inventory import record, set_stock
+from .pricing import annotate_unit_price
+from .models import ArchivedProduct, Product, Cart, CartItem, Order, OrderItem, StockMovement
 
 
 @admin.register(Product)
@@ -8,7 +13,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ('is_active', 'vendor__user_type', 'created_at')
     search_fields = ('name', 'vendor__email', 'vendor__full_name', 'description')
     ordering = ('-created_at',)
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('deactivated_at', 'created_at', 'updated_at')
     
     fieldsets = (
         ('Product Information', {
@@ -18,7 +23,7 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('retail_price', 'whole_sale_price')
         }),
         ('Inventory', {
-            'fields': ('stock_quantity', 'is_active')
+            'fields': ('stock_quantity', 'is_active', 'deactivated_at')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -29,6 +34,59 @@ class ProductAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('vendor')
 
+    def save_model(self, request, obj, form, change):
+        # Stock changes go through the ledger, and only the edited fields are
+        # written so a sale made while the form was open isn't overwritten.
+        with transaction.atomic():
+            if not change:
+                obj.save()
+                record('restock', {obj.id: obj.stock_quantity}, 'created')
+                analytics.product_added(obj)
+                facets.update({}, {obj.id: facets.cell_for(obj)})
+                events.product_changed()
+                return
+            fields = [name for name in form.changed_data if name != 'stock_quantity']
+            if 'is_active' in fields:
+                # When it went inactive is what archiving goes by.
+                obj.deactivated_at = None if obj.is_active else timezone.now()
+                fields.append('deactivated_at')
+            if fields:
+                moves = facets.CELL_FIELDS & set(fields)
+                before = facets.cells([obj.id], lock=True) if moves else None
+                obj.save(update_fields=[*fields, 'updated_at'])
+                if moves:
+                    facets.update(before, facets.cells([obj.id]))
+            if 'stock_quantity' in form.changed_data:
+                set_stock(obj, obj.stock_quantity, 'admin')
+            if {'retail_price', 'whole_sale_price'} & set(form.changed_data):
+                # The carts holding it are repriced by the event's handler.
+                analytics.price_changed(obj, form.initial['retail_price'])
+            events.product_changed({obj.id: {
+                field: getattr(obj, field) for field in feed.TRACKED_FIELDS if field in form.changed_data
+            }})
+
+    # Products are deactivated instead (is_active), and archived later by
+    # `manage.py archive_products`; orders and the ledger keep their ids.
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedProduct)
+class ArchivedProductAdmin(admin.ModelAdmin):
+    list_display = ('name', 'vendor', 'retail_price', 'stock_quantity', 'deactivated_at', 'archived_at')
+    list_filter = ('archived_at',)
+    search_fields = ('id', 'name', 'vendor__email', 'vendor__full_name')
+    ordering = ('-archived_at',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('vendor')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
@@ -38,7 +96,9 @@ class CartAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at', 'updated_at', 'total_items', 'total_price')
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('user').prefetch_related('items__product')
+        # Totals come from the stored CartTotal rows; the items are only
+        # summed for carts that have none yet.
+        return super().get_queryset(request).select_related('user').prefetch_related('totals', 'items__product')
 
 
 @admin.register(CartItem)
@@ -53,8 +113,52 @@ class CartItemAdmin(admin.ModelAdmin):
     cart_user.short_description = 'User'
     
     def unit_price(self, obj):
-        return obj.product.get_price_for_user(obj.cart.user)
+        return obj.tier_unit_price
     unit_price.short_description = 'Unit Price'
+
+    def total_price(self, obj):
+        return obj.tier_unit_price * obj.quantity
+    total_price.short_description = 'Total Price'
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('cart__user', 'product', 'product__vendor')
+        # Priced in the query for every row at once, each at its cart owner's tier.
+        queryset = super().get_queryset(request).select_related('cart__user', 'product', 'product__vendor')
+        return annotate_unit_price(
+            queryset, 'cart__user__user_type', prefix='product__', quantity='quantity', name='tier_unit_price',
+        )
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+    readonly_fields = ('product', 'product_name', 'unit_price', 'quantity', 'total_price')
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'price_type', 'total_items', 'total_price', 'created_at')
+    list_filter = ('status', 'price_type', 'created_at')
+    search_fields = ('user__email', 'user__full_name')
+    readonly_fields = ('user', 'price_type', 'total_items', 'total_price', 'created_at')
+    inlines = [OrderItemInline]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('id', 'product', 'kind', 'quantity', 'reference', 'created_at')
+    list_filter = ('kind', 'created_at')
+    search_fields = ('product__name', 'reference')
+    ordering = ('-id',)
+
+    # The ledger is append-only.
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
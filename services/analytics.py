@@ -0,0 +1,370 @@
+"""
+Vendor analytics rollups.
+
+Dashboards read small rollup tables instead of scanning Product and
+CartItem:
+
+    VendorStats      one row per vendor: products, units in carts, low-stock
+                     products and catalog value (stock x retail price)
+    ProductStats     one row per product: units sitting in carts
+    VendorActivity   one row per vendor and hour / day: orders, units sold,
+                     revenue and units restocked
+
+The rows are kept current by the events that change what they count, in
+the same transaction and with relative F() updates:
+
+    cart_changed(changes)       an item's quantity changed (cart_totals.apply_changes)
+    stock_changed(rows, deltas) Product.stock_quantity changed (inventory)
+    restocked(quantities)       restock movements were recorded (inventory.record)
+    product_added(product)      a product was created
+    products_removed(ids)       ... or are about to be deleted (archived)
+    price_changed(product, old) its retail price was edited (prices_changed: many)
+    order_placed(order, items)  checkout
+
+so a dashboard costs O(buckets), not O(rows). A vendor or product without a
+row yet (seeded data, or rows from before the rollups) is computed from
+scratch on its first event or read instead. `manage.py rebuild_analytics` recomputes everything, including
+the hourly and daily buckets from orders and the stock ledger; run it after
+changing LOW_STOCK_THRESHOLD.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    Case, Count, DecimalField, F, IntegerField, OuterRef, Q, Subquery, Sum, UUIDField, Value, When,
+)
+from django.db.models.functions import Coalesce, Trunc
+from django.utils import timezone
+
+from .models import (
+    ArchivedProduct, CartItem, OrderItem, Product, ProductStats, StockMovement, VendorActivity, VendorStats,
+)
+
+DEFAULTS = {
+    'LOW_STOCK_THRESHOLD': 5,
+    'TOP_PRODUCTS': 20,
+    'BATCH_SIZE': 500,
+}
+
+PERIODS = ('hour', 'day')
+VALUE_FIELD = DecimalField(max_digits=18, decimal_places=2)
+ZERO = Decimal('0.00')
+
+
+def get_analytics_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'ANALYTICS', {}))
+    return config
+
+
+def bucket_start(moment, period):
+    moment = moment.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if period == 'day' else moment
+
+
+def _is_low(stock, threshold):
+    return 1 if stock <= threshold else 0
+
+
+# Gauges
+
+def compute_vendors(vendor_ids):
+    """{vendor_id: {field: value}} for VendorStats, from the products and carts."""
+    threshold = get_analytics_settings()['LOW_STOCK_THRESHOLD']
+    stats = {
+        vendor_id: {'products': 0, 'units_in_carts': 0, 'low_stock': 0, 'catalog_value': ZERO}
+        for vendor_id in vendor_ids
+    }
+    rows = (
+        Product.objects.filter(vendor_id__in=vendor_ids).values('vendor_id')
+        .annotate(
+            count=Count('id'),
+            low=Count('id', filter=Q(stock_quantity__lte=threshold)),
+            value=Sum(F('stock_quantity') * F('retail_price'), output_field=VALUE_FIELD),
+        )
+        .values_list('vendor_id', 'count', 'low', 'value')
+    )
+    for vendor_id, count, low, value in rows:
+        stats[vendor_id].update(products=count, low_stock=low, catalog_value=value or ZERO)
+    units = (
+        CartItem.objects.filter(product__vendor_id__in=vendor_ids).values('product__vendor_id')
+        .annotate(units=Sum('quantity')).values_list('product__vendor_id', 'units')
+    )
+    for vendor_id, total in units:
+        stats[vendor_id]['units_in_carts'] = total
+    return stats
+
+
+def rebuild_products(product_ids):
+    """Recompute and store these products' ProductStats."""
+    units = dict(
+        CartItem.objects.filter(product_id__in=product_ids).values('product_id')
+        .annotate(units=Sum('quantity')).values_list('product_id', 'units')
+    )
+    ProductStats.objects.bulk_create(
+        [
+            ProductStats(product_id=product_id, vendor_id=vendor_id, units_in_carts=units.get(product_id, 0))
+            for product_id, vendor_id in Product.objects.filter(id__in=product_ids).values_list('id', 'vendor_id')
+        ],
+        update_conflicts=True, unique_fields=['product'], update_fields=['units_in_carts'],
+    )
+
+
+def rebuild_vendors(vendor_ids):
+    """Recompute and store these vendors' VendorStats and their products' ProductStats."""
+    vendor_ids = list(vendor_ids)
+    with transaction.atomic():
+        rebuild_products(Product.objects.filter(vendor_id__in=vendor_ids).values_list('id', flat=True))
+        VendorStats.objects.bulk_create(
+            [VendorStats(vendor_id=vendor_id, **values) for vendor_id, values in compute_vendors(vendor_ids).items()],
+            update_conflicts=True, unique_fields=['vendor'],
+            update_fields=['products', 'units_in_carts', 'low_stock', 'catalog_value', 'updated_at'],
+        )
+
+
+def _apply_vendor(vendor_id, deltas):
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return True
+    return VendorStats.objects.filter(vendor_id=vendor_id).update(
+        updated_at=timezone.now(), **{field: F(field) + delta for field, delta in deltas.items()},
+    )
+
+
+def _bump_vendor(vendor_id, **deltas):
+    if not _apply_vendor(vendor_id, deltas):
+        # Computed from scratch, so it already includes this change.
+        rebuild_vendors([vendor_id])
+
+
+def cart_changed(changes):
+    """(product, old_quantity, new_quantity) changes to cart items, as cart_totals.apply_changes gets them."""
+    per_product = defaultdict(int)
+    per_vendor = defaultdict(int)
+    for product, old, new in changes:
+        per_product[product.id] += new - old
+        per_vendor[product.vendor_id] += new - old
+    per_product = {product_id: delta for product_id, delta in per_product.items() if delta}
+    if not per_product:
+        return
+    updated = ProductStats.objects.filter(product_id__in=per_product).update(
+        units_in_carts=F('units_in_carts') + Case(
+            *[When(product_id=product_id, then=Value(delta)) for product_id, delta in per_product.items()],
+            output_field=IntegerField(),
+        )
+    )
+    if updated != len(per_product):
+        rebuild_products(list(per_product))
+    for vendor_id, delta in per_vendor.items():
+        _bump_vendor(vendor_id, units_in_carts=delta)
+
+
+def stock_changed(rows, deltas):
+    """
+    rows of (id, vendor_id, retail_price, stock_quantity, is_active) read
+    right after {product_id: delta} was applied to their stock.
+    """
+    threshold = get_analytics_settings()['LOW_STOCK_THRESHOLD']
+    per_vendor = defaultdict(lambda: {'low_stock': 0, 'catalog_value': ZERO})
+    for product_id, vendor_id, retail_price, stock, _ in rows:
+        delta = deltas[product_id]
+        per_vendor[vendor_id]['low_stock'] += _is_low(stock, threshold) - _is_low(stock - delta, threshold)
+        per_vendor[vendor_id]['catalog_value'] += delta * retail_price
+    for vendor_id, vendor_deltas in per_vendor.items():
+        _bump_vendor(vendor_id, **vendor_deltas)
+
+
+def product_added(product):
+    threshold = get_analytics_settings()['LOW_STOCK_THRESHOLD']
+    _bump_vendor(
+        product.vendor_id,
+        products=1,
+        low_stock=_is_low(product.stock_quantity, threshold),
+        catalog_value=product.stock_quantity * product.retail_price,
+    )
+
+
+def products_removed(product_ids):
+    """Before deleting products, in the transaction that deletes them."""
+    threshold = get_analytics_settings()['LOW_STOCK_THRESHOLD']
+    rows = list(
+        Product.objects.select_for_update(of=('self',)).filter(id__in=product_ids)
+        .values_list('id', 'vendor_id', 'stock_quantity', 'retail_price', 'stats__units_in_carts')
+    )
+    untracked = [product_id for product_id, _, _, _, units in rows if units is None]
+    counted = dict(
+        CartItem.objects.filter(product_id__in=untracked).values('product_id')
+        .annotate(units=Sum('quantity')).values_list('product_id', 'units')
+    ) if untracked else {}
+    per_vendor = defaultdict(lambda: {'products': 0, 'units_in_carts': 0, 'low_stock': 0, 'catalog_value': ZERO})
+    for product_id, vendor_id, stock, retail_price, units in rows:
+        deltas = per_vendor[vendor_id]
+        deltas['products'] -= 1
+        deltas['units_in_carts'] -= counted.get(product_id, 0) if units is None else units
+        deltas['low_stock'] -= _is_low(stock, threshold)
+        deltas['catalog_value'] -= stock * retail_price
+    # No rebuild when a vendor has no row yet: the products still exist,
+    # and the first event after the delete computes the row without them.
+    for vendor_id, deltas in per_vendor.items():
+        _apply_vendor(vendor_id, deltas)
+
+
+def price_changed(product, old_retail_price):
+    """After saving a new retail price, in the transaction that saved it."""
+    if product.retail_price == old_retail_price:
+        return
+    stock = Product.objects.values_list('stock_quantity', flat=True).get(id=product.id)
+    prices_changed([(product.vendor_id, stock, old_retail_price, product.retail_price)])
+
+
+def prices_changed(rows):
+    """rows of (vendor_id, stock_quantity, old_retail_price, new_retail_price) for retail prices just saved."""
+    per_vendor = defaultdict(lambda: ZERO)
+    for vendor_id, stock, old_retail_price, retail_price in rows:
+        per_vendor[vendor_id] += stock * (retail_price - old_retail_price)
+    for vendor_id, delta in per_vendor.items():
+        _bump_vendor(vendor_id, catalog_value=delta)
+
+
+# Activity buckets
+
+def _bump_activity(vendor_id, moment, **deltas):
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    buckets = {period: bucket_start(moment, period) for period in PERIODS}
+    # Creating the buckets up front, rather than on a miss, keeps every
+    # event at two queries.
+    VendorActivity.objects.bulk_create(
+        [VendorActivity(vendor_id=vendor_id, period=period, bucket=bucket) for period, bucket in buckets.items()],
+        ignore_conflicts=True,
+    )
+    VendorActivity.objects.filter(
+        Q(period='hour', bucket=buckets['hour']) | Q(period='day', bucket=buckets['day']), vendor_id=vendor_id,
+    ).update(**{field: F(field) + delta for field, delta in deltas.items()})
+
+
+def restocked(quantities):
+    """{product_id: units} of restock movements just recorded."""
+    per_vendor = defaultdict(int)
+    for product_id, vendor_id in Product.objects.filter(id__in=quantities).values_list('id', 'vendor_id'):
+        per_vendor[vendor_id] += quantities[product_id]
+    now = timezone.now()
+    for vendor_id, units in per_vendor.items():
+        _bump_activity(vendor_id, now, units_restocked=units)
+
+
+def order_placed(order, order_items):
+    per_vendor = defaultdict(lambda: {'units_sold': 0, 'revenue': ZERO})
+    for line in order_items:
+        per_vendor[line.product.vendor_id]['units_sold'] += line.quantity
+        per_vendor[line.product.vendor_id]['revenue'] += line.total_price
+    for vendor_id, deltas in per_vendor.items():
+        _bump_activity(vendor_id, order.created_at, orders=1, **deltas)
+
+
+def _vendor_of_product():
+    """The vendor of the row's product_id, whether the product is live or archived."""
+    return Coalesce(
+        Subquery(Product.objects.filter(id=OuterRef('product_id')).values('vendor_id')[:1]),
+        Subquery(ArchivedProduct.objects.filter(id=OuterRef('product_id')).values('vendor_id')[:1]),
+        output_field=UUIDField(),
+    )
+
+
+def compute_activity(vendor_ids):
+    """{(vendor_id, period, bucket): {field: value}} from orders and restock movements."""
+    activity = defaultdict(lambda: {'orders': 0, 'units_sold': 0, 'revenue': ZERO, 'units_restocked': 0})
+    for period in PERIODS:
+        sales = (
+            OrderItem.objects.annotate(vendor_id=_vendor_of_product())
+            .filter(vendor_id__in=vendor_ids)
+            .annotate(bucket=Trunc('order__created_at', period, tzinfo=datetime.timezone.utc))
+            .values('vendor_id', 'bucket')
+            .annotate(orders=Count('order', distinct=True), units=Sum('quantity'), revenue=Sum('total_price'))
+            .values_list('vendor_id', 'bucket', 'orders', 'units', 'revenue')
+        )
+        for vendor_id, bucket, orders, units, revenue in sales:
+            activity[vendor_id, period, bucket].update(orders=orders, units_sold=units, revenue=revenue)
+        restocks = (
+            StockMovement.objects.filter(kind='restock').annotate(vendor_id=_vendor_of_product())
+            .filter(vendor_id__in=vendor_ids)
+            .annotate(bucket=Trunc('created_at', period, tzinfo=datetime.timezone.utc))
+            .values('vendor_id', 'bucket')
+            .annotate(units=Sum('quantity'))
+            .values_list('vendor_id', 'bucket', 'units')
+        )
+        for vendor_id, bucket, units in restocks:
+            activity[vendor_id, period, bucket]['units_restocked'] = units
+    return activity
+
+
+def rebuild_activity(vendor_ids):
+    with transaction.atomic():
+        VendorActivity.objects.filter(vendor_id__in=vendor_ids).delete()
+        VendorActivity.objects.bulk_create([
+            VendorActivity(vendor_id=vendor_id, period=period, bucket=bucket, **values)
+            for (vendor_id, period, bucket), values in compute_activity(vendor_ids).items()
+        ])
+
+
+def rebuild(vendor_ids, batch_size=None):
+    """Recompute every rollup of these vendors. Returns the number of vendors."""
+    batch_size = batch_size or get_analytics_settings()['BATCH_SIZE']
+    vendor_ids = list(vendor_ids)
+    for start in range(0, len(vendor_ids), batch_size):
+        batch = vendor_ids[start:start + batch_size]
+        rebuild_vendors(batch)
+        rebuild_activity(batch)
+    return len(vendor_ids)
+
+
+def dashboard(vendor, period='hour', buckets=24):
+    """The analytics endpoint's payload: the vendor's gauges, top products and the last `buckets` buckets."""
+    config = get_analytics_settings()
+    stats = VendorStats.objects.filter(vendor=vendor).first()
+    if stats is None:
+        rebuild_vendors([vendor.id])
+        stats = VendorStats.objects.get(vendor=vendor)
+    top_products = (
+        ProductStats.objects.filter(vendor=vendor, units_in_carts__gt=0)
+        .order_by('-units_in_carts').values_list('product_id', 'product__name', 'units_in_carts')
+    )[:config['TOP_PRODUCTS']]
+
+    step = datetime.timedelta(days=1) if period == 'day' else datetime.timedelta(hours=1)
+    last = bucket_start(timezone.now(), period)
+    first = last - step * (buckets - 1)
+    stored = {
+        row['bucket']: row
+        for row in VendorActivity.objects.filter(vendor=vendor, period=period, bucket__gte=first)
+        .values('bucket', 'orders', 'units_sold', 'revenue', 'units_restocked')
+    }
+    series = []
+    for i in range(buckets):
+        bucket = first + step * i
+        row = stored.get(bucket, {'orders': 0, 'units_sold': 0, 'revenue': ZERO, 'units_restocked': 0})
+        series.append({
+            'bucket': bucket,
+            'orders': row['orders'],
+            'units_sold': row['units_sold'],
+            'revenue': row['revenue'],
+            'units_restocked': row['units_restocked'],
+        })
+    return {
+        'summary': {
+            'products': stats.products,
+            'units_in_carts': stats.units_in_carts,
+            'low_stock': stats.low_stock,
+            'low_stock_threshold': config['LOW_STOCK_THRESHOLD'],
+            'catalog_value': stats.catalog_value,
+        },
+        'top_products': [
+            {'id': product_id, 'name': name, 'units_in_carts': units}
+            for product_id, name, units in top_products
+        ],
+        'period': period,
+        'buckets': series,
+    }
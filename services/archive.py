@@ -0,0 +1,95 @@
+"""
+Deactivating and archiving products.
+
+Products are never deleted outright: deleting one deactivates it
+(deactivate()), which takes it off the list and out of the facet counts
+but keeps the row, so orders, the stock ledger and the vendor's own views
+still find it. Its cart items are left to the cart sweeper
+(services/cleanup.py).
+
+Products inactive for AFTER_DAYS are then moved out of Product, which every
+catalog query scans, into ArchivedProduct by archive_products(), in
+primary-key-ordered batches of BATCH_SIZE, one short transaction each,
+sleeping SLEEP seconds between batches. An archived product keeps its id;
+VendorProductDetailView still returns it. Run it from cron with
+`manage.py archive_products`.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import analytics, events, facets
+from .cleanup import batches, remove_items
+from .models import ArchivedProduct, CartItem, Product
+
+DEFAULTS = {
+    'AFTER_DAYS': 90,
+    'BATCH_SIZE': 500,
+    'SLEEP': 0.5,
+}
+
+# Copied as they are to ArchivedProduct.
+ARCHIVED_FIELDS = (
+    'id', 'name', 'description', 'vendor_id', 'retail_price', 'whole_sale_price', 'stock_quantity',
+    'created_at', 'updated_at', 'deactivated_at',
+)
+
+
+def get_archive_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'PRODUCT_ARCHIVE', {}))
+    return config
+
+
+def deactivate(product):
+    """Soft-delete the product: it stays, inactive, until it is archived."""
+    with transaction.atomic():
+        before = facets.cells([product.id], lock=True)
+        product.is_active = False
+        product.deactivated_at = timezone.now()
+        product.save(update_fields=['is_active', 'deactivated_at', 'updated_at'])
+        facets.update(before, {product.id: None})
+        events.product_changed({product.id: {'is_active': False}})
+
+
+def archive_batch(product_ids, cutoff):
+    """Move these products to ArchivedProduct if still inactive since before cutoff. Returns how many."""
+    with transaction.atomic():
+        # Items first, as checkout locks them before the products. Ones the
+        # cart sweeper hasn't removed yet go this way, so cart totals and
+        # analytics see them go, rather than cascading with the product.
+        remove_items(CartItem.objects.filter(product_id__in=product_ids, product__is_active=False))
+        # Locked, and checked again, so a product reactivated meanwhile stays.
+        products = list(
+            Product.objects.select_for_update().filter(id__in=product_ids, is_active=False, deactivated_at__lt=cutoff)
+            .order_by('id').values(*ARCHIVED_FIELDS)
+        )
+        if not products:
+            return 0
+        ids = [product['id'] for product in products]
+        ArchivedProduct.objects.bulk_create([ArchivedProduct(**product) for product in products])
+        analytics.products_removed(ids)
+        Product.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def archive_products(after_days=None, batch_size=None, pause=None, dry_run=False, sleep=time.sleep):
+    """Archive products inactive for after_days. Returns how many."""
+    config = get_archive_settings()
+    after_days = config['AFTER_DAYS'] if after_days is None else after_days
+    batch_size = batch_size or config['BATCH_SIZE']
+    pause = config['SLEEP'] if pause is None else pause
+    cutoff = timezone.now() - datetime.timedelta(days=after_days)
+
+    archived = 0
+    for ids in batches(Product.objects.filter(is_active=False, deactivated_at__lt=cutoff), batch_size):
+        if dry_run:
+            archived += len(ids)
+            continue
+        archived += archive_batch(ids, cutoff)
+        if pause:
+            sleep(pause)
+    return archived
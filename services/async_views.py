@@ -0,0 +1,140 @@
+"""
+Async versions of the catalog and cart read endpoints.
+
+DRF's APIView only dispatches synchronous handlers, so these are plain
+Django async views. They authenticate with the same JWTs, apply the same
+throttles and permission checks, and render the same JSON as their sync
+counterparts in views.py, but the ORM and cache calls are awaited instead
+of holding a thread for the whole request under ASGI.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from authentication.permissions import IsVendor
+from SaaS_Practice.renderers import FastJSONRenderer
+from . import facets
+from .catalog import PRODUCT_LIST_TIMEOUT, acatalog_generation, product_list_key
+from .models import Cart, CartItem, Product
+from .serializers import CART_ITEM_COLUMNS, PRODUCT_COLUMNS, cart_data, product_data
+
+
+def render(data, status_code=status.HTTP_200_OK, headers=None):
+    response = HttpResponse(FastJSONRenderer().render(data), status=status_code, content_type='application/json')
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
+
+
+def render_error(exc):
+    headers = {}
+    if getattr(exc, 'auth_header', None):
+        headers['WWW-Authenticate'] = exc.auth_header
+    if getattr(exc, 'wait', None) is not None:
+        headers['Retry-After'] = str(int(exc.wait))
+    # Same body shapes as rest_framework.views.exception_handler.
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return render(data, exc.status_code, headers)
+
+
+async def aauthenticate(request):
+    """
+    JWTAuthentication.authenticate() with the user lookup in the thread
+    pool. Token decoding is CPU-only, so it stays synchronous; get_user()
+    is simplejwt's own, so its active-user and revocation checks apply.
+    """
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    if header is None:
+        return AnonymousUser()
+    raw_token = authentication.get_raw_token(header)
+    if raw_token is None:
+        return AnonymousUser()
+    validated_token = authentication.get_validated_token(raw_token)
+    return await sync_to_async(authentication.get_user)(validated_token)
+
+
+class AsyncAPIView(View):
+    """
+    Authentication, permission and throttling for async read views, in the
+    order APIView.initial() runs them. Subclasses implement `aget`.
+    """
+    http_method_names = ['get', 'options']
+    require_authentication = True
+    permission = None
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+
+    def get_throttles(self):
+        return [throttle() for throttle in self.throttle_classes]
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            request.user = await aauthenticate(request)
+        except exceptions.AuthenticationFailed as exc:
+            exc.auth_header = 'Bearer realm="api"'
+            return render_error(exc)
+
+        if self.require_authentication and not request.user.is_authenticated:
+            exc = exceptions.NotAuthenticated()
+            exc.auth_header = 'Bearer realm="api"'
+            return render_error(exc)
+        if self.permission and not self.permission().has_permission(request, self):
+            return render_error(exceptions.PermissionDenied(self.permission.message))
+
+        # The rate counters live in the cache; the DRF throttles only have a
+        # sync API, so they run in the thread pool.
+        for throttle in self.get_throttles():
+            if not await sync_to_async(throttle.allow_request)(request, self):
+                return render_error(exceptions.Throttled(throttle.wait()))
+
+        return await self.aget(request, *args, **kwargs)
+
+    async def aget(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+
+class AsyncProductListView(AsyncAPIView):
+    require_authentication = False
+
+    async def aget(self, request):
+        try:
+            filters = facets.parse_filters(request.GET)
+        except ValueError as e:
+            return render({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
+
+        key = product_list_key(await acatalog_generation(), facets.filters_key(filters))
+        cached_data = await cache.aget(key)
+        if cached_data is not None:
+            return render(cached_data)
+
+        products = facets.filter_products(Product.objects.filter(is_active=True, stock_quantity__gt=0), filters)
+        rows = [row async for row in products.values_list(*PRODUCT_COLUMNS)]
+        data = product_data(rows)
+        await cache.aset(key, data, timeout=PRODUCT_LIST_TIMEOUT)
+        return render(data)
+
+
+class AsyncCartView(AsyncAPIView):
+
+    async def aget(self, request):
+        user = request.user
+        if user.user_type not in ['normal_customer', 'vip_customer'] or not user.is_fully_active():
+            return render({"error": "Customer access required"}, status.HTTP_403_FORBIDDEN)
+
+        cart, created = await Cart.objects.aget_or_create(user=user)
+        cart.user = user
+        rows = [row async for row in CartItem.objects.filter(cart=cart).values_list(*CART_ITEM_COLUMNS)]
+        return render(cart_data(cart, rows))
+
+
+class AsyncVendorProductListView(AsyncAPIView):
+    permission = IsVendor
+
+    async def aget(self, request):
+        rows = [row async for row in Product.objects.filter(vendor=request.user).values_list(*PRODUCT_COLUMNS)]
+        return render(product_data(rows, request.user))
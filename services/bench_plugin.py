@@ -0,0 +1,57 @@
+"""
+pytest plugin for the endpoint benchmarks (requires pytest-django).
+
+    pytest -p services.bench_plugin --ds=SaaS_Practice.settings \
+        --bench-baseline=bench.json --bench-output=bench-new.json
+
+Tests request the `endpoint_benchmark` fixture and call it; the test fails
+when a scenario regresses against --bench-baseline.
+
+    def test_endpoint_performance(endpoint_benchmark):
+        endpoint_benchmark(scenarios=['product_list', 'cart_get'])
+"""
+import json
+
+import pytest
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('endpoint-bench', 'endpoint benchmarks')
+    group.addoption('--bench-iterations', type=int, default=100)
+    group.addoption('--bench-warmup', type=int, default=10)
+    group.addoption('--bench-baseline', help='Result file to compare against.')
+    group.addoption('--bench-threshold', type=float, default=0.2)
+    group.addoption('--bench-output', help='Write results to this file.')
+
+
+@pytest.fixture
+def endpoint_benchmark(request, db):
+    # Imported here: plugins load before pytest-django configures Django.
+    from services.benchmarks import Dataset, EndpointBenchmark, benchmark_settings, find_regressions
+
+    config = request.config
+
+    def run(scenarios=None, **dataset_options):
+        with benchmark_settings():
+            dataset = Dataset(**dataset_options).create()
+            bench = EndpointBenchmark(
+                dataset,
+                iterations=config.getoption('bench_iterations'),
+                warmup=config.getoption('bench_warmup'),
+            )
+            results = bench.run(scenarios)
+
+        output = config.getoption('bench_output')
+        if output:
+            with open(output, 'w') as fh:
+                json.dump(results, fh, indent=2)
+
+        baseline_path = config.getoption('bench_baseline')
+        if baseline_path:
+            with open(baseline_path) as fh:
+                regressions = find_regressions(json.load(fh), results, config.getoption('bench_threshold'))
+            if regressions:
+                pytest.fail("Performance regressions:\n  " + "\n  ".join(regressions))
+        return results
+
+    return run
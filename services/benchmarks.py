@@ -0,0 +1,411 @@
+"""
+Reproducible endpoint benchmarks.
+
+Seeds a deterministic dataset, drives the catalog, cart, vendor and login
+endpoints through the Django test client and reports throughput, latency
+percentiles and query counts. Used by `manage.py bench_endpoints` and the
+pytest plugin in services/bench_plugin.py.
+
+ConcurrencyBenchmark drives the sync read views and their async versions
+(services/async_views.py) with many requests in flight through the async
+test client, for `manage.py bench_async_views`. serialization_benchmark()
+times ProductSerializer against the values()-based fast path for
+`manage.py bench_serialization`.
+"""
+import asyncio
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authentication.models import User
+from SaaS_Practice.renderers import FastJSONRenderer
+from .catalog import catalog_generation, product_list_key
+from .models import Cart, CartItem, Product
+from .serializers import ProductSerializer, serialize_products
+
+BENCH_PASSWORD = 'Bench@12345'
+EMAIL_DOMAIN = 'bench.example.com'
+
+# Throttles would reject most of the traffic a benchmark generates.
+UNTHROTTLED_RATES = {
+    scope: '1000000/s' for scope in ('anon', 'user', 'login', 'otp_verify', 'resend_otp')
+}
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@contextmanager
+def benchmark_settings(isolated_cache=True):
+    overrides = {
+        'REST_FRAMEWORK': {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': UNTHROTTLED_RATES},
+    }
+    if isolated_cache:
+        overrides['CACHES'] = LOCMEM_CACHES
+    with override_settings(**overrides):
+        yield
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Dataset:
+    def __init__(self, customers=50, vip_ratio=0.2, vendors=5, products_per_vendor=200, cart_items=10, seed=42):
+        self.customers = customers
+        self.vip_ratio = vip_ratio
+        self.vendors = vendors
+        self.products_per_vendor = products_per_vendor
+        self.cart_items = cart_items
+        self.seed = seed
+
+    def describe(self):
+        return {
+            'customers': self.customers,
+            'vip_ratio': self.vip_ratio,
+            'vendors': self.vendors,
+            'products_per_vendor': self.products_per_vendor,
+            'cart_items': self.cart_items,
+            'seed': self.seed,
+        }
+
+    def create(self):
+        rng = random.Random(self.seed)
+        # One hash for every account: hashing per user would dominate seeding.
+        password = make_password(BENCH_PASSWORD)
+        now = timezone.now()
+
+        vendors = [
+            User(email=f"vendor{i}@{EMAIL_DOMAIN}", full_name=f"Vendor {i}", user_type='vendor',
+                 password=password, is_verified=True, is_approved=True, approved_at=now)
+            for i in range(self.vendors)
+        ]
+        customers = [
+            User(email=f"customer{i}@{EMAIL_DOMAIN}", full_name=f"Customer {i}",
+                 user_type='vip_customer' if rng.random() < self.vip_ratio else 'normal_customer',
+                 password=password, is_verified=True, is_approved=True, approved_at=now)
+            for i in range(self.customers)
+        ]
+        User.objects.bulk_create(vendors + customers, batch_size=1000)
+
+        products = []
+        for vendor in vendors:
+            for i in range(self.products_per_vendor):
+                retail = Decimal(rng.randint(500, 50000)) / 100
+                products.append(Product(
+                    name=f"{vendor.full_name} item {i}",
+                    description="Benchmark product",
+                    vendor=vendor,
+                    retail_price=retail,
+                    whole_sale_price=(retail * Decimal('0.8')).quantize(Decimal('0.01')),
+                    stock_quantity=rng.randint(1000, 100000),
+                ))
+        Product.objects.bulk_create(products, batch_size=1000)
+
+        carts = [Cart(user=customer) for customer in customers]
+        Cart.objects.bulk_create(carts, batch_size=1000)
+        items = []
+        self.cart_products = {}
+        for customer, cart in zip(customers, carts):
+            picked = rng.sample(products, min(self.cart_items, len(products)))
+            self.cart_products[customer.pk] = [product.id for product in picked]
+            for product in picked:
+                items.append(CartItem(cart=cart, product=product, quantity=rng.randint(1, 5)))
+        CartItem.objects.bulk_create(items, batch_size=1000)
+
+        self.vendor_users = vendors
+        self.customer_users = customers
+        self.products = products
+        return self
+
+
+class EndpointBenchmark:
+    """Runs each scenario `iterations` times after `warmup` untimed requests."""
+
+    def __init__(self, dataset, iterations=200, warmup=20):
+        self.dataset = dataset
+        self.iterations = iterations
+        self.warmup = warmup
+        self.client = Client()
+        self.rng = random.Random(dataset.seed)
+        self._tokens = {}
+
+    def auth_header(self, user):
+        if user.pk not in self._tokens:
+            self._tokens[user.pk] = f"Bearer {RefreshToken.for_user(user).access_token}"
+        return {'HTTP_AUTHORIZATION': self._tokens[user.pk]}
+
+    def pick_customer(self):
+        return self.rng.choice(self.dataset.customer_users)
+
+    def pick_vendor_product(self):
+        vendor = self.rng.choice(self.dataset.vendor_users)
+        start = self.dataset.vendor_users.index(vendor) * self.dataset.products_per_vendor
+        product = self.dataset.products[start + self.rng.randrange(self.dataset.products_per_vendor)]
+        return vendor, product
+
+    # Each scenario performs one request and returns the response.
+
+    def product_list(self):
+        return self.client.get('/Products/products/')
+
+    def product_list_uncached(self):
+        cache.delete(product_list_key(catalog_generation()))
+        return self.client.get('/Products/products/')
+
+    def cart_get(self):
+        return self.client.get('/Products/cart/', **self.auth_header(self.pick_customer()))
+
+    def cart_add(self):
+        product = self.rng.choice(self.dataset.products)
+        return self.client.post(
+            '/Products/cart/', {'product_id': str(product.id), 'quantity': 1},
+            content_type='application/json', **self.auth_header(self.pick_customer()),
+        )
+
+    def cart_update(self):
+        customer = self.pick_customer()
+        product_id = self.rng.choice(self.dataset.cart_products[customer.pk])
+        return self.client.put(
+            '/Products/manage-cart-products/', {'product_id': str(product_id), 'quantity': 2},
+            content_type='application/json', **self.auth_header(customer),
+        )
+
+    def vendor_product_list(self):
+        vendor = self.rng.choice(self.dataset.vendor_users)
+        return self.client.get('/Products/vendor/products/', **self.auth_header(vendor))
+
+    def vendor_product_detail(self):
+        vendor, product = self.pick_vendor_product()
+        return self.client.get(f'/Products/vendor/products/{product.id}/', **self.auth_header(vendor))
+
+    def vendor_product_update(self):
+        vendor, product = self.pick_vendor_product()
+        return self.client.patch(
+            f'/Products/vendor/products/{product.id}/', {'stock_quantity': self.rng.randint(1000, 100000)},
+            content_type='application/json', **self.auth_header(vendor),
+        )
+
+    def login(self):
+        customer = self.pick_customer()
+        return self.client.post(
+            '/api/login/', {'email': customer.email, 'password': BENCH_PASSWORD},
+            content_type='application/json',
+        )
+
+    SCENARIOS = (
+        'product_list',
+        'product_list_uncached',
+        'cart_get',
+        'cart_add',
+        'cart_update',
+        'vendor_product_list',
+        'vendor_product_detail',
+        'vendor_product_update',
+        'login',
+    )
+
+    def run_scenario(self, name):
+        request = getattr(self, name)
+        for _ in range(self.warmup):
+            request()
+
+        latencies = []
+        query_counts = []
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(self.iterations):
+            with CaptureQueriesContext(connections['default']) as queries:
+                request_started = time.perf_counter()
+                response = request()
+                latencies.append(time.perf_counter() - request_started)
+            query_counts.append(len(queries))
+            if response.status_code >= 400:
+                errors += 1
+        elapsed = time.perf_counter() - started
+
+        return {
+            'iterations': self.iterations,
+            'errors': errors,
+            'requests_per_second': round(self.iterations / elapsed, 1),
+            'latency_ms': latency_summary(latencies),
+            'queries_per_request': round(statistics.fmean(query_counts), 2),
+            'max_queries': max(query_counts),
+        }
+
+    def run(self, scenarios=None):
+        results = {}
+        for name in scenarios or self.SCENARIOS:
+            if name not in self.SCENARIOS:
+                raise ValueError(f"Unknown scenario {name!r}; choose from {', '.join(self.SCENARIOS)}")
+            results[name] = self.run_scenario(name)
+        return {
+            'timestamp': timezone.now().isoformat(),
+            'database': connections['default'].vendor,
+            'dataset': self.dataset.describe(),
+            'iterations': self.iterations,
+            'scenarios': results,
+        }
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'mean': round(statistics.fmean(latencies) * 1000, 3),
+        'p50': round(percentile(latencies, 50) * 1000, 3),
+        'p90': round(percentile(latencies, 90) * 1000, 3),
+        'p99': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+class ConcurrencyBenchmark:
+    """
+    Sends `requests` requests to each view with `concurrency` of them in
+    flight at once. Every request gets its own ThreadSensitiveContext, as
+    it would under the ASGI handler, so sync views run on separate threads
+    instead of queueing behind one.
+    """
+
+    # name: (sync path, async path, who makes the request)
+    ENDPOINTS = {
+        'product_list': ('/Products/products/', '/Products/async/products/', None),
+        'cart_get': ('/Products/cart/', '/Products/async/cart/', 'customer'),
+        'vendor_product_list': ('/Products/vendor/products/', '/Products/async/vendor/products/', 'vendor'),
+    }
+
+    def __init__(self, dataset, requests=500, concurrency=20, warmup=20):
+        self.dataset = dataset
+        self.requests = requests
+        self.concurrency = concurrency
+        self.warmup = warmup
+        # Issuing a token writes an OutstandingToken row, which can't happen
+        # inside the event loop, so every header is built up front.
+        self.headers = {
+            user.pk: {'Authorization': f"Bearer {RefreshToken.for_user(user).access_token}"}
+            for user in dataset.customer_users + dataset.vendor_users
+        }
+
+    def request_headers(self, rng, caller):
+        if caller is None:
+            return {}
+        users = self.dataset.customer_users if caller == 'customer' else self.dataset.vendor_users
+        return self.headers[rng.choice(users).pk]
+
+    async def drive(self, path, caller):
+        client = AsyncClient()
+        rng = random.Random(self.dataset.seed)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies = []
+        errors = 0
+
+        async def one(record=True):
+            nonlocal errors
+            headers = self.request_headers(rng, caller)
+            async with semaphore, ThreadSensitiveContext():
+                started = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                if record:
+                    latencies.append(time.perf_counter() - started)
+                    errors += response.status_code >= 400
+
+        await asyncio.gather(*(one(record=False) for _ in range(self.warmup)))
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(self.requests)))
+        elapsed = time.perf_counter() - started
+        return {
+            'requests': self.requests,
+            'errors': errors,
+            'requests_per_second': round(self.requests / elapsed, 1),
+            'latency_ms': latency_summary(latencies),
+        }
+
+    def run(self, endpoints=None):
+        results = {}
+        for name in endpoints or self.ENDPOINTS:
+            if name not in self.ENDPOINTS:
+                raise ValueError(f"Unknown endpoint {name!r}; choose from {', '.join(self.ENDPOINTS)}")
+            sync_path, async_path, caller = self.ENDPOINTS[name]
+            sync_result = asyncio.run(self.drive(sync_path, caller))
+            async_result = asyncio.run(self.drive(async_path, caller))
+            results[name] = {
+                'sync': sync_result,
+                'async': async_result,
+                'speedup': round(async_result['requests_per_second'] / sync_result['requests_per_second'], 2),
+            }
+        return {
+            'timestamp': timezone.now().isoformat(),
+            'database': connections['default'].vendor,
+            'dataset': self.dataset.describe(),
+            'concurrency': self.concurrency,
+            'endpoints': results,
+        }
+
+
+def serialization_benchmark(user, repeat=5):
+    """
+    Query, serialize and render every product for `user`, once through
+    ProductSerializer + JSONRenderer and once through serialize_products +
+    FastJSONRenderer. Reports the best of `repeat` runs for each.
+    """
+    request = type('Request', (), {'user': user})()
+
+    def drf():
+        queryset = Product.objects.select_related('vendor')
+        return JSONRenderer().render(ProductSerializer(queryset, many=True, context={'request': request}).data)
+
+    def fast():
+        return FastJSONRenderer().render(serialize_products(Product.objects.all(), user))
+
+    results = {}
+    outputs = {}
+    for name, render in (('drf', drf), ('fast', fast)):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            outputs[name] = render()
+            timings.append(time.perf_counter() - started)
+        results[name] = {'best_ms': round(min(timings) * 1000, 1), 'mean_ms': round(statistics.fmean(timings) * 1000, 1)}
+    return {
+        'products': Product.objects.count(),
+        'bytes': len(outputs['fast']),
+        'identical': outputs['drf'] == outputs['fast'],
+        **results,
+        'speedup': round(results['drf']['best_ms'] / results['fast']['best_ms'], 2),
+    }
+
+
+def find_regressions(baseline, current, threshold=0.2):
+    """
+    Compare two result documents. A scenario regresses when its p50 latency
+    grows by more than `threshold` (a fraction), when it issues more queries
+    per request than before, or when it starts returning errors.
+    """
+    regressions = []
+    for name, result in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        old_p50, new_p50 = before['latency_ms']['p50'], result['latency_ms']['p50']
+        if old_p50 and (new_p50 - old_p50) / old_p50 > threshold:
+            regressions.append(f"{name}: p50 latency {old_p50}ms -> {new_p50}ms")
+        if result['queries_per_request'] > before['queries_per_request']:
+            regressions.append(
+                f"{name}: queries per request {before['queries_per_request']} -> {result['queries_per_request']}"
+            )
+        if result['errors'] > before['errors']:
+            regressions.append(f"{name}: errors {before['errors']} -> {result['errors']}")
+    return regressions
@@ -0,0 +1,126 @@
+"""
+Bulk stock and price updates, for vendors syncing their catalog from an ERP.
+
+update_products() takes rows of {'id', 'stock_quantity', 'retail_price',
+'whole_sale_price'} (every field but id optional) and applies all of them
+or none, in one transaction with a fixed number of queries however many
+rows there are:
+
+    prices   one UPDATE with a CASE per product
+    stock    inventory.set_stocks(): one UPDATE, with the differences in
+             the stock ledger as adjustments
+
+The wholesale < retail rule is checked for every row against the stored
+prices before anything is written. One ProductChanged event carries every
+product's diff, so the catalog cache is invalidated once; its handler also
+reprices the carts holding the repriced products, in batches of their own
+once this has committed (services/cart_totals.py).
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, Value, When
+from django.utils import timezone
+
+from . import analytics, events, facets
+from .inventory import set_stocks
+from .models import Product
+
+DEFAULTS = {
+    'MAX_ROWS': 5000,
+}
+
+PRICE_FIELDS = ('retail_price', 'whole_sale_price')
+
+
+def get_bulk_update_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'PRODUCT_BULK_UPDATE', {}))
+    return config
+
+
+class BulkUpdateError(Exception):
+    def __init__(self, message, rows):
+        # [{'id', 'error'}, ...]
+        self.rows = rows
+        super().__init__(message)
+
+
+def _per_product(values):
+    return Case(
+        *[When(id=product_id, then=Value(value)) for product_id, value in values.items()],
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+def update_products(vendor, rows):
+    """
+    Apply validated rows to the vendor's products. Returns counts of
+    {'updated', 'repriced', 'restocked'} products, or raises BulkUpdateError
+    with nothing changed.
+    """
+    updates = {row['id']: row for row in rows}
+    if len(updates) != len(rows):
+        seen, duplicates = set(), set()
+        for row in rows:
+            (duplicates if row['id'] in seen else seen).add(row['id'])
+        raise BulkUpdateError("Duplicate products", [
+            {'id': str(product_id), 'error': "Listed more than once"} for product_id in sorted(duplicates, key=str)
+        ])
+
+    with transaction.atomic():
+        stored = {
+            product_id: {
+                'retail_price': retail_price, 'whole_sale_price': whole_sale_price,
+                'stock_quantity': stock, 'is_active': is_active,
+            }
+            for product_id, retail_price, whole_sale_price, stock, is_active
+            in Product.objects.select_for_update().filter(vendor=vendor, id__in=updates).order_by('id')
+            .values_list('id', 'retail_price', 'whole_sale_price', 'stock_quantity', 'is_active')
+        }
+        errors = [{'id': str(product_id), 'error': "Not found"} for product_id in updates if product_id not in stored]
+        for product_id, row in updates.items():
+            if product_id not in stored:
+                continue
+            prices = {field: row.get(field, stored[product_id][field]) for field in PRICE_FIELDS}
+            if prices['whole_sale_price'] >= prices['retail_price']:
+                errors.append({'id': str(product_id), 'error': "Wholesale price must be less than retail price"})
+        if errors:
+            raise BulkUpdateError("Invalid products", errors)
+
+        changes = {product_id: {} for product_id in updates}
+        new_prices = {field: {} for field in PRICE_FIELDS}
+        for product_id, row in updates.items():
+            for field in PRICE_FIELDS:
+                if field in row and row[field] != stored[product_id][field]:
+                    new_prices[field][product_id] = changes[product_id][field] = row[field]
+        repriced = new_prices['retail_price'].keys() | new_prices['whole_sale_price'].keys()
+        if repriced:
+            Product.objects.filter(id__in=repriced).update(
+                updated_at=timezone.now(),
+                **{field: _per_product(values) for field, values in new_prices.items() if values},
+            )
+            # The stock isn't changed yet, so these only move the price.
+            retail = new_prices['retail_price']
+            config = facets.get_facet_settings()
+            before, after = {}, {}
+            for product_id, price in retail.items():
+                old = stored[product_id]
+                before[product_id] = facets.cell(
+                    vendor.id, old['retail_price'], old['stock_quantity'], old['is_active'], config,
+                )
+                after[product_id] = facets.cell(vendor.id, price, old['stock_quantity'], old['is_active'], config)
+            facets.update(before, after)
+            analytics.prices_changed([
+                (vendor.id, stored[product_id]['stock_quantity'], stored[product_id]['retail_price'], price)
+                for product_id, price in retail.items()
+            ])
+
+        stock = {product_id: row['stock_quantity'] for product_id, row in updates.items() if 'stock_quantity' in row}
+        restocked = set_stocks(stock, 'bulk update') if stock else {}
+        for product_id in restocked:
+            changes[product_id]['stock_quantity'] = stock[product_id]
+
+        changes = {product_id: product_changes for product_id, product_changes in changes.items() if product_changes}
+        if changes:
+            events.product_changed(changes)
+    return {'updated': len(changes), 'repriced': len(repriced), 'restocked': len(restocked)}
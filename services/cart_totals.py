@@ -0,0 +1,185 @@
+"""
+Denormalized cart totals.
+
+Every cart has one CartTotal row per pricing tier, so reading its summary
+is one row whatever the cart holds, and stays right if its owner changes
+tier. Item changes adjust the rows in place with F() expressions, inside
+the transaction that changed the items:
+
+    apply_changes(cart, [(product, old_quantity, new_quantity), ...])
+
+A cart whose rows don't exist yet (older carts, or ones only ever filled
+outside the tracked views) is rebuilt from its items instead. So is every
+cart holding a product whose prices change, but not in the write's
+transaction: the ProductChanged event's handler queues a CartsRepriced
+event (reprice_later), which the outbox runs BATCH_SIZE carts at a time,
+each batch in its own transaction, so those carts' rows trail the new
+prices by a dispatch or so.
+Cart.total_price / total_items fall back to summing the items while a cart
+has no rows. `manage.py check_cart_totals` compares the rows with a fresh
+recomputation.
+
+apply_changes() also passes the changes on to the vendor analytics
+(services/analytics.py), which count the units sitting in carts.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+
+from Notifications import outbox
+
+from . import analytics
+from .models import Cart, CartItem, CartTotal
+from .pricing import TIER_PRICE_FIELDS, get_tier
+
+TOTAL_FIELD = DecimalField(max_digits=15, decimal_places=2)
+ZERO = Decimal('0.00')
+BATCH_SIZE = 500
+
+
+def all_tiers():
+    return [get_tier(name) for name in TIER_PRICE_FIELDS]
+
+
+def _line_total(tier, product, quantity):
+    if not quantity:
+        return ZERO
+    return tier.product_price(product, quantity) * quantity
+
+
+def initialize(cart):
+    """Zero totals for a cart created empty."""
+    CartTotal.objects.bulk_create(
+        [CartTotal(cart_id=cart.id, tier=name) for name in TIER_PRICE_FIELDS], ignore_conflicts=True,
+    )
+
+
+def apply_changes(cart, changes):
+    """
+    Adjust the cart's totals for (product, old_quantity, new_quantity)
+    changes. Call it in the transaction that made them, with the changed
+    items locked, so the old quantities are the ones replaced.
+    """
+    changes = [(product, old, new) for product, old, new in changes if old != new]
+    if not changes:
+        return
+    # Cart.updated_at is when its items last changed; idle carts are swept
+    # by it (services/cleanup.py).
+    Cart.objects.filter(id=cart.id).update(updated_at=timezone.now())
+    analytics.cart_changed(changes)
+    tiers = all_tiers()
+    price_deltas = {
+        tier.name: sum(
+            (_line_total(tier, product, new) - _line_total(tier, product, old) for product, old, new in changes),
+            ZERO,
+        )
+        for tier in tiers
+    }
+    updated = CartTotal.objects.filter(cart_id=cart.id).update(
+        total_items=F('total_items') + sum(new - old for _, old, new in changes),
+        total_price=F('total_price') + Case(
+            *[When(tier=name, then=Value(delta)) for name, delta in price_deltas.items()],
+            default=Value(ZERO),
+            output_field=TOTAL_FIELD,
+        ),
+    )
+    if updated != len(tiers):
+        rebuild([cart.id])
+
+
+def compute(cart_ids):
+    """{(cart_id, tier): (total_items, total_price)} recomputed from the items."""
+    lines = defaultdict(list)
+    rows = CartItem.objects.filter(cart_id__in=cart_ids).values_list(
+        'cart_id', 'product__retail_price', 'product__whole_sale_price', 'quantity',
+    )
+    for cart_id, retail_price, whole_sale_price, quantity in rows:
+        lines[cart_id].append((retail_price, whole_sale_price, quantity))
+    totals = {}
+    for tier in all_tiers():
+        for cart_id in cart_ids:
+            cart_lines = lines.get(cart_id, [])
+            totals[cart_id, tier.name] = (
+                sum(quantity for _, _, quantity in cart_lines),
+                sum((line_total for _, line_total in tier.line_prices(cart_lines)), ZERO),
+            )
+    return totals
+
+
+def rebuild(cart_ids):
+    """Recompute and store these carts' totals."""
+    with transaction.atomic():
+        # Locked so carts can't be deleted under us, and so item changes
+        # still in flight wait and then apply their delta on top; ones
+        # that already committed are in what we read.
+        cart_ids = list(Cart.objects.select_for_update().filter(id__in=cart_ids).values_list('id', flat=True))
+        list(CartTotal.objects.select_for_update().filter(cart_id__in=cart_ids).values_list('id'))
+        CartTotal.objects.bulk_create(
+            [
+                CartTotal(cart_id=cart_id, tier=tier, total_items=items, total_price=price)
+                for (cart_id, tier), (items, price) in compute(cart_ids).items()
+            ],
+            update_conflicts=True, unique_fields=['cart', 'tier'], update_fields=['total_items', 'total_price'],
+        )
+
+
+def rebuild_carts(cart_ids, batch_size=None):
+    batch_size = batch_size or BATCH_SIZE
+    cart_ids = list(cart_ids)
+    for start in range(0, len(cart_ids), batch_size):
+        rebuild(cart_ids[start:start + batch_size])
+    return len(cart_ids)
+
+
+def reprice_later(product_ids):
+    """Queue a rebuild of every cart holding these products, after their prices changed."""
+    if product_ids:
+        outbox.emit('CartsRepriced', {'products': sorted(str(product_id) for product_id in product_ids), 'after': None})
+
+
+def deliver_carts_repriced(payload, batch_size=None):
+    """Outbox handler: rebuild the next batch of carts, and queue the rest as another event."""
+    batch_size = batch_size or BATCH_SIZE
+    carts = (
+        CartItem.objects.filter(product_id__in=payload['products'])
+        .order_by('cart_id').values_list('cart_id', flat=True).distinct()
+    )
+    if payload['after']:
+        carts = carts.filter(cart_id__gt=payload['after'])
+    cart_ids = list(carts[:batch_size])
+    rebuild(cart_ids)
+    if len(cart_ids) == batch_size:
+        outbox.emit('CartsRepriced', {'products': payload['products'], 'after': str(cart_ids[-1])})
+
+
+def check(batch_size=None):
+    """
+    Compare every cart's stored totals with a recomputation. Returns
+    [(cart_id, tier, stored, expected)] with stored None for carts that
+    have items but no row.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    carts = Cart.objects.order_by('id').values_list('id', flat=True)
+    mismatches = []
+    last_id = None
+    while True:
+        page = list((carts if last_id is None else carts.filter(id__gt=last_id))[:batch_size])
+        if not page:
+            return mismatches
+        stored = {
+            (cart_id, tier): (items, price)
+            for cart_id, tier, items, price in CartTotal.objects.filter(cart_id__in=page)
+            .values_list('cart_id', 'tier', 'total_items', 'total_price')
+        }
+        materialized = {cart_id for cart_id, _ in stored}
+        for key, expected in compute(page).items():
+            cart_id, tier = key
+            if key in stored:
+                if stored[key] != expected:
+                    mismatches.append((cart_id, tier, stored[key], expected))
+            elif cart_id in materialized or expected[0]:
+                mismatches.append((cart_id, tier, None, expected))
+        last_id = page[-1]
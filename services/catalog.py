@@ -0,0 +1,67 @@
+"""
+Generation-keyed caching for the public product list.
+
+The cached list lives under product_list:<generation> (with a suffix per
+combination of facet filters, see services/facets.py), and its facet counts
+under product_facets:<generation>:<filters>. Anything that changes
+what the list shows bumps the generation instead of deleting the key, so a
+request that computed the list from the old data can only ever store it
+under the old, no longer read, key; those entries just expire. Writes do
+that by recording a ProductChanged event (services/events.py), whose
+outbox handler calls bump_catalog_generation(); with no dispatch_outbox
+worker running, the list stays as it was until its timeout.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+GENERATION_KEY = 'catalog:generation'
+PRODUCT_LIST_TIMEOUT = 300
+
+
+def _initial_generation():
+    # Seeded from the clock so a generation key lost to eviction never
+    # restarts at a number whose product list is still cached.
+    return int(time.time() * 1000)
+
+
+def catalog_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        initial = _initial_generation()
+        cache.add(GENERATION_KEY, initial, timeout=None)
+        generation = cache.get(GENERATION_KEY, initial)
+    return generation
+
+
+async def acatalog_generation():
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        initial = _initial_generation()
+        await cache.aadd(GENERATION_KEY, initial, timeout=None)
+        generation = await cache.aget(GENERATION_KEY, initial)
+    return generation
+
+
+def product_list_key(generation, filters_key=''):
+    if filters_key:
+        return f"product_list:{generation}:{filters_key}"
+    return f"product_list:{generation}"
+
+
+def product_facets_key(generation, filters_key=''):
+    return f"product_facets:{generation}:{filters_key}"
+
+
+def _bump():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        if not cache.add(GENERATION_KEY, _initial_generation(), timeout=None):
+            cache.incr(GENERATION_KEY)
+
+
+def bump_catalog_generation():
+    """Invalidate the cached product list once the current transaction commits."""
+    transaction.on_commit(_bump)
@@ -0,0 +1,99 @@
+"""
+Turning a cart into an order.
+
+All of it is one transaction and a fixed number of queries however many
+lines the cart has: the stock for every line is taken by a single
+conditional UPDATE (inventory.take_stock, which also records the sales in
+the stock ledger), so if any product is short (or was deactivated) fewer
+rows match, nothing is written and the cart is left as it was.
+"""
+import uuid
+
+from django.db import transaction
+
+from . import analytics, cart_totals, events
+from .inventory import take_stock
+from .models import CartItem, Order, OrderItem, Product
+from .pricing import tier_for
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    def __init__(self):
+        super().__init__("Cart is empty")
+
+
+class InsufficientStock(CheckoutError):
+    def __init__(self, lines):
+        # [{'product_id', 'requested', 'available'}, ...]
+        self.lines = lines
+        super().__init__("Insufficient stock")
+
+
+def _short_lines(quantities):
+    available = dict(
+        Product.objects.filter(id__in=quantities, is_active=True).values_list('id', 'stock_quantity')
+    )
+    return [
+        {'product_id': str(product_id), 'requested': quantity, 'available': available.get(product_id, 0)}
+        for product_id, quantity in quantities.items()
+        if available.get(product_id, 0) < quantity
+    ]
+
+
+def checkout(user, cart):
+    """
+    Place an order for everything in the cart and return (order, order_items),
+    or raise CheckoutError with nothing changed.
+    """
+    with transaction.atomic():
+        # Locked so a concurrent quantity change or a second checkout of the
+        # same cart waits for this one.
+        items = list(
+            CartItem.objects.filter(cart=cart).select_related('product').select_for_update(of=('self',))
+        )
+        if not items:
+            raise EmptyCart()
+
+        order_id = uuid.uuid4()
+        quantities = {item.product_id: item.quantity for item in items}
+        if not take_stock(quantities, 'sale', reference=order_id):
+            raise InsufficientStock(_short_lines(quantities))
+
+        tier = tier_for(user)
+        order_items = []
+        for item in items:
+            unit_price = tier.product_price(item.product, item.quantity)
+            order_items.append(OrderItem(
+                product=item.product,
+                product_name=item.product.name,
+                unit_price=unit_price,
+                quantity=item.quantity,
+                total_price=unit_price * item.quantity,
+            ))
+        order = Order.objects.create(
+            id=order_id,
+            user=user,
+            price_type=tier.name,
+            total_price=sum(line.total_price for line in order_items),
+            total_items=sum(line.quantity for line in order_items),
+        )
+        for line in order_items:
+            line.order = order
+        OrderItem.objects.bulk_create(order_items)
+        analytics.order_placed(order, order_items)
+
+        # Only the lines we ordered; an item added meanwhile stays in the cart.
+        CartItem.objects.filter(id__in=[item.id for item in items]).delete()
+        cart_totals.apply_changes(cart, [(item.product, item.quantity, 0) for item in items])
+
+        # The rows are still locked by our UPDATE, so these are the new values.
+        stock = dict(Product.objects.filter(id__in=quantities).values_list('id', 'stock_quantity'))
+        events.product_changed({product_id: {'stock_quantity': quantity} for product_id, quantity in stock.items()})
+        events.cart_changed([(user.id, product_id, False) for product_id in stock])
+
+    return order, order_items
+
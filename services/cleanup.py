@@ -0,0 +1,125 @@
+"""
+Sweeping stale carts.
+
+Every customer who opens the cart gets a Cart row, and items of products
+that were deactivated stay in carts where they can never be bought. sweep()
+removes both:
+
+    items    CartItems of inactive products
+    carts    Carts not changed for IDLE_DAYS, with their items and totals
+
+in primary-key-ordered batches of BATCH_SIZE, one short transaction each,
+sleeping SLEEP seconds between batches so replicas keep up. Cart totals and
+the vendor analytics are adjusted with every batch. Run it from cron with
+`manage.py sweep_carts`.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import analytics, cart_totals, events
+from .models import Cart, CartItem
+
+DEFAULTS = {
+    'IDLE_DAYS': 30,
+    'BATCH_SIZE': 500,
+    'SLEEP': 0.5,
+}
+
+
+def get_cleanup_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CART_CLEANUP', {}))
+    return config
+
+
+def batches(queryset, batch_size):
+    """Successive lists of up to batch_size ids of queryset, in id order."""
+    last_id = None
+    while True:
+        page = queryset if last_id is None else queryset.filter(id__gt=last_id)
+        ids = list(page.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def _forget_items(items):
+    """Tell analytics and the feed about deleted items (select_related product and cart)."""
+    analytics.cart_changed([(item.product, item.quantity, 0) for item in items])
+    events.cart_changed([(item.cart.user_id, item.product_id, False) for item in items])
+
+
+def remove_items(items):
+    """
+    Delete a queryset of cart items, adjusting their carts' totals and the
+    analytics. Must run inside a transaction. Returns how many.
+    """
+    items = list(items.select_for_update(of=('self',)).select_related('product', 'cart'))
+    CartItem.objects.filter(id__in=[item.id for item in items]).delete()
+    _forget_items(items)
+    cart_totals.rebuild(list({item.cart_id for item in items}))
+    return len(items)
+
+
+def sweep_inactive_items(batch_size, sleep, dry_run=False):
+    """Delete cart items of inactive products. Returns how many."""
+    removed = 0
+    for ids in batches(CartItem.objects.filter(product__is_active=False), batch_size):
+        if dry_run:
+            removed += len(ids)
+            continue
+        with transaction.atomic():
+            removed += remove_items(CartItem.objects.filter(id__in=ids, product__is_active=False))
+        sleep()
+    return removed
+
+
+def sweep_idle_carts(cutoff, batch_size, sleep, dry_run=False):
+    """Delete carts unchanged since cutoff. Returns (carts, items) removed."""
+    carts = items_removed = 0
+    for ids in batches(Cart.objects.filter(updated_at__lt=cutoff), batch_size):
+        if dry_run:
+            carts += len(ids)
+            items_removed += CartItem.objects.filter(cart_id__in=ids).count()
+            continue
+        with transaction.atomic():
+            # Items first, then the carts, in the order checkout locks them.
+            # Both checked again, so a cart changed meanwhile is kept.
+            items = list(
+                CartItem.objects.select_for_update(of=('self',)).select_related('product', 'cart')
+                .filter(cart_id__in=ids, cart__updated_at__lt=cutoff).order_by('id')
+            )
+            idle = set(
+                Cart.objects.select_for_update().filter(id__in=ids, updated_at__lt=cutoff)
+                .order_by('id').values_list('id', flat=True)
+            )
+            items = [item for item in items if item.cart_id in idle]
+            CartItem.objects.filter(id__in=[item.id for item in items]).delete()
+            Cart.objects.filter(id__in=idle).delete()
+            _forget_items(items)
+        carts += len(idle)
+        items_removed += len(items)
+        sleep()
+    return carts, items_removed
+
+
+def sweep(idle_days=None, batch_size=None, pause=None, dry_run=False, sleep=time.sleep):
+    """Run both sweeps. Returns {'inactive_items', 'idle_carts', 'idle_cart_items'}."""
+    config = get_cleanup_settings()
+    idle_days = config['IDLE_DAYS'] if idle_days is None else idle_days
+    batch_size = batch_size or config['BATCH_SIZE']
+    pause = config['SLEEP'] if pause is None else pause
+    cutoff = timezone.now() - datetime.timedelta(days=idle_days)
+
+    def wait():
+        if pause:
+            sleep(pause)
+
+    inactive_items = sweep_inactive_items(batch_size, wait, dry_run)
+    idle_carts, idle_cart_items = sweep_idle_carts(cutoff, batch_size, wait, dry_run)
+    return {'inactive_items': inactive_items, 'idle_carts': idle_carts, 'idle_cart_items': idle_cart_items}
@@ -0,0 +1,89 @@
+import uuid
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .feed import cart_group_name, product_group_name
+from .models import CartItem
+
+
+class ProductFeedConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes stock/price diffs for the products in the user's cart, so clients
+    can update locally instead of polling CartView.
+
+    On connect the socket joins product_<id> for every cart line. Cart views
+    keep that in sync through the cart_<user_id> group; clients may also send
+    {"type": "subscribe" | "unsubscribe", "product_ids": [...]}.
+    """
+    max_subscriptions = 200
+    cart_group = None
+
+    async def connect(self):
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+
+        self.product_ids = set()
+        self.cart_group = cart_group_name(user.id)
+        await self.channel_layer.group_add(self.cart_group, self.channel_name)
+        await self.subscribe(await self.get_cart_product_ids(user))
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.cart_group is None:
+            return
+        await self.unsubscribe(list(self.product_ids))
+        await self.channel_layer.group_discard(self.cart_group, self.channel_name)
+
+    @database_sync_to_async
+    def get_cart_product_ids(self, user):
+        return [
+            str(product_id)
+            for product_id in CartItem.objects.filter(cart__user=user).values_list('product_id', flat=True)
+        ]
+
+    async def subscribe(self, product_ids):
+        for product_id in product_ids:
+            if product_id in self.product_ids:
+                continue
+            if len(self.product_ids) >= self.max_subscriptions:
+                break
+            self.product_ids.add(product_id)
+            await self.channel_layer.group_add(product_group_name(product_id), self.channel_name)
+
+    async def unsubscribe(self, product_ids):
+        for product_id in product_ids:
+            if product_id in self.product_ids:
+                self.product_ids.discard(product_id)
+                await self.channel_layer.group_discard(product_group_name(product_id), self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        action = content.get("type")
+        if action not in ("subscribe", "unsubscribe"):
+            return
+        product_ids = []
+        for value in content.get("product_ids") or []:
+            try:
+                product_ids.append(str(uuid.UUID(str(value))))
+            except ValueError:
+                continue
+        if action == "subscribe":
+            await self.subscribe(product_ids)
+        else:
+            await self.unsubscribe(product_ids)
+        await self.send_json({"type": "subscriptions", "product_ids": sorted(self.product_ids)})
+
+    async def cart_subscription(self, event):
+        if event["subscribed"]:
+            await self.subscribe([event["product_id"]])
+        else:
+            await self.unsubscribe([event["product_id"]])
+
+    async def product_update(self, event):
+        await self.send_json({
+            "type": "product.update",
+            "product_id": event["product_id"],
+            "changes": event["changes"],
+        })
@@ -0,0 +1,53 @@
+"""
+Domain events of the catalog and carts.
+
+Writes record what follows from them as events in their own transaction,
+through the outbox (Notifications/outbox.py), instead of running it inline:
+
+    product_changed(changes)        ProductChanged: the feed gets each product's
+                                    diff, then the catalog generation is bumped,
+                                    and carts holding repriced products are
+                                    queued for new totals
+    cart_changed(subscriptions)     CartChanged: users' feed sockets join or
+                                    leave product groups
+
+Each call is one INSERT however many products or carts it covers. The
+deliver_* functions are the outbox handlers, run by
+`manage.py dispatch_outbox` once the write has committed.
+"""
+from Notifications import outbox
+
+from . import cart_totals, feed
+from .catalog import bump_catalog_generation
+
+PRICE_FIELDS = {'retail_price', 'whole_sale_price'}
+
+
+def product_changed(changes=None):
+    """
+    Something the product list shows changed; changes is {product_id:
+    {field: value}} for the feed, and may leave products out or be empty.
+    """
+    outbox.emit('ProductChanged', {'products': {
+        str(product_id): {field: feed.to_json(value) for field, value in product_changes.items()}
+        for product_id, product_changes in (changes or {}).items() if product_changes
+    }})
+
+
+def cart_changed(subscriptions):
+    """(user_id, product_id, subscribed) for items added to or removed from carts."""
+    rows = [[str(user_id), str(product_id), subscribed] for user_id, product_id, subscribed in subscriptions]
+    if rows:
+        outbox.emit('CartChanged', {'subscriptions': rows})
+
+
+def deliver_product_changed(payload):
+    feed.send_product_changes(payload['products'])
+    bump_catalog_generation()
+    cart_totals.reprice_later([
+        product_id for product_id, changes in payload['products'].items() if PRICE_FIELDS & changes.keys()
+    ])
+
+
+def deliver_cart_changed(payload):
+    feed.send_cart_subscriptions(payload['subscriptions'])
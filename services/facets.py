@@ -0,0 +1,283 @@
+"""
+Faceted filtering of the public product list.
+
+The list shows active products with stock. Each of them falls in one cell
+(vendor, price band, availability), and FacetCount keeps how many listed
+products each cell holds. So facet counts for any combination of filters
+are sums over the cells, of which there are at most
+vendors x bands x availabilities, instead of GROUP BYs over Product.
+
+The cells are moved, with F() updates in the writing transaction, whenever
+something decides a product's cell changes:
+
+    before = cells([product_id], lock=True)
+    ...  # edit the product
+    update(before, cells([product_id]))
+
+Stock changes are reported by the inventory module, through stock_changed().
+Band edges and the low-stock limit come from settings.CATALOG_FACETS; after
+changing them, or to repair drift, run `manage.py catalog_facets rebuild`.
+"""
+import hashlib
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+
+from .models import FacetCount, Product
+
+DEFAULTS = {
+    'PRICE_BANDS': [10, 25, 50, 100, 250],  # retail price edges
+    'LOW_STOCK': 5,                         # listed with at most this many left: low_stock
+}
+
+AVAILABILITY = ('in_stock', 'low_stock')
+# Product fields, besides the stock, that decide its cell.
+CELL_FIELDS = {'retail_price', 'is_active'}
+FACETS = ('vendor', 'price_band', 'availability')
+
+
+def get_facet_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CATALOG_FACETS', {}))
+    return config
+
+
+def price_bands(config=None):
+    """[(label, low, high)], high None for the last, open band."""
+    edges = [0, *(config or get_facet_settings())['PRICE_BANDS']]
+    bands = [(f"{low}-{high}", low, high) for low, high in zip(edges, edges[1:])]
+    bands.append((f"{edges[-1]}+", edges[-1], None))
+    return bands
+
+
+def price_band(retail_price, config=None):
+    for label, _, high in price_bands(config):
+        if high is None or retail_price < high:
+            return label
+
+
+def cell(vendor_id, retail_price, stock_quantity, is_active, config=None):
+    """The product's (vendor_id, price_band, availability), or None if the list doesn't show it."""
+    if not is_active or stock_quantity <= 0:
+        return None
+    config = config or get_facet_settings()
+    availability = 'low_stock' if stock_quantity <= config['LOW_STOCK'] else 'in_stock'
+    return (vendor_id, price_band(retail_price, config), availability)
+
+
+def cell_for(product):
+    return cell(product.vendor_id, product.retail_price, product.stock_quantity, product.is_active)
+
+
+def cells(product_ids, lock=False):
+    """{product_id: cell} as stored now."""
+    products = Product.objects.filter(id__in=product_ids)
+    if lock:
+        products = products.select_for_update()
+    config = get_facet_settings()
+    return {
+        product_id: cell(vendor_id, retail_price, stock, is_active, config)
+        for product_id, vendor_id, retail_price, stock, is_active
+        in products.values_list('id', 'vendor_id', 'retail_price', 'stock_quantity', 'is_active')
+    }
+
+
+def _cell_q(key):
+    vendor_id, band, availability = key
+    return Q(vendor_id=vendor_id, price_band=band, availability=availability)
+
+
+def _apply(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    FacetCount.objects.bulk_create(
+        [FacetCount(vendor_id=vendor_id, price_band=band, availability=availability)
+         for vendor_id, band, availability in deltas],
+        ignore_conflicts=True,
+    )
+    matching = Q()
+    for key in deltas:
+        matching |= _cell_q(key)
+    FacetCount.objects.filter(matching).update(count=F('count') + Case(
+        *[When(_cell_q(key), then=Value(delta)) for key, delta in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    ))
+
+
+def update(before, after):
+    """Move products from their `before` cells to their `after` ones ({product_id: cell or None})."""
+    deltas = Counter()
+    for product_id in before.keys() | after.keys():
+        old, new = before.get(product_id), after.get(product_id)
+        if old == new:
+            continue
+        if old is not None:
+            deltas[old] -= 1
+        if new is not None:
+            deltas[new] += 1
+    _apply(deltas)
+
+
+def stock_changed(rows, deltas):
+    """
+    rows of (id, vendor_id, retail_price, stock_quantity, is_active) read
+    right after {product_id: delta} was applied to their stock.
+    """
+    config = get_facet_settings()
+    before, after = {}, {}
+    for product_id, vendor_id, retail_price, stock, is_active in rows:
+        after[product_id] = cell(vendor_id, retail_price, stock, is_active, config)
+        before[product_id] = cell(vendor_id, retail_price, stock - deltas[product_id], is_active, config)
+    update(before, after)
+
+
+def compute():
+    """{cell: count} from the products, for rebuild and verify."""
+    config = get_facet_settings()
+    whens = [
+        When(retail_price__lt=high, then=Value(label)) for label, _, high in price_bands(config) if high is not None
+    ]
+    rows = (
+        Product.objects.filter(is_active=True, stock_quantity__gt=0)
+        .annotate(
+            band=Case(*whens, default=Value(price_bands(config)[-1][0])),
+            availability=Case(
+                When(stock_quantity__lte=config['LOW_STOCK'], then=Value('low_stock')), default=Value('in_stock'),
+            ),
+        )
+        .values('vendor_id', 'band', 'availability').annotate(count=Count('id'))
+        .values_list('vendor_id', 'band', 'availability', 'count')
+    )
+    return {(vendor_id, band, availability): count for vendor_id, band, availability, count in rows}
+
+
+def stored():
+    return {
+        (vendor_id, band, availability): count
+        for vendor_id, band, availability, count in FacetCount.objects.exclude(count=0)
+        .values_list('vendor_id', 'price_band', 'availability', 'count')
+    }
+
+
+def rebuild():
+    """Replace every count with a recomputation. Returns the number of cells."""
+    with transaction.atomic():
+        counts = compute()
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create([
+            FacetCount(vendor_id=vendor_id, price_band=band, availability=availability, count=count)
+            for (vendor_id, band, availability), count in counts.items()
+        ])
+    return len(counts)
+
+
+def verify():
+    """[(cell, stored, expected)] for every cell whose count is off."""
+    expected, current = compute(), stored()
+    return [
+        (key, current.get(key, 0), expected.get(key, 0))
+        for key in sorted(expected.keys() | current.keys(), key=str)
+        if current.get(key, 0) != expected.get(key, 0)
+    ]
+
+
+# Filters
+
+def parse_filters(params):
+    """
+    {facet: sorted values} from query params; each facet takes several
+    values, comma-separated or repeated. Raises ValueError on unknown values.
+    """
+    bands = [label for label, _, _ in price_bands()]
+    filters = {}
+    for facet in FACETS:
+        values = {value for param in params.getlist(facet) for value in param.split(',') if value}
+        if not values:
+            continue
+        if facet == 'vendor':
+            try:
+                values = {uuid.UUID(value) for value in values}
+            except ValueError:
+                raise ValueError("vendor must be a vendor id")
+        elif facet == 'price_band' and not values <= set(bands):
+            raise ValueError(f"price_band must be one of {', '.join(bands)}")
+        elif facet == 'availability' and not values <= set(AVAILABILITY):
+            raise ValueError(f"availability must be one of {', '.join(AVAILABILITY)}")
+        filters[facet] = sorted(values, key=str)
+    return filters
+
+
+def filters_key(filters):
+    """A short, stable cache-key suffix for the filters ('' for none)."""
+    if not filters:
+        return ''
+    spec = '&'.join(f"{facet}={','.join(map(str, values))}" for facet, values in sorted(filters.items()))
+    return hashlib.sha256(spec.encode()).hexdigest()[:32]
+
+
+def filter_products(queryset, filters):
+    """Narrow a queryset of listed products to the filters."""
+    if 'vendor' in filters:
+        queryset = queryset.filter(vendor_id__in=filters['vendor'])
+    if 'price_band' in filters:
+        matching = Q()
+        for label, low, high in price_bands():
+            if label in filters['price_band']:
+                matching |= Q(retail_price__gte=low) & (Q(retail_price__lt=high) if high is not None else Q())
+        queryset = queryset.filter(matching)
+    if 'availability' in filters:
+        low_stock = get_facet_settings()['LOW_STOCK']
+        if filters['availability'] == ['in_stock']:
+            queryset = queryset.filter(stock_quantity__gt=low_stock)
+        elif filters['availability'] == ['low_stock']:
+            queryset = queryset.filter(stock_quantity__lte=low_stock)
+    return queryset
+
+
+def facet_counts(filters):
+    """
+    Counts per facet value for the filters, each facet counted with the
+    other facets' filters applied (so picking a value keeps its siblings
+    visible), and the total matching all of them.
+    """
+    rows = list(
+        FacetCount.objects.filter(count__gt=0)
+        .values_list('vendor_id', 'vendor__full_name', 'price_band', 'availability', 'count')
+    )
+    selected = {facet: {str(value) for value in values} for facet, values in filters.items()}
+
+    def matches(row, skip=None):
+        values = {'vendor': str(row[0]), 'price_band': row[2], 'availability': row[3]}
+        return all(values[facet] in wanted for facet, wanted in selected.items() if facet != skip)
+
+    vendors, bands, availability = Counter(), Counter(), Counter()
+    vendor_names = {}
+    for row in rows:
+        vendor_id, vendor_name, band, available, count = row
+        if matches(row, skip='vendor'):
+            vendors[str(vendor_id)] += count
+            vendor_names[str(vendor_id)] = vendor_name
+        if matches(row, skip='price_band'):
+            bands[band] += count
+        if matches(row, skip='availability'):
+            availability[available] += count
+    return {
+        'total': sum(row[4] for row in rows if matches(row)),
+        'facets': {
+            'vendor': [
+                {'value': vendor_id, 'label': vendor_names[vendor_id], 'count': count}
+                for vendor_id, count in sorted(vendors.items(), key=lambda item: (-item[1], vendor_names[item[0]]))
+            ],
+            'price_band': [
+                {'value': label, 'count': bands[label]} for label, _, _ in price_bands() if bands[label]
+            ],
+            'availability': [
+                {'value': value, 'count': availability[value]} for value in AVAILABILITY if availability[value]
+            ],
+        },
+    }
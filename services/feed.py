@@ -0,0 +1,74 @@
+from decimal import Decimal
+
+from channels.layers import get_channel_layer
+
+from Notifications.utils import DELIVERY_TIMEOUT, submit_background
+
+# Fields clients holding a cart care about; anything else never hits the feed.
+TRACKED_FIELDS = ('retail_price', 'whole_sale_price', 'stock_quantity', 'is_active')
+
+
+def product_group_name(product_id):
+    return f"product_{product_id}"
+
+
+def cart_group_name(user_id):
+    return f"cart_{user_id}"
+
+
+def snapshot(product):
+    return {field: getattr(product, field) for field in TRACKED_FIELDS}
+
+
+def diff(before, product):
+    changes = {}
+    for field in TRACKED_FIELDS:
+        value = getattr(product, field)
+        if before.get(field) != value:
+            changes[field] = value
+    return changes
+
+
+def to_json(value):
+    # Same representation ProductSerializer uses for decimals.
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+# Sending. Writes don't call these: they record ProductChanged / CartChanged
+# events (services/events.py), whose outbox handlers do.
+
+async def _group_send_all(events):
+    layer = get_channel_layer()
+    for group, event in events:
+        await layer.group_send(group, event)
+
+
+def _send(events):
+    if events:
+        submit_background(_group_send_all(events)).result(timeout=DELIVERY_TIMEOUT)
+
+
+def send_product_changes(changes):
+    """Broadcast {product_id: {field: json value}} diffs to sockets subscribed to each product."""
+    _send([
+        (product_group_name(product_id), {
+            "type": "product.update",
+            "product_id": str(product_id),
+            "changes": product_changes,
+        })
+        for product_id, product_changes in changes.items() if product_changes
+    ])
+
+
+def send_cart_subscriptions(rows):
+    """Tell users' open feed sockets to join or leave product groups; rows of (user_id, product_id, subscribed)."""
+    _send([
+        (cart_group_name(user_id), {
+            "type": "cart.subscription",
+            "product_id": str(product_id),
+            "subscribed": subscribed,
+        })
+        for user_id, product_id, subscribed in rows
+    ])
@@ -0,0 +1,193 @@
+"""
+Stock ledger.
+
+Every change to a product's stock is appended to StockMovement, so the sum
+of a product's movements is what its stock should be. Reads never touch
+the ledger: Product.stock_quantity stays the materialized, O(1) counter
+everything filters and serializes on.
+
+Decrements (sales, reservations) must never oversell, so they go to
+Product.stock_quantity with a conditional UPDATE that takes no lock before
+it writes. Increments and counts (set_stocks) are applied to the same row,
+in the transaction that records their movement.
+
+Invariant, checked by verify():
+
+    SUM(movements) == Product.stock_quantity
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from . import analytics, events, facets
+from .models import Product, StockMovement
+
+DEFAULTS = {
+    'BATCH_SIZE': 500,
+}
+
+
+def get_inventory_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'INVENTORY', {}))
+    return config
+
+
+def per_product(values):
+    """A CASE expression giving each product id in `values` its value."""
+    return Case(
+        *[When(id=product_id, then=Value(value)) for product_id, value in values.items()],
+        output_field=IntegerField(),
+    )
+
+
+def record(kind, quantities, reference=''):
+    """Append one movement per product; quantities are signed."""
+    movements = [
+        StockMovement(product_id=product_id, kind=kind, quantity=quantity, reference=str(reference))
+        for product_id, quantity in quantities.items()
+        if quantity
+    ]
+    if movements:
+        StockMovement.objects.bulk_create(movements)
+        if kind == 'restock':
+            analytics.restocked({movement.product_id: movement.quantity for movement in movements})
+
+
+def _stock_changed(deltas):
+    """
+    Pass {product_id: delta}, just applied to Product.stock_quantity with
+    the rows still locked, on to what is derived from the stock.
+    """
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    rows = list(
+        Product.objects.filter(id__in=deltas)
+        .values_list('id', 'vendor_id', 'retail_price', 'stock_quantity', 'is_active')
+    )
+    analytics.stock_changed(rows, deltas)
+    facets.stock_changed(rows, deltas)
+
+
+def add_stock(product_id, quantity, kind='restock', reference=''):
+    """Record an increase and apply it to the product."""
+    if quantity <= 0:
+        raise ValueError("add_stock() takes a positive quantity")
+    with transaction.atomic():
+        Product.objects.filter(id=product_id).update(stock_quantity=F('stock_quantity') + quantity)
+        record(kind, {product_id: quantity}, reference)
+        _stock_changed({product_id: quantity})
+        _publish_stock([product_id])
+
+
+def _decrement(quantities):
+    needed = per_product(quantities)
+    with transaction.atomic():
+        updated = Product.objects.filter(
+            id__in=quantities, is_active=True, stock_quantity__gte=needed,
+        ).update(stock_quantity=F('stock_quantity') - needed)
+        if updated == len(quantities):
+            return True
+        # Put back the lines that did have enough.
+        transaction.set_rollback(True)
+    return False
+
+
+def take_stock(quantities, kind='sale', reference=''):
+    """
+    Decrement every product in {product_id: quantity} or none of them, with
+    one conditional UPDATE. Must run inside a transaction. Returns False if
+    any product is inactive or short.
+    """
+    taken = _decrement(quantities)
+    if taken:
+        record(kind, {product_id: -quantity for product_id, quantity in quantities.items()}, reference)
+        _stock_changed({product_id: -quantity for product_id, quantity in quantities.items()})
+    return taken
+
+
+def set_stocks(quantities, reference=''):
+    """
+    Make {product_id: quantity} the products' stock, e.g. after a physical
+    count. Must run inside a transaction. The differences are recorded as
+    adjustments. Returns {product_id: delta} for the products whose stock
+    changed.
+    """
+    current = dict(
+        Product.objects.select_for_update().filter(id__in=quantities).order_by('id')
+        .values_list('id', 'stock_quantity')
+    )
+    changed = {product_id: quantities[product_id] - stock for product_id, stock in current.items()}
+    changed = {product_id: delta for product_id, delta in changed.items() if delta}
+    if changed:
+        Product.objects.filter(id__in=changed).update(
+            stock_quantity=per_product({product_id: quantities[product_id] for product_id in changed}),
+            updated_at=timezone.now(),
+        )
+        _stock_changed(changed)
+    record('adjustment', changed, reference)
+    return changed
+
+
+def set_stock(product, quantity, reference=''):
+    """set_stocks() for one product; updates product in place."""
+    set_stocks({product.id: quantity}, reference)
+    product.stock_quantity = quantity
+
+
+def _publish_stock(product_ids):
+    events.product_changed({
+        product_id: {'stock_quantity': stock}
+        for product_id, stock in Product.objects.filter(id__in=product_ids).values_list('id', 'stock_quantity')
+    })
+
+
+def _totals(queryset, field, product_ids):
+    return dict(
+        queryset.filter(product_id__in=product_ids)
+        .values('product_id').annotate(total=Sum(field)).values_list('product_id', 'total')
+    )
+
+
+def verify(product_ids=None, batch_size=None):
+    """
+    Compare the ledger with the materialized counters. Returns
+    [(product_id, ledger_stock, materialized_stock)] for every product
+    where they disagree.
+    """
+    batch_size = batch_size or get_inventory_settings()['BATCH_SIZE']
+    products = Product.objects.order_by('id')
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+    drift = []
+    last_id = None
+    while True:
+        page = products if last_id is None else products.filter(id__gt=last_id)
+        stock = dict(page.values_list('id', 'stock_quantity')[:batch_size])
+        if not stock:
+            return drift
+        ledger = _totals(StockMovement.objects, 'quantity', stock)
+        for product_id, quantity in stock.items():
+            if ledger.get(product_id, 0) != quantity:
+                drift.append((product_id, ledger.get(product_id, 0), quantity))
+        last_id = max(stock)
+
+
+def replay(product_ids):
+    """Rebuild these products' stock from the ledger alone. Returns {product_id: stock}."""
+    with transaction.atomic():
+        stock = dict(
+            Product.objects.select_for_update().filter(id__in=product_ids).order_by('id')
+            .values_list('id', 'stock_quantity')
+        )
+        ledger = _totals(StockMovement.objects, 'quantity', product_ids)
+        rebuilt = {product_id: ledger.get(product_id, 0) for product_id in product_ids}
+        if rebuilt:
+            Product.objects.filter(id__in=rebuilt).update(stock_quantity=per_product(rebuilt))
+            _stock_changed({
+                product_id: quantity - stock[product_id] for product_id, quantity in rebuilt.items() if product_id in stock
+            })
+            _publish_stock(rebuilt)
+    return rebuilt
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from services import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move products inactive for longer than --days to the archive table, "
+        "in small id-ordered batches with a pause between them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Defaults to settings.PRODUCT_ARCHIVE.')
+        parser.add_argument('--batch-size', type=int, help='Products per batch; defaults to settings.PRODUCT_ARCHIVE.')
+        parser.add_argument('--sleep', type=float, help='Seconds between batches; defaults to settings.PRODUCT_ARCHIVE.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be archived.')
+
+    def handle(self, *args, **options):
+        archived = archive.archive_products(
+            after_days=options['days'],
+            batch_size=options['batch_size'],
+            pause=options['sleep'],
+            dry_run=options['dry_run'],
+        )
+        verb = "Would archive" if options['dry_run'] else "Archived"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {archived} inactive products."))
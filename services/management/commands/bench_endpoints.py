@@ -0,0 +1,70 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from services.benchmarks import Dataset, EndpointBenchmark, benchmark_settings, find_regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database and benchmark the catalog, cart, vendor and login endpoints. "
+        "Runs on whatever DATABASES points at (set DB_ENGINE=sqlite for SQLite)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=50)
+        parser.add_argument('--vip-ratio', type=float, default=0.2)
+        parser.add_argument('--vendors', type=int, default=5)
+        parser.add_argument('--products-per-vendor', type=int, default=200)
+        parser.add_argument('--cart-items', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--scenarios', help='Comma-separated subset of: ' + ', '.join(EndpointBenchmark.SCENARIOS))
+        parser.add_argument('--output', help='Write the JSON result to this file.')
+        parser.add_argument('--baseline', help='Earlier result file; exit non-zero on regression.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed relative p50 latency increase before failing (default 0.2).')
+        parser.add_argument('--use-configured-cache', action='store_true',
+                            help='Benchmark against the configured cache instead of a local in-memory one.')
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'].split(',') if options['scenarios'] else None
+        dataset = Dataset(
+            customers=options['customers'],
+            vip_ratio=options['vip_ratio'],
+            vendors=options['vendors'],
+            products_per_vendor=options['products_per_vendor'],
+            cart_items=options['cart_items'],
+            seed=options['seed'],
+        )
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with benchmark_settings(isolated_cache=not options['use_configured_cache']):
+                dataset.create()
+                bench = EndpointBenchmark(dataset, iterations=options['iterations'], warmup=options['warmup'])
+                try:
+                    results = bench.run(scenarios)
+                except ValueError as exc:
+                    raise CommandError(str(exc))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(results, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + "\n")
+            self.stdout.write(f"Saved results to {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as fh:
+                baseline = json.load(fh)
+            regressions = find_regressions(baseline, results, options['threshold'])
+            if regressions:
+                raise CommandError("Performance regressions:\n  " + "\n  ".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against baseline."))
@@ -0,0 +1,52 @@
+import json
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from services.benchmarks import Dataset, serialization_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database and compare ProductSerializer with the values()-based "
+        "serializer on the full catalog. Fails when the output differs or the speedup is too small."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--vendors', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--user-type', default='vip_customer',
+                            choices=['anonymous', 'normal_customer', 'vip_customer', 'vendor'],
+                            help='Whose price tier to serialize for.')
+        parser.add_argument('--min-speedup', type=float, default=5.0)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        dataset = Dataset(
+            customers=10, vip_ratio=0.5, vendors=options['vendors'],
+            products_per_vendor=max(1, options['products'] // options['vendors']),
+            cart_items=0, seed=options['seed'],
+        )
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            dataset.create()
+            if options['user_type'] == 'anonymous':
+                user = AnonymousUser()
+            else:
+                users = dataset.vendor_users + dataset.customer_users
+                user = next((u for u in users if u.user_type == options['user_type']), users[0])
+            results = serialization_benchmark(user, repeat=options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(json.dumps(results, indent=2))
+        if not results['identical']:
+            raise CommandError("Fast serializer output differs from ProductSerializer")
+        if results['speedup'] < options['min_speedup']:
+            raise CommandError(f"Speedup {results['speedup']}x is below {options['min_speedup']}x")
+        self.stdout.write(self.style.SUCCESS(f"{results['speedup']}x faster, identical output"))
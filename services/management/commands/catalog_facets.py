@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from services import facets
+from services.catalog import bump_catalog_generation
+
+
+class Command(BaseCommand):
+    help = (
+        "Maintain the product list's facet counts. verify: compare them with a "
+        "recount of the listed products. rebuild: replace them with that recount."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['verify', 'rebuild'])
+
+    def handle(self, *args, **options):
+        if options['action'] == 'rebuild':
+            cells = facets.rebuild()
+            bump_catalog_generation()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {cells} facet cells."))
+            return
+
+        drift = facets.verify()
+        for (vendor_id, band, availability), stored, expected in drift:
+            self.stdout.write(f"{vendor_id} {band} {availability}: stored {stored}, expected {expected}")
+        if drift:
+            raise CommandError(f"{len(drift)} facet counts disagree with the products.")
+        self.stdout.write(self.style.SUCCESS("Facet counts match the products."))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from services import cart_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare every cart's stored per-tier totals with a recomputation from its "
+        "items. With --fix, rebuild the carts that disagree."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rebuild the totals of carts that disagree.')
+        parser.add_argument('--batch-size', type=int, help=f'Carts per batch (default {cart_totals.BATCH_SIZE}).')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        mismatches = cart_totals.check(batch_size)
+        for cart_id, tier, stored, expected in mismatches:
+            self.stdout.write(f"{cart_id} [{tier}]: stored {stored or 'missing'}, expected {expected}")
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("Cart totals match the items."))
+            return
+        if not options['fix']:
+            raise CommandError(f"{len(mismatches)} cart totals disagree with the items.")
+
+        rebuilt = cart_totals.rebuild_carts(dict.fromkeys(cart_id for cart_id, _, _, _ in mismatches), batch_size)
+        self.stdout.write(f"Rebuilt the totals of {rebuilt} carts.")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from authentication.models import User
+from services import analytics
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the vendor analytics rollups from scratch: the catalog gauges from "
+        "the products and carts, and the hourly and daily buckets from orders and the "
+        "stock ledger."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendor', action='append', dest='vendors', help='Limit to this vendor id (repeatable).')
+        parser.add_argument('--batch-size', type=int, help='Vendors per batch; defaults to settings.ANALYTICS.')
+
+    def handle(self, *args, **options):
+        vendors = User.objects.filter(user_type='vendor').order_by('id')
+        if options['vendors']:
+            vendors = vendors.filter(id__in=options['vendors'])
+        rebuilt = analytics.rebuild(vendors.values_list('id', flat=True), options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the analytics of {rebuilt} vendors."))
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.models import User
+from services.seeding import DISTRIBUTIONS, Seeder
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users, products, carts, cart items and notifications at volume. "
+        "Output is deterministic for a given --seed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=10000)
+        parser.add_argument('--vendors', type=int, default=100)
+        parser.add_argument('--vip-ratio', type=float, default=0.1, help='Share of customers that are VIP.')
+        parser.add_argument('--products-per-vendor', type=float, default=100, help='Mean products per vendor.')
+        parser.add_argument('--product-distribution', choices=DISTRIBUTIONS, default='pareto')
+        parser.add_argument('--cart-ratio', type=float, default=0.5, help='Share of customers with a cart.')
+        parser.add_argument('--cart-size', type=float, default=5, help='Mean items per cart.')
+        parser.add_argument('--cart-distribution', choices=DISTRIBUTIONS, default='exponential')
+        parser.add_argument('--notifications-per-user', type=float, default=0)
+        parser.add_argument('--notification-distribution', choices=DISTRIBUTIONS, default='exponential')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per bulk_create/transaction.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--password', default='Seed@12345', help='Password for every generated account.')
+        parser.add_argument('--email-domain', help='Defaults to seed<SEED>.example.com.')
+
+    def handle(self, *args, **options):
+        seeder = Seeder(
+            customers=options['customers'],
+            vendors=options['vendors'],
+            vip_ratio=options['vip_ratio'],
+            products_per_vendor=options['products_per_vendor'],
+            product_distribution=options['product_distribution'],
+            cart_ratio=options['cart_ratio'],
+            cart_size=options['cart_size'],
+            cart_distribution=options['cart_distribution'],
+            notifications_per_user=options['notifications_per_user'],
+            notification_distribution=options['notification_distribution'],
+            chunk_size=options['chunk_size'],
+            seed=options['seed'],
+            password=options['password'],
+            email_domain=options['email_domain'],
+            log=self.stdout.write,
+        )
+        if User.objects.filter(email__endswith=f"@{seeder.email_domain}").exists():
+            raise CommandError(
+                f"Users under @{seeder.email_domain} already exist; use another --seed or --email-domain."
+            )
+
+        started = time.perf_counter()
+        counts = seeder.run()
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {total} rows in {time.perf_counter() - started:.1f}s (seed={options['seed']})."
+        ))
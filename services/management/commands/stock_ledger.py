@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from services import inventory
+
+
+class Command(BaseCommand):
+    help = (
+        "Maintain the stock ledger. verify: compare every product's stock with the sum "
+        "of its movements. replay: rebuild stock from the ledger for the products "
+        "that fail verification (or the ones given with --product)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['verify', 'replay'])
+        parser.add_argument('--product', action='append', dest='products', help='Limit to this product id (repeatable).')
+        parser.add_argument('--batch-size', type=int, help='Products per batch; defaults to settings.INVENTORY.')
+
+    def handle(self, *args, **options):
+        drift = inventory.verify(options['products'], options['batch_size'])
+        for product_id, ledger, materialized in drift:
+            self.stdout.write(f"{product_id}: ledger {ledger}, materialized {materialized}")
+
+        if options['action'] == 'verify':
+            if drift:
+                raise CommandError(f"{len(drift)} products disagree with the ledger.")
+            self.stdout.write(self.style.SUCCESS("Stock matches the ledger."))
+            return
+
+        product_ids = options['products'] or [product_id for product_id, _, _ in drift]
+        rebuilt = inventory.replay(product_ids) if product_ids else {}
+        self.stdout.write(f"Rebuilt stock for {len(rebuilt)} products from the ledger.")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from services import cleanup
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete cart items of inactive products and carts idle for longer than "
+        "--idle-days, in small id-ordered batches with a pause between them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=int, help='Defaults to settings.CART_CLEANUP.')
+        parser.add_argument('--batch-size', type=int, help='Rows per batch; defaults to settings.CART_CLEANUP.')
+        parser.add_argument('--sleep', type=float, help='Seconds between batches; defaults to settings.CART_CLEANUP.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be removed.')
+
+    def handle(self, *args, **options):
+        removed = cleanup.sweep(
+            idle_days=options['idle_days'],
+            batch_size=options['batch_size'],
+            pause=options['sleep'],
+            dry_run=options['dry_run'],
+        )
+        verb = "Would remove" if options['dry_run'] else "Removed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {removed['inactive_items']} items of inactive products and "
+            f"{removed['idle_carts']} idle carts holding {removed['idle_cart_items']} items."
+        ))
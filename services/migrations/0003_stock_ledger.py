@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_ledger(apps, schema_editor):
+    """Start every existing product's ledger with its current stock."""
+    Product = apps.get_model('services', 'Product')
+    StockMovement = apps.get_model('services', 'StockMovement')
+    products = Product.objects.exclude(stock_quantity=0).values_list('id', 'stock_quantity').iterator(chunk_size=2000)
+    batch = []
+    for product_id, stock in products:
+        batch.append(StockMovement(product_id=product_id, kind='adjustment', quantity=stock, reference='opening'))
+        if len(batch) >= 2000:
+            StockMovement.objects.bulk_create(batch)
+            batch = []
+    StockMovement.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0002_orders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('restock', 'Restock'), ('sale', 'Sale'), ('reservation', 'Reservation'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('reference', models.CharField(blank=True, default='', max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='services.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'id'], name='stockmove_product_idx')],
+            },
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
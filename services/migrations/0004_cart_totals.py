@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0003_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tier', models.CharField(max_length=20)),
+                ('total_items', models.IntegerField(default=0)),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='totals', to='services.cart')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cart', 'tier'), name='carttotal_cart_tier_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def count_facets(apps, schema_editor):
+    """Put every listed product in its facet cell."""
+    from services.facets import get_facet_settings, cell
+
+    Product = apps.get_model('services', 'Product')
+    FacetCount = apps.get_model('services', 'FacetCount')
+    config = get_facet_settings()
+    counts = {}
+    products = (
+        Product.objects.filter(is_active=True, stock_quantity__gt=0)
+        .values_list('vendor_id', 'retail_price', 'stock_quantity').iterator(chunk_size=2000)
+    )
+    for vendor_id, retail_price, stock in products:
+        key = cell(vendor_id, retail_price, stock, True, config)
+        counts[key] = counts.get(key, 0) + 1
+    FacetCount.objects.bulk_create([
+        FacetCount(vendor_id=vendor_id, price_band=band, availability=availability, count=count)
+        for (vendor_id, band, availability), count in counts.items()
+    ], batch_size=2000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0005_analytics_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_band', models.CharField(max_length=20)),
+                ('availability', models.CharField(max_length=10)),
+                ('count', models.IntegerField(default=0)),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('vendor', 'price_band', 'availability'), name='facetcount_cell_uniq')],
+            },
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
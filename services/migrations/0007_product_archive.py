@@ -0,0 +1,62 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def date_deactivations(apps, schema_editor):
+    """Products already inactive count as deactivated at their last change."""
+    Product = apps.get_model('services', 'Product')
+    Product.objects.filter(is_active=False, deactivated_at__isnull=True).update(deactivated_at=F('updated_at'))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0006_catalog_facets'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedProduct',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('retail_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('whole_sale_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('stock_quantity', models.IntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('deactivated_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='deactivated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(date_deactivations, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='product',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='order_items', to='services.product'),
+        ),
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='product',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='stock_movements', to='services.product'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', False)), fields=['deactivated_at'], name='product_deactivated_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedproduct',
+            name='vendor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_products', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,6 +1,9 @@
 from django.db import models
 from authentication.models import User
 import uuid
+from functools import cached_property
+
+from .pricing import tier_for
 
 class Product(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -11,17 +14,46 @@ class Product(models.Model):
     whole_sale_price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_quantity = models.IntegerField()
     is_active = models.BooleanField(default=True)
+    # Set when the product is deactivated (deleted); archive_products moves
+    # products inactive for long enough to ArchivedProduct.
+    deactivated_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['deactivated_at'], condition=models.Q(is_active=False), name='product_deactivated_idx',
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
     def get_price_for_user(self, user):
-    
-        if user.user_type == 'vip_customer':
-            return self.whole_sale_price 
-        return self.retail_price
+        return tier_for(user).product_price(self)
+
+
+class ArchivedProduct(models.Model):
+    """
+    A product moved out of Product after being inactive for a while (see
+    services/archive.py). Same id, so orders and the stock ledger still
+    point at it.
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    name = models.CharField(max_length=100)
+    description = models.TextField(blank=True, null=True)
+    vendor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_products')
+    retail_price = models.DecimalField(max_digits=10, decimal_places=2)
+    whole_sale_price = models.DecimalField(max_digits=10, decimal_places=2)
+    stock_quantity = models.IntegerField()
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    deactivated_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} (archived)"
 
 
 class Cart(models.Model):
@@ -33,14 +65,53 @@ class Cart(models.Model):
     def __str__(self):
         return f"{self.user}'s Cart"
 
+    @cached_property
+    def pricing_tier(self):
+        # Resolved once per cart; its prefetched items point back here and share it.
+        return tier_for(self.user)
+
+    def stored_totals(self):
+        """The CartTotal row for the owner's tier, or None if it was never materialized."""
+        tier = self.pricing_tier.name
+        if 'totals' in getattr(self, '_prefetched_objects_cache', {}):
+            return next((row for row in self.totals.all() if row.tier == tier), None)
+        return self.totals.filter(tier=tier).first()
+
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        totals = self.stored_totals()
+        if totals is not None:
+            return totals.total_price
+        tier = self.pricing_tier
+        lines = [
+            (item.product.retail_price, item.product.whole_sale_price, item.quantity)
+            for item in self.items.all()
+        ]
+        return sum(line_total for _, line_total in tier.line_prices(lines))
 
     @property
     def total_items(self):
+        totals = self.stored_totals()
+        if totals is not None:
+            return totals.total_items
         return sum(item.quantity for item in self.items.all())
 
+
+class CartTotal(models.Model):
+    """A cart's totals at one pricing tier, maintained by services/cart_totals.py."""
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='totals')
+    tier = models.CharField(max_length=20)
+    total_items = models.IntegerField(default=0)
+    total_price = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'tier'], name='carttotal_cart_tier_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.cart_id} [{self.tier}] {self.total_items} items, {self.total_price}"
+
     
 class CartItem(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -54,6 +125,154 @@ class CartItem(models.Model):
     def __str__(self):
         return f"{self.quantity} × {self.product.name}"
 
+    def price_at(self, tier):
+        """The unit price at `tier`, for callers that price many items at once."""
+        return tier.product_price(self.product, self.quantity)
+
+    @property
+    def unit_price(self):
+        return self.price_at(self.cart.pricing_tier)
+
     @property
     def total_price(self):
-        return self.product.get_price_for_user(self.cart.user) * self.quantity
+        return self.unit_price * self.quantity
+
+
+class Order(models.Model):
+    STATUS_CHOICES = [
+        ('placed', 'Placed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='placed')
+    # Which price tier the lines were charged at, as ProductSerializer reports it.
+    price_type = models.CharField(max_length=20)
+    total_price = models.DecimalField(max_digits=15, decimal_places=2)
+    total_items = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', '-created_at'], name='order_user_created_idx')]
+
+    def __str__(self):
+        return f"Order {self.id} by {self.user}"
+
+
+class OrderItem(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    # The name and price are snapshots. Not a constraint: the product may
+    # have been archived since, to ArchivedProduct under the same id.
+    product = models.ForeignKey(
+        'Product', on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='order_items',
+    )
+    product_name = models.CharField(max_length=100)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+    total_price = models.DecimalField(max_digits=15, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.quantity} × {self.product_name}"
+
+
+class StockMovement(models.Model):
+    """
+    One change to a product's stock. Rows are only ever appended; the sum
+    of a product's movements is what its stock should be (see
+    services/inventory.py).
+    """
+    KIND_CHOICES = [
+        ('restock', 'Restock'),
+        ('sale', 'Sale'),
+        ('reservation', 'Reservation'),
+        ('adjustment', 'Adjustment'),
+    ]
+
+    # Sequential so the ledger has a total order to replay in.
+    id = models.BigAutoField(primary_key=True)
+    # Not a constraint, so the ledger outlives archiving the product.
+    product = models.ForeignKey(
+        'Product', on_delete=models.DO_NOTHING, db_constraint=False, related_name='stock_movements',
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField()  # signed: sales and reservations are negative
+    reference = models.CharField(max_length=64, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['product', 'id'], name='stockmove_product_idx')]
+
+    def __str__(self):
+        return f"{self.kind} {self.quantity:+d} of {self.product_id}"
+
+
+class VendorStats(models.Model):
+    """A vendor's current catalog gauges, maintained by services/analytics.py."""
+    vendor = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    products = models.IntegerField(default=0)
+    units_in_carts = models.IntegerField(default=0)
+    # Products at or below settings.ANALYTICS['LOW_STOCK_THRESHOLD'].
+    low_stock = models.IntegerField(default=0)
+    # SUM(stock_quantity * retail_price) over the vendor's products.
+    catalog_value = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats for {self.vendor}"
+
+
+class ProductStats(models.Model):
+    """Units of a product sitting in carts, maintained by services/analytics.py."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    vendor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='product_stats')
+    units_in_carts = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['vendor', '-units_in_carts'], name='productstats_vendor_units_idx')]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.units_in_carts} in carts"
+
+
+class VendorActivity(models.Model):
+    """A vendor's sales and restocks within one hour or one day (UTC)."""
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+
+    vendor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='activity')
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()  # start of the hour or day
+    orders = models.IntegerField(default=0)
+    units_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    units_restocked = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'period', 'bucket'], name='vendoractivity_bucket_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.vendor} {self.period} {self.bucket:%Y-%m-%d %H:00}"
+
+
+class FacetCount(models.Model):
+    """Listed products in one facet cell of the catalog, maintained by services/facets.py."""
+    vendor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='facet_counts')
+    price_band = models.CharField(max_length=20)
+    availability = models.CharField(max_length=10)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['vendor', 'price_band', 'availability'], name='facetcount_cell_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.vendor_id} {self.price_band} {self.availability}: {self.count}"
@@ -0,0 +1,153 @@
+"""
+Price tiers.
+
+A user's tier decides which of a product's two prices they pay and what
+the API reports as price_type. Code that prices products resolves the tier
+once for the whole batch (a page of products, a cart) and prices every row
+with it, instead of branching on user_type per object:
+
+    tier = tier_for(request.user)
+    tier.unit_prices(rows)                     # (retail, wholesale) rows
+    tier.line_prices(rows)                     # (retail, wholesale, quantity) rows
+    queryset.annotate(price=tier.expression()) # the same, in the database
+
+annotate_unit_price() does it in the database for querysets that mix users
+of different tiers, such as the cart item admin.
+
+Each tier can also carry rules, applied in order to the unit price of a
+line given its quantity. They come from settings.PRICING_RULES:
+
+    PRICING_RULES = {
+        'vip_wholesale': [
+            {'class': 'services.pricing.VolumeDiscount', 'min_quantity': 10, 'percent': '5'},
+        ],
+    }
+
+A rule implements apply(price, quantity) on Decimals and, so querysets can
+be priced in SQL too, expression(price, quantity) on expressions. With no
+rules configured, prices are exactly the product's retail or wholesale
+price, as Product.get_price_for_user always returned.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Value, When
+from django.db.models.functions import Round
+from django.db.models.lookups import GreaterThanOrEqual
+from django.utils.module_loading import import_string
+
+CENT = Decimal('0.01')
+PRICE_FIELD = DecimalField(max_digits=10, decimal_places=2)
+
+# price_type: which of the product's prices the tier pays.
+TIER_PRICE_FIELDS = {
+    'retail': 'retail_price',
+    'vip_wholesale': 'whole_sale_price',
+    # Vendors are shown "wholesale" but, browsing as buyers, pay retail.
+    'wholesale': 'retail_price',
+}
+
+USER_TYPE_TIERS = {
+    'vip_customer': 'vip_wholesale',
+    'vendor': 'wholesale',
+}
+
+
+class VolumeDiscount:
+    """`percent` off the unit price of lines of at least `min_quantity`."""
+
+    def __init__(self, min_quantity, percent):
+        self.min_quantity = int(min_quantity)
+        self.factor = 1 - Decimal(str(percent)) / 100
+
+    def apply(self, price, quantity):
+        if quantity < self.min_quantity:
+            return price
+        return (price * self.factor).quantize(CENT, rounding=ROUND_HALF_UP)
+
+    def expression(self, price, quantity):
+        discounted = Round(ExpressionWrapper(price * Value(self.factor), output_field=PRICE_FIELD), 2)
+        return Case(
+            When(GreaterThanOrEqual(quantity, self.min_quantity), then=discounted),
+            default=price,
+            output_field=PRICE_FIELD,
+        )
+
+
+class PriceTier:
+
+    def __init__(self, name, rules=()):
+        self.name = name
+        self.price_field = TIER_PRICE_FIELDS[name]
+        self.wholesale = self.price_field == 'whole_sale_price'
+        self.rules = list(rules)
+
+    def __repr__(self):
+        return f"<PriceTier {self.name}>"
+
+    def unit_price(self, retail_price, whole_sale_price, quantity=1):
+        price = whole_sale_price if self.wholesale else retail_price
+        for rule in self.rules:
+            price = rule.apply(price, quantity)
+        return price
+
+    def product_price(self, product, quantity=1):
+        """Unit price of `product` in a line of `quantity`."""
+        return self.unit_price(product.retail_price, product.whole_sale_price, quantity)
+
+    def unit_prices(self, rows):
+        """Unit price for each (retail_price, whole_sale_price) row, for a quantity of one."""
+        column = 1 if self.wholesale else 0
+        if not self.rules:
+            return [row[column] for row in rows]
+        return [self.unit_price(retail, wholesale) for retail, wholesale in rows]
+
+    def line_prices(self, rows):
+        """(unit_price, line_total) for each (retail_price, whole_sale_price, quantity) row."""
+        prices = []
+        for retail, wholesale, quantity in rows:
+            unit_price = self.unit_price(retail, wholesale, quantity)
+            prices.append((unit_price, unit_price * quantity))
+        return prices
+
+    def expression(self, prefix='', quantity=None):
+        """
+        The unit price as a query expression. `prefix` leads to the product
+        ('product__' from a cart item); `quantity` is the name of the
+        quantity field, or None for a single unit.
+        """
+        price = F(prefix + self.price_field)
+        quantity = F(quantity) if quantity else Value(1)
+        for rule in self.rules:
+            price = rule.expression(price, quantity)
+        return price
+
+
+def load_rules(tier_name):
+    rules = []
+    for spec in getattr(settings, 'PRICING_RULES', {}).get(tier_name, []):
+        options = dict(spec)
+        rules.append(import_string(options.pop('class'))(**options))
+    return rules
+
+
+def get_tier(name):
+    return PriceTier(name, load_rules(name))
+
+
+def tier_for(user):
+    """The tier a user buys at; anonymous users (or none) pay retail."""
+    if user is None or not user.is_authenticated:
+        return get_tier('retail')
+    return get_tier(USER_TYPE_TIERS.get(user.user_type, 'retail'))
+
+
+def annotate_unit_price(queryset, user_type_field, prefix='', quantity=None, name='unit_price'):
+    """Annotate each row with its unit price at the tier of the user in `user_type_field`."""
+    whens = [
+        When(**{user_type_field: user_type}, then=get_tier(tier_name).expression(prefix, quantity))
+        for user_type, tier_name in USER_TYPE_TIERS.items()
+    ]
+    return queryset.annotate(**{
+        name: Case(*whens, default=get_tier('retail').expression(prefix, quantity), output_field=PRICE_FIELD),
+    })
@@ -0,0 +1,177 @@
+"""
+High-volume synthetic data for local load testing (`manage.py seed`).
+
+Everything is drawn from one random.Random(seed), including primary keys,
+so the same options always produce the same rows. Rows are written with
+bulk_create in fixed-size chunks, one transaction per chunk, and every
+account shares one precomputed password hash. bulk_create skips what the
+API keeps up to date on every write, so the facet index, the vendor
+analytics and the cart totals are rebuilt once at the end.
+"""
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from authentication.models import User
+from Notifications.models import Notification
+from . import analytics, cart_totals, facets
+from .catalog import bump_catalog_generation
+from .models import Cart, CartItem, Product, StockMovement
+
+DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'pareto')
+
+
+def draw(rng, distribution, mean):
+    """Non-negative integer with the given mean under the named distribution."""
+    if mean <= 0:
+        return 0
+    if distribution == 'fixed':
+        return int(mean)
+    if distribution == 'uniform':
+        return rng.randint(0, int(2 * mean))
+    if distribution == 'exponential':
+        return int(rng.expovariate(1 / mean))
+    if distribution == 'pareto':
+        # alpha=2 has mean 2, so halve it: a long tail around the same mean.
+        return int(mean * rng.paretovariate(2) / 2)
+    raise ValueError(f"Unknown distribution {distribution!r}; choose from {', '.join(DISTRIBUTIONS)}")
+
+
+class Seeder:
+    def __init__(self, customers=10000, vendors=100, vip_ratio=0.1,
+                 products_per_vendor=100, product_distribution='pareto',
+                 cart_ratio=0.5, cart_size=5, cart_distribution='exponential',
+                 notifications_per_user=0, notification_distribution='exponential',
+                 chunk_size=5000, seed=1, password='Seed@12345', email_domain=None, log=None):
+        self.customers = customers
+        self.vendors = vendors
+        self.vip_ratio = vip_ratio
+        self.products_per_vendor = products_per_vendor
+        self.product_distribution = product_distribution
+        self.cart_ratio = cart_ratio
+        self.cart_size = cart_size
+        self.cart_distribution = cart_distribution
+        self.notifications_per_user = notifications_per_user
+        self.notification_distribution = notification_distribution
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.password = password
+        self.email_domain = email_domain or f"seed{seed}.example.com"
+        self.log = log or (lambda message: None)
+        self.rng = random.Random(seed)
+        self.counts = {}
+
+    def new_id(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def write(self, model, rows):
+        """bulk_create an iterable of unsaved instances in chunks; returns the row count."""
+        label = model._meta.verbose_name_plural
+        started = time.perf_counter()
+        total = 0
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                total += self._flush(model, chunk)
+                chunk = []
+        if chunk:
+            total += self._flush(model, chunk)
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else 0
+        self.log(f"{label}: {total} rows in {elapsed:.1f}s ({rate:,.0f}/s)")
+        self.counts[label] = self.counts.get(label, 0) + total
+        return total
+
+    def _flush(self, model, chunk):
+        with transaction.atomic():
+            model.objects.bulk_create(chunk, batch_size=self.chunk_size)
+        return len(chunk)
+
+    def run(self):
+        password = make_password(self.password)
+        now = timezone.now()
+
+        vendor_ids = [self.new_id() for _ in range(self.vendors)]
+        self.write(User, (
+            User(id=vendor_id, email=f"vendor{i}@{self.email_domain}", full_name=f"Vendor {i}",
+                 user_type='vendor', password=password, is_verified=True, is_approved=True, approved_at=now)
+            for i, vendor_id in enumerate(vendor_ids)
+        ))
+
+        customer_ids = [self.new_id() for _ in range(self.customers)]
+        self.write(User, (
+            User(id=customer_id, email=f"customer{i}@{self.email_domain}", full_name=f"Customer {i}",
+                 user_type='vip_customer' if self.rng.random() < self.vip_ratio else 'normal_customer',
+                 password=password, is_verified=True, is_approved=True, approved_at=now)
+            for i, customer_id in enumerate(customer_ids)
+        ))
+
+        product_ids = []
+        product_stock = []
+
+        def products():
+            for vendor_number, vendor_id in enumerate(vendor_ids):
+                for i in range(draw(self.rng, self.product_distribution, self.products_per_vendor)):
+                    product_id = self.new_id()
+                    product_ids.append(product_id)
+                    retail = Decimal(self.rng.randint(100, 100000)) / 100
+                    stock = self.rng.randint(0, 1000)
+                    product_stock.append((product_id, stock))
+                    yield Product(
+                        id=product_id,
+                        name=f"Vendor {vendor_number} product {i}",
+                        vendor_id=vendor_id,
+                        retail_price=retail,
+                        whole_sale_price=(retail * Decimal('0.8')).quantize(Decimal('0.01')),
+                        stock_quantity=stock,
+                        is_active=self.rng.random() > 0.05,
+                    )
+
+        self.write(Product, products())
+        # The products' opening balance in the stock ledger.
+        self.write(StockMovement, (
+            StockMovement(product_id=product_id, kind='restock', quantity=stock, reference='seed')
+            for product_id, stock in product_stock if stock
+        ))
+
+        cart_owners = [customer_id for customer_id in customer_ids if self.rng.random() < self.cart_ratio]
+        cart_ids = [self.new_id() for _ in cart_owners]
+        self.write(Cart, (
+            Cart(id=cart_id, user_id=owner_id) for cart_id, owner_id in zip(cart_ids, cart_owners)
+        ))
+
+        def cart_items():
+            if not product_ids:
+                return
+            for cart_id in cart_ids:
+                size = min(draw(self.rng, self.cart_distribution, self.cart_size), len(product_ids))
+                for product_id in self.rng.sample(product_ids, size):
+                    yield CartItem(id=self.new_id(), cart_id=cart_id, product_id=product_id,
+                                   quantity=self.rng.randint(1, 5))
+
+        self.write(CartItem, cart_items())
+
+        def notifications():
+            for user_id in customer_ids:
+                for i in range(draw(self.rng, self.notification_distribution, self.notifications_per_user)):
+                    yield Notification(user_id=user_id, message=f"Seeded notification {i}",
+                                       is_read=self.rng.random() < 0.7)
+
+        if self.notifications_per_user:
+            self.write(Notification, notifications())
+        self.derive(vendor_ids, cart_ids)
+        return self.counts
+
+    def derive(self, vendor_ids, cart_ids):
+        started = time.perf_counter()
+        facets.rebuild()
+        analytics.rebuild(vendor_ids)
+        cart_totals.rebuild_carts(cart_ids)
+        bump_catalog_generation()
+        self.log(f"facets, analytics and cart totals rebuilt in {time.perf_counter() - started:.1f}s")
@@ -1,5 +1,12 @@
+from decimal import Decimal
+from functools import cached_property
+
+from django.db import transaction
 from rest_framework import serializers
-from .models import Product, Cart, CartItem
+from . import analytics, events, facets, feed
+from .inventory import record, set_stock
+from .models import ArchivedProduct, Product, Cart, CartItem
+from .pricing import tier_for
 from authentication.models import User
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -12,26 +19,29 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'vendor_name', 'retail_price', 
                  'whole_sale_price', 'stock_quantity', 'is_active', 'price', 'price_type']
     
-    def get_price(self, obj):
+    @cached_property
+    def tier(self):
+        # Resolved once; with many=True this is the child shared by every row.
         request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            try:
-                return obj.get_price_for_user(request.user)
-            except:
-                pass
-        return obj.retail_price
+        return tier_for(request.user if request else None)
+
+    def get_price(self, obj):
+        return self.tier.product_price(obj)
     
     def get_price_type(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            try:
-                if request.user.user_type == 'vip_customer':
-                    return 'vip_wholesale'
-                elif request.user.user_type == 'vendor':
-                    return 'wholesale'
-            except:
-                pass
-        return 'retail'
+        return self.tier.name
+
+class ArchivedProductSerializer(serializers.ModelSerializer):
+    vendor_name = serializers.CharField(source='vendor.full_name', read_only=True)
+    is_active = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedProduct
+        fields = ['id', 'name', 'description', 'vendor_name', 'retail_price', 'whole_sale_price',
+                  'stock_quantity', 'is_active', 'deactivated_at', 'archived_at']
+
+    def get_is_active(self, obj):
+        return False
 
 class ProductCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -39,9 +49,66 @@ class ProductCreateSerializer(serializers.ModelSerializer):
         fields = ['name', 'description', 'retail_price', 'whole_sale_price', 'stock_quantity']
     
     def validate(self, data):
-        if data['whole_sale_price'] >= data['retail_price']:
+        # PATCH only sends the changed fields; compare against the stored ones.
+        whole_sale_price = data.get('whole_sale_price', getattr(self.instance, 'whole_sale_price', None))
+        retail_price = data.get('retail_price', getattr(self.instance, 'retail_price', None))
+        if whole_sale_price is not None and retail_price is not None and whole_sale_price >= retail_price:
             raise serializers.ValidationError("Wholesale price must be less than retail price")
-        if data['stock_quantity'] < 0:
+        if data.get('stock_quantity', 0) < 0:
+            raise serializers.ValidationError("Stock quantity cannot be negative")
+        return data
+
+    # Stock changes also go into the ledger (services/inventory.py), and
+    # every write records a ProductChanged event (services/events.py).
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            product = super().create(validated_data)
+            record('restock', {product.id: product.stock_quantity}, 'created')
+            analytics.product_added(product)
+            facets.update({}, {product.id: facets.cell_for(product)})
+            events.product_changed()
+        return product
+
+    def update(self, instance, validated_data):
+        stock_quantity = validated_data.pop('stock_quantity', None)
+        repriced = any(
+            field in validated_data and validated_data[field] != getattr(instance, field)
+            for field in ('retail_price', 'whole_sale_price')
+        )
+        old_retail_price = instance.retail_price
+        before = feed.snapshot(instance)
+        with transaction.atomic():
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            # Not a plain save(): that would write back the stock_quantity
+            # read with the instance over any sale made since.
+            if validated_data:
+                moves = facets.CELL_FIELDS & validated_data.keys()
+                cells_before = facets.cells([instance.id], lock=True) if moves else None
+                instance.save(update_fields=[*validated_data, 'updated_at'])
+                if moves:
+                    facets.update(cells_before, facets.cells([instance.id]))
+            if stock_quantity is not None:
+                set_stock(instance, stock_quantity, 'vendor update')
+            if repriced:
+                # The carts holding it are repriced by the event's handler.
+                analytics.price_changed(instance, old_retail_price)
+            events.product_changed({instance.id: feed.diff(before, instance)})
+        return instance
+
+
+class ProductBulkUpdateSerializer(serializers.Serializer):
+    # One row of a bulk update (services/bulk_update.py); only id is required.
+    id = serializers.UUIDField()
+    stock_quantity = serializers.IntegerField(required=False)
+    retail_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    whole_sale_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+
+    def validate(self, data):
+        if len(data) == 1:
+            raise serializers.ValidationError("Nothing to update")
+        if data.get('stock_quantity', 0) < 0:
             raise serializers.ValidationError("Stock quantity cannot be negative")
         return data
 
@@ -58,11 +125,21 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product_id', 'product_name', 'quantity', 'unit_price', 
                  'total_price', 'stock_available']
     
+    @cached_property
+    def tiers(self):
+        # Per cart owner, resolved once; with many=True this is the child shared by every row.
+        return {}
+
+    def tier(self, obj):
+        if obj.cart.user_id not in self.tiers:
+            self.tiers[obj.cart.user_id] = obj.cart.pricing_tier
+        return self.tiers[obj.cart.user_id]
+
     def get_unit_price(self, obj):
-        return obj.product.get_price_for_user(obj.cart.user)
+        return obj.price_at(self.tier(obj))
     
     def get_total_price(self, obj):
-        return obj.total_price
+        return obj.price_at(self.tier(obj)) * obj.quantity
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -73,3 +150,129 @@ class CartSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cart
         fields = ['id', 'items', 'total_price', 'total_items', 'updated_at']
+
+
+# Fast path for the large read responses (catalog, vendor list, cart). Works
+# from values_list() rows instead of model instances and produces exactly
+# what ProductSerializer / CartSerializer render: decimal fields as strings,
+# the price fields as numbers (DRF's encoder turns a Decimal into a float),
+# ids as strings, in the same key order.
+
+PRODUCT_COLUMNS = (
+    'id', 'name', 'description', 'vendor__full_name', 'retail_price',
+    'whole_sale_price', 'stock_quantity', 'is_active',
+)
+
+CART_ITEM_COLUMNS = (
+    'id', 'product__name', 'quantity', 'product__retail_price',
+    'product__whole_sale_price', 'product__stock_quantity',
+)
+
+CENT = Decimal('0.01')
+
+_datetime_field = serializers.DateTimeField()
+
+
+def decimal_string(value):
+    # DecimalField(decimal_places=2).to_representation without the per-call context setup.
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return f'{value.quantize(CENT):f}'
+
+
+def product_data(rows, user=None):
+    """Rows of PRODUCT_COLUMNS as ProductSerializer(many=True) data for `user`."""
+    tier = tier_for(user)
+    rows = list(rows)
+    prices = tier.unit_prices([(row[4], row[5]) for row in rows])
+    return [
+        {
+            'id': str(product_id),
+            'name': name,
+            'description': description,
+            'vendor_name': vendor_name,
+            'retail_price': decimal_string(retail_price),
+            'whole_sale_price': decimal_string(whole_sale_price),
+            'stock_quantity': stock_quantity,
+            'is_active': is_active,
+            'price': float(price),
+            'price_type': tier.name,
+        }
+        for (product_id, name, description, vendor_name, retail_price,
+             whole_sale_price, stock_quantity, is_active), price in zip(rows, prices)
+    ]
+
+
+def serialize_products(queryset, user=None):
+    return product_data(queryset.values_list(*PRODUCT_COLUMNS), user)
+
+
+def cart_data(cart, rows):
+    """CartSerializer data for `cart` (with cart.user set) and its CART_ITEM_COLUMNS rows."""
+    rows = list(rows)
+    prices = tier_for(cart.user).line_prices([(row[3], row[4], row[2]) for row in rows])
+    items = []
+    total_price = 0
+    total_items = 0
+    for (item_id, product_name, quantity, _, _, stock_quantity), (unit_price, line_total) in zip(rows, prices):
+        total_price += line_total
+        total_items += quantity
+        items.append({
+            'id': str(item_id),
+            'product_name': product_name,
+            'quantity': quantity,
+            'unit_price': float(unit_price),
+            'total_price': float(line_total),
+            'stock_available': stock_quantity,
+        })
+    return {
+        'id': str(cart.id),
+        'items': items,
+        'total_price': decimal_string(total_price),
+        'total_items': total_items,
+        'updated_at': _datetime_field.to_representation(cart.updated_at),
+    }
+
+
+def serialize_cart(cart):
+    return cart_data(cart, CartItem.objects.filter(cart=cart).values_list(*CART_ITEM_COLUMNS))
+
+
+def order_data(order, lines):
+    """A placed Order and its OrderItems, decimals as strings like the model serializers."""
+    return {
+        'id': str(order.id),
+        'status': order.status,
+        'price_type': order.price_type,
+        'items': [
+            {
+                'product_id': str(line.product_id) if line.product_id else None,
+                'product_name': line.product_name,
+                'unit_price': decimal_string(line.unit_price),
+                'quantity': line.quantity,
+                'total_price': decimal_string(line.total_price),
+            }
+            for line in lines
+        ],
+        'total_price': decimal_string(order.total_price),
+        'total_items': order.total_items,
+        'created_at': _datetime_field.to_representation(order.created_at),
+    }
+
+
+def dashboard_data(dashboard):
+    """analytics.dashboard() with decimals and datetimes as strings."""
+    summary = dict(dashboard['summary'], catalog_value=decimal_string(dashboard['summary']['catalog_value']))
+    return {
+        'summary': summary,
+        'top_products': [dict(row, id=str(row['id'])) for row in dashboard['top_products']],
+        'period': dashboard['period'],
+        'buckets': [
+            dict(
+                row,
+                bucket=_datetime_field.to_representation(row['bucket']),
+                revenue=decimal_string(row['revenue']),
+            )
+            for row in dashboard['buckets']
+        ],
+    }
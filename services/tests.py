@@ -1,3 +1,1158 @@
-from django.test import TestCase
+import datetime
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.authentication import api_settings as jwt_settings
+
+from Notifications import outbox
+from Notifications.models import OutboxEvent
+from SaaS_Practice.renderers import FastJSONRenderer
+from SaaS_Practice.testing import QueryBudgetTestCase, make_user
+from . import analytics, archive, cart_totals, cleanup, facets, inventory
+from .async_views import AsyncProductListView
+from .consumers import ProductFeedConsumer
+from .feed import cart_group_name, product_group_name
+from .models import (
+    ArchivedProduct, Cart, CartItem, FacetCount, Order, OrderItem, Product, ProductStats, StockMovement,
+    VendorActivity, VendorStats,
+)
+from .pricing import annotate_unit_price, get_tier, tier_for
+from .serializers import CartItemSerializer, CartSerializer, ProductSerializer, serialize_cart, serialize_products
+from .urls import urlpatterns
+
+
+def drain_outbox():
+    while outbox.dispatch() != (0, 0):
+        pass
+
+
+class ServicesQueryBudgetTests(QueryBudgetTestCase):
+    """Every route in services/urls.py with its query budget."""
+
+    COVERED_ROUTES = {
+        'cart-view',
+        'product-list-generic',
+        'product-facets',
+        'vendor-product-list-create',
+        'vendor-product-detail-generic',
+        'vendor-product-bulk-update',
+        'manage-cart-products',
+        'cart-summary',
+        'vendor-analytics',
+        'checkout',
+        'product-list-async',
+        'cart-view-async',
+        'vendor-product-list-async',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor')
+        cls.customer = make_user('customer@example.com', 'normal_customer')
+        cls.vip = make_user('vip@example.com', 'vip_customer')
+        cls.product = cls.make_products(1)[0]
+        analytics.rebuild_vendors([cls.vendor.id])
+
+    @classmethod
+    def make_products(cls, count, vendor=None):
+        products = [
+            Product(
+                name=f"Product {i}",
+                vendor=vendor or cls.vendor,
+                retail_price=Decimal('10.00') + i,
+                whole_sale_price=Decimal('8.00') + i,
+                stock_quantity=100,
+            )
+            for i in range(count)
+        ]
+        return Product.objects.bulk_create(products)
+
+    def grow_catalog(self, size):
+        missing = size - Product.objects.filter(vendor=self.vendor).count()
+        if missing > 0:
+            self.make_products(missing)
+            facets.rebuild()
+
+    def grow_cart(self, user):
+        def grow(size):
+            cart, _ = Cart.objects.get_or_create(user=user)
+            self.grow_catalog(size)
+            in_cart = cart.items.values_list('product_id', flat=True)
+            for product in Product.objects.exclude(id__in=in_cart)[:size - cart.items.count()]:
+                CartItem.objects.create(cart=cart, product=product, quantity=2)
+            cart_totals.rebuild([cart.id])
+            analytics.rebuild_vendors([self.vendor.id])
+        return grow
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual({pattern.name for pattern in urlpatterns}, self.COVERED_ROUTES)
+
+    def test_product_list(self):
+        url = reverse('product-list-generic')
+        self.assertQueriesDoNotScale(1, lambda: self.client.get(url), self.grow_catalog)
+
+    def test_product_list_served_from_cache(self):
+        url = reverse('product-list-generic')
+        self.client.get(url)
+        self.assertQueryBudget(0, lambda: self.client.get(url))
+
+    def test_product_list_filtered(self):
+        url = reverse('product-list-generic')
+        params = {'vendor': str(self.vendor.id), 'price_band': '10-25,25-50', 'availability': 'in_stock'}
+        self.assertQueriesDoNotScale(1, lambda: self.client.get(url, params), self.grow_catalog)
+        self.assertQueryBudget(0, lambda: self.client.get(url, params))
+
+    def test_product_facets(self):
+        url = reverse('product-facets')
+        params = {'price_band': '10-25'}
+        self.assertQueriesDoNotScale(1, lambda: self.client.get(url, params), self.grow_catalog)
+        self.assertQueryBudget(0, lambda: self.client.get(url, params))
+
+    def test_vendor_product_list(self):
+        self.authenticate(self.vendor)
+        url = reverse('vendor-product-list-create')
+        self.assertQueriesDoNotScale(2, lambda: self.client.get(url), self.grow_catalog)
+
+    def test_vendor_product_create(self):
+        self.authenticate(self.vendor)
+        data = {'name': 'New', 'retail_price': '20.00', 'whole_sale_price': '15.00', 'stock_quantity': 5}
+        response, _ = self.assertQueryBudget(
+            12, lambda: self.client.post(reverse('vendor-product-list-create'), data, format='json')
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_vendor_product_detail(self):
+        self.authenticate(self.vendor)
+        url = reverse('vendor-product-detail-generic', kwargs={'id': self.product.id})
+        response, _ = self.assertQueryBudget(2, lambda: self.client.get(url))
+        self.assertEqual(response.status_code, 200)
+
+    def test_vendor_product_update(self):
+        self.authenticate(self.vendor)
+        url = reverse('vendor-product-detail-generic', kwargs={'id': self.product.id})
+        response, _ = self.assertQueryBudget(
+            11, lambda: self.client.patch(url, {'stock_quantity': 7}, format='json')
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_vendor_product_update_reports_only_changed_fields(self):
+        self.authenticate(self.vendor)
+        url = reverse('vendor-product-detail-generic', kwargs={'id': self.product.id})
+        for data, changes in [
+            # The name isn't in the feed; the list cache is still invalidated.
+            ({'name': 'Renamed'}, {}),
+            ({'whole_sale_price': '7.50'}, {str(self.product.id): {'whole_sale_price': '7.50'}}),
+            ({'retail_price': '12.00'}, {str(self.product.id): {'retail_price': '12.00'}}),
+        ]:
+            with self.subTest(data=data):
+                response = self.client.patch(url, data, format='json')
+                self.assertEqual(response.status_code, 200)
+                event = OutboxEvent.objects.latest('id')
+                self.assertEqual((event.kind, event.payload), ('ProductChanged', {'products': changes}))
+
+    def test_vendor_product_bulk_update(self):
+        self.authenticate(self.vendor)
+        url = reverse('vendor-product-bulk-update')
+        calls = iter(range(1, 100))
+        product_ids = []
+
+        def grow(size):
+            self.grow_catalog(size)
+            product_ids[:] = Product.objects.filter(vendor=self.vendor).values_list('id', flat=True)
+
+        def sync():
+            # New prices and stock on every call, so each one writes.
+            n = next(calls)
+            rows = [
+                {'id': str(product_id), 'stock_quantity': 50 + n, 'retail_price': f'{40 + n}.00'}
+                for product_id in product_ids
+            ]
+            response = self.client.patch(url, {'products': rows}, format='json')
+            self.assertEqual(response.json()['updated'], len(rows))
+            return response
+
+        self.assertQueriesDoNotScale(16, sync, grow)
+
+    def test_vendor_product_delete(self):
+        self.authenticate(self.vendor)
+        url = reverse('vendor-product-detail-generic', kwargs={'id': self.product.id})
+        response, _ = self.assertQueryBudget(9, lambda: self.client.delete(url))
+        self.assertEqual(response.status_code, 204)
+
+    def test_cart_get(self):
+        for user in (self.customer, self.vip):
+            with self.subTest(user_type=user.user_type):
+                self.authenticate(user)
+                url = reverse('cart-view')
+                self.assertQueriesDoNotScale(3, lambda: self.client.get(url), self.grow_cart(user))
+
+    def test_cart_add(self):
+        self.authenticate(self.customer)
+        data = {'product_id': str(self.product.id), 'quantity': 1}
+        response, _ = self.assertQueryBudget(
+            18, lambda: self.client.post(reverse('cart-view'), data, format='json')
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_manage_cart_update_and_delete(self):
+        self.authenticate(self.customer)
+        cart = Cart.objects.create(user=self.customer)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        cart_totals.rebuild([cart.id])
+        url = reverse('manage-cart-products')
+        data = {'product_id': str(self.product.id), 'quantity': 3}
+        response, _ = self.assertQueryBudget(12, lambda: self.client.put(url, data, format='json'))
+        self.assertEqual(response.status_code, 200)
+        response, _ = self.assertQueryBudget(
+            13, lambda: self.client.delete(url, {'product_id': str(self.product.id)}, format='json')
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_vendor_analytics(self):
+        self.authenticate(self.vendor)
+        url = reverse('vendor-analytics')
+        for period in ('hour', 'day'):
+            response, _ = self.assertQueryBudget(4, lambda: self.client.get(url, {'period': period}))
+            self.assertEqual(response.status_code, 200)
+
+    def test_cart_summary(self):
+        self.authenticate(self.vip)
+        url = reverse('cart-summary')
+        self.assertQueriesDoNotScale(3, lambda: self.client.get(url), self.grow_cart(self.vip))
+
+    def test_checkout(self):
+        self.authenticate(self.customer)
+        url = reverse('checkout')
+        self.assertQueriesDoNotScale(23, lambda: self.client.post(url), self.grow_cart(self.customer))
+
+    def test_async_product_list(self):
+        url = reverse('product-list-async')
+        self.assertQueriesDoNotScale(1, lambda: self.client.get(url), self.grow_catalog)
+        self.assertQueryBudget(0, lambda: self.client.get(url))
+
+    def test_async_vendor_product_list(self):
+        self.authenticate(self.vendor)
+        url = reverse('vendor-product-list-async')
+        self.assertQueriesDoNotScale(2, lambda: self.client.get(url), self.grow_catalog)
+
+    def test_async_cart_get(self):
+        for user in (self.customer, self.vip):
+            with self.subTest(user_type=user.user_type):
+                self.authenticate(user)
+                url = reverse('cart-view-async')
+                self.assertQueriesDoNotScale(3, lambda: self.client.get(url), self.grow_cart(user))
+
+
+class CheckoutTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor')
+        cls.vip = make_user('vip@example.com', 'vip_customer')
+        cls.widget, cls.gadget = Product.objects.bulk_create([
+            Product(name='Widget', vendor=cls.vendor, retail_price=Decimal('10.00'),
+                    whole_sale_price=Decimal('8.00'), stock_quantity=5),
+            Product(name='Gadget', vendor=cls.vendor, retail_price=Decimal('3.50'),
+                    whole_sale_price=Decimal('3.00'), stock_quantity=2),
+        ])
+
+    def setUp(self):
+        super().setUp()
+        self.cart = Cart.objects.create(user=self.vip)
+        CartItem.objects.create(cart=self.cart, product=self.widget, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.gadget, quantity=2)
+        self.authenticate(self.vip)
+
+    def stock(self):
+        return dict(Product.objects.values_list('name', 'stock_quantity'))
+
+    def test_places_order_at_the_users_prices(self):
+        self.client.get(reverse('product-list-generic'))
+        response = self.client.post(reverse('checkout'))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['price_type'], 'vip_wholesale')
+        self.assertEqual(response.json()['total_price'], '22.00')
+        self.assertEqual(
+            sorted((line['product_name'], line['unit_price']) for line in response.json()['items']),
+            [('Gadget', '3.00'), ('Widget', '8.00')],
+        )
+        self.assertEqual(self.stock(), {'Widget': 3, 'Gadget': 0})
+        self.assertFalse(self.cart.items.exists())
+
+        # Later price changes don't touch the order.
+        Product.objects.update(whole_sale_price=Decimal('1.00'))
+        self.assertEqual(Order.objects.get().items.get(product=self.widget).unit_price, Decimal('8.00'))
+
+        # The cached product list is invalidated once the order's
+        # ProductChanged event is dispatched: Gadget is sold out.
+        names = [product['name'] for product in self.client.get(reverse('product-list-generic')).json()]
+        self.assertEqual(names, ['Widget', 'Gadget'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(outbox.dispatch(), (2, 0))
+        names = [product['name'] for product in self.client.get(reverse('product-list-generic')).json()]
+        self.assertEqual(names, ['Widget'])
+
+    def test_short_line_fails_the_whole_checkout(self):
+        Product.objects.filter(id=self.gadget.id).update(stock_quantity=1)
+        response = self.client.post(reverse('checkout'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['items'], [
+            {'product_id': str(self.gadget.id), 'requested': 2, 'available': 1},
+        ])
+        self.assertEqual(self.stock(), {'Widget': 5, 'Gadget': 1})
+        self.assertEqual(self.cart.items.count(), 2)
+        self.assertFalse(Order.objects.exists())
+
+    def test_empty_cart(self):
+        self.cart.items.all().delete()
+        response = self.client.post(reverse('checkout'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Cart is empty'})
+
+
+class StockLedgerTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor')
+        cls.customer = make_user('customer@example.com', 'normal_customer')
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.vendor)
+        response = self.client.post(reverse('vendor-product-list-create'), {
+            'name': 'Widget', 'retail_price': '10.00', 'whole_sale_price': '8.00', 'stock_quantity': 5,
+        }, format='json')
+        self.product = Product.objects.get(name=response.json()['name'])
+
+    def stock(self):
+        return Product.objects.values_list('stock_quantity', flat=True).get(id=self.product.id)
+
+    def movements(self):
+        return list(StockMovement.objects.order_by('id').values_list('kind', 'quantity'))
+
+    def test_every_change_is_recorded(self):
+        inventory.add_stock(self.product.id, 3)
+        self.assertEqual(self.stock(), 8)
+        url = reverse('vendor-product-detail-generic', kwargs={'id': self.product.id})
+        self.client.patch(url, {'stock_quantity': 10}, format='json')
+        self.assertEqual(self.stock(), 10)
+
+        cart = Cart.objects.create(user=self.customer)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=4)
+        self.authenticate(self.customer)
+        order_id = self.client.post(reverse('checkout')).json()['id']
+
+        self.assertEqual(self.stock(), 6)
+        self.assertEqual(self.movements(), [('restock', 5), ('restock', 3), ('adjustment', 2), ('sale', -4)])
+        self.assertEqual(StockMovement.objects.get(kind='sale').reference, order_id)
+        self.assertEqual(inventory.verify(), [])
+
+    def test_take_stock_never_oversells(self):
+        inventory.add_stock(self.product.id, 3)
+        with transaction.atomic():
+            self.assertTrue(inventory.take_stock({self.product.id: 7}))
+        self.assertEqual(self.stock(), 1)
+        with transaction.atomic():
+            self.assertFalse(inventory.take_stock({self.product.id: 2}))
+        self.assertEqual(self.stock(), 1)
+        self.assertEqual(inventory.verify(), [])
+
+    def test_verify_and_replay(self):
+        Product.objects.filter(id=self.product.id).update(stock_quantity=99)
+        with self.assertRaisesMessage(CommandError, '1 products disagree'):
+            call_command('stock_ledger', 'verify', stdout=StringIO())
+        call_command('stock_ledger', 'replay', stdout=StringIO())
+        self.assertEqual(self.stock(), 5)
+        call_command('stock_ledger', 'verify', stdout=StringIO())
+
+
+VOLUME_DISCOUNT = {'class': 'services.pricing.VolumeDiscount', 'min_quantity': 3, 'percent': '10'}
+
+
+class PricingTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor')
+        cls.users = [cls.vendor, make_user('customer@example.com'), make_user('vip@example.com', 'vip_customer')]
+        cls.products = Product.objects.bulk_create([
+            Product(name='A', vendor=cls.vendor, retail_price=Decimal('12.34'),
+                    whole_sale_price=Decimal('11.11'), stock_quantity=10),
+            Product(name='B', vendor=cls.vendor, retail_price=Decimal('7.00'),
+                    whole_sale_price=Decimal('5.55'), stock_quantity=10),
+        ])
+        for user in cls.users:
+            cart = Cart.objects.create(user=user)
+            for quantity, product in enumerate(cls.products, 2):
+                CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+
+    def legacy_price(self, product, user):
+        # What Product.get_price_for_user returned before the tiers.
+        return product.whole_sale_price if user.user_type == 'vip_customer' else product.retail_price
+
+    def cart_prices(self):
+        """Every cart line priced per object, in the batch serializer and in SQL."""
+        items = CartItem.objects.select_related('cart__user', 'product').order_by('cart__user__email', 'product__name')
+        annotated = annotate_unit_price(items, 'cart__user__user_type', 'product__', 'quantity', name='sql_price')
+        batch = {}
+        for user in self.users:
+            for line in serialize_cart(Cart.objects.get(user=user))['items']:
+                batch[(user.email, line['product_name'])] = Decimal(str(line['unit_price']))
+        return [
+            (item.unit_price, batch[(item.cart.user.email, item.product.name)], item.sql_price)
+            for item in annotated
+        ]
+
+    def test_without_rules_prices_are_unchanged(self):
+        for user in self.users + [AnonymousUser()]:
+            tier = tier_for(user)
+            for product in self.products:
+                expected = product.retail_price if user.is_anonymous else self.legacy_price(product, user)
+                self.assertEqual(product.get_price_for_user(user), expected)
+                self.assertEqual(tier.unit_prices([(product.retail_price, product.whole_sale_price)]), [expected])
+        for per_object, batch, sql in self.cart_prices():
+            self.assertEqual(per_object, batch)
+            self.assertEqual(per_object, sql)
+
+    @override_settings(PRICING_RULES={'vip_wholesale': [VOLUME_DISCOUNT], 'retail': [VOLUME_DISCOUNT]})
+    def test_rules_apply_alike_everywhere(self):
+        prices = self.cart_prices()
+        for per_object, batch, sql in prices:
+            self.assertEqual(per_object, batch)
+            self.assertEqual(per_object, sql)
+        # By email: the customer's and the vip's 3 x B get 10% off (4.995 rounds
+        # half up to 5.00); the vendors' tier has no rules.
+        self.assertEqual([line[0] for line in prices], [
+            Decimal('12.34'), Decimal('6.30'),
+            Decimal('12.34'), Decimal('7.00'),
+            Decimal('11.11'), Decimal('5.00'),
+        ])
+        self.assertEqual(Cart.objects.get(user=self.users[2]).total_price, Decimal('37.22'))
+
+    @override_settings(PRICING_RULES={'vip_wholesale': [VOLUME_DISCOUNT], 'retail': [VOLUME_DISCOUNT]})
+    def test_tiers_are_resolved_once_per_batch(self):
+        items = CartItem.objects.select_related('cart__user', 'product').order_by('cart__user__email', 'product__name')
+        cart = Cart.objects.select_related('user').get(user=self.users[2])
+        prefetch_related_objects([cart], Prefetch('items', queryset=CartItem.objects.select_related('product')))
+        with mock.patch('services.pricing.get_tier', wraps=get_tier) as resolved:
+            rows = CartItemSerializer(items, many=True).data
+            self.assertEqual(resolved.call_count, len(self.users))
+            resolved.reset_mock()
+            data = CartSerializer(cart).data
+            self.assertEqual(resolved.call_count, 1)
+        self.assertEqual([Decimal(str(row['unit_price'])) for row in rows], [item.unit_price for item in items])
+        self.assertEqual(Decimal(data['total_price']), Decimal('37.22'))
+
+    def test_admin_prices_cart_items_in_the_query(self):
+        model_admin = admin.site._registry[CartItem]
+        queryset = model_admin.get_queryset(RequestFactory().get('/'))
+        rows, _ = self.assertQueryBudget(1, lambda: list(queryset))
+        for item in rows:
+            self.assertEqual(model_admin.unit_price(item), item.unit_price)
+            self.assertEqual(model_admin.total_price(item), item.total_price)
+
+
+class CartTotalsTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor')
+        cls.customer = make_user('customer@example.com', 'normal_customer')
+        cls.products = Product.objects.bulk_create([
+            Product(name='A', vendor=cls.vendor, retail_price=Decimal('12.50'),
+                    whole_sale_price=Decimal('10.00'), stock_quantity=50),
+            Product(name='B', vendor=cls.vendor, retail_price=Decimal('3.00'),
+                    whole_sale_price=Decimal('2.25'), stock_quantity=50),
+        ])
+
+    def cart(self):
+        return Cart.objects.get(user=self.customer)
+
+    def stored(self):
+        cart = self.cart()
+        return {
+            (cart.id, row.tier): (row.total_items, row.total_price) for row in cart.totals.all()
+        }
+
+    def assertTotalsCurrent(self):
+        cart = self.cart()
+        self.assertEqual(self.stored(), cart_totals.compute([cart.id]))
+        self.assertEqual(cart_totals.check(), [])
+
+    def summary(self):
+        return self.client.get(reverse('cart-summary')).json()
+
+    def test_cart_changes_keep_totals_current(self):
+        self.authenticate(self.customer)
+        a, b = (str(product.id) for product in self.products)
+        self.client.post(reverse('cart-view'), {'product_id': a, 'quantity': 2}, format='json')
+        self.client.post(reverse('cart-view'), {'product_id': b, 'quantity': 3}, format='json')
+        self.client.post(reverse('cart-view'), {'product_id': a, 'quantity': 1}, format='json')
+        self.assertTotalsCurrent()
+        self.assertEqual(self.summary(), {
+            'id': str(self.cart().id), 'total_items': 6, 'total_price': '46.50', 'price_type': 'retail',
+        })
+
+        url = reverse('manage-cart-products')
+        self.client.put(url, {'product_id': b, 'quantity': 1}, format='json')
+        self.assertTotalsCurrent()
+        self.client.delete(url, {'product_id': a}, format='json')
+        self.assertTotalsCurrent()
+        self.assertEqual(self.summary()['total_price'], '3.00')
+
+    def test_price_change_reprices_carts(self):
+        cart = Cart.objects.create(user=self.customer)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=2)
+        cart_totals.rebuild([cart.id])
+        self.authenticate(self.vendor)
+        url = reverse('vendor-product-detail-generic', kwargs={'id': self.products[0].id})
+        response = self.client.patch(url, {'retail_price': '20.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        # Not in the vendor's request: the outbox reprices the carts.
+        self.assertEqual(self.cart().total_price, Decimal('25.00'))
+        drain_outbox()
+        self.assertTotalsCurrent()
+        self.assertEqual(self.cart().total_price, Decimal('40.00'))
+
+    def test_repricing_runs_in_batches(self):
+        carts = []
+        for i in range(5):
+            cart = Cart.objects.create(user=make_user(f'buyer{i}@example.com'))
+            CartItem.objects.create(cart=cart, product=self.products[0], quantity=1)
+            carts.append(cart.id)
+        CartItem.objects.create(cart_id=carts[0], product=self.products[1], quantity=1)
+        cart_totals.rebuild(carts)
+        Product.objects.filter(id__in=[self.products[0].id, self.products[1].id]).update(retail_price=Decimal('1.00'))
+
+        cart_totals.reprice_later([self.products[0].id, self.products[1].id])
+        batches = []
+        while event := OutboxEvent.objects.filter(kind='CartsRepriced', dispatched_at__isnull=True).first():
+            event.delete()
+            with CaptureQueriesContext(connection) as queries:
+                cart_totals.deliver_carts_repriced(event.payload, batch_size=2)
+            batches.append(len(queries))
+        # 2 + 2 + 1 carts; each batch the same few queries.
+        self.assertEqual(len(batches), 3)
+        self.assertEqual(len(set(batches[:2])), 1)
+        self.assertEqual(cart_totals.check(), [])
+
+    def test_tier_change_reads_the_other_row(self):
+        cart = Cart.objects.create(user=self.customer)
+        CartItem.objects.create(cart=cart, product=self.products[1], quantity=4)
+        cart_totals.rebuild([cart.id])
+        self.assertEqual(self.cart().total_price, Decimal('12.00'))
+        self.customer.user_type = 'vip_customer'
+        self.customer.save(update_fields=['user_type'])
+        self.assertEqual(self.cart().total_price, Decimal('9.00'))
+
+    def test_unmaterialized_cart_falls_back_to_items(self):
+        cart = Cart.objects.create(user=self.customer)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=2)
+        self.assertEqual(self.cart().total_price, Decimal('25.00'))
+        self.authenticate(self.customer)
+        self.assertEqual(self.summary()['total_price'], '25.00')
+        self.assertTotalsCurrent()
+
+    def test_check_command_finds_and_fixes_drift(self):
+        cart = Cart.objects.create(user=self.customer)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=2)
+        cart_totals.rebuild([cart.id])
+        call_command('check_cart_totals', stdout=StringIO())
+        cart.totals.filter(tier='retail').update(total_price=Decimal('1.00'))
+        with self.assertRaisesMessage(CommandError, "1 cart totals disagree with the items."):
+            call_command('check_cart_totals', stdout=StringIO())
+        call_command('check_cart_totals', '--fix', stdout=StringIO())
+        self.assertTotalsCurrent()
+
+
+class AnalyticsTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor')
+        cls.customer = make_user('customer@example.com', 'normal_customer')
+
+    def create_product(self, **data):
+        self.authenticate(self.vendor)
+        data = {'name': 'P', 'retail_price': '10.00', 'whole_sale_price': '8.00', 'stock_quantity': 20, **data}
+        response = self.client.post(reverse('vendor-product-list-create'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Product.objects.get(vendor=self.vendor, name=data['name'])
+
+    def stored(self):
+        stats = VendorStats.objects.filter(vendor=self.vendor).values(
+            'products', 'units_in_carts', 'low_stock', 'catalog_value',
+        ).get()
+        # No row and a row of 0 both mean none in carts.
+        products = dict(ProductStats.objects.exclude(units_in_carts=0).values_list('product_id', 'units_in_carts'))
+        activity = {
+            (row.period, row.bucket): (row.orders, row.units_sold, row.revenue, row.units_restocked)
+            for row in VendorActivity.objects.filter(vendor=self.vendor)
+        }
+        return stats, products, activity
+
+    def assertMatchesRebuild(self):
+        incremental = self.stored()
+        call_command('rebuild_analytics', stdout=StringIO())
+        self.assertEqual(incremental, self.stored())
+
+    def test_events_keep_rollups_current(self):
+        a = self.create_product(name='A', stock_quantity=6)
+        b = self.create_product(name='B', retail_price='4.00', whole_sale_price='3.00', stock_quantity=2)
+        self.authenticate(self.customer)
+        self.client.post(reverse('cart-view'), {'product_id': str(a.id), 'quantity': 3}, format='json')
+        self.client.post(reverse('cart-view'), {'product_id': str(b.id), 'quantity': 1}, format='json')
+        self.assertEqual(self.client.post(reverse('checkout')).status_code, 201)
+        self.client.post(reverse('cart-view'), {'product_id': str(b.id), 'quantity': 1}, format='json')
+        self.authenticate(self.vendor)
+        url = reverse('vendor-product-detail-generic', kwargs={'id': a.id})
+        self.client.patch(url, {'retail_price': '12.00'}, format='json')
+        self.assertMatchesRebuild()
+
+        data = self.client.get(reverse('vendor-analytics'), {'period': 'day', 'buckets': 7}).json()
+        # A: 3 left at 12.00; B: 1 left at 4.00, in a cart.
+        self.assertEqual(data['summary'], {
+            'products': 2, 'units_in_carts': 1, 'low_stock': 2, 'low_stock_threshold': 5, 'catalog_value': '40.00',
+        })
+        self.assertEqual(data['top_products'], [{'id': str(b.id), 'name': 'B', 'units_in_carts': 1}])
+        self.assertEqual(len(data['buckets']), 7)
+        self.assertEqual(data['buckets'][-1], dict(
+            data['buckets'][-1], orders=1, units_sold=4, revenue='34.00', units_restocked=8,
+        ))
+        self.assertEqual(sum(bucket['orders'] for bucket in data['buckets']), 1)
+
+    def test_stock_changes_and_deletes(self):
+        a = self.create_product(name='A', stock_quantity=10)
+        self.create_product(name='B', stock_quantity=1)
+        url = reverse('vendor-product-detail-generic', kwargs={'id': a.id})
+        self.client.patch(url, {'stock_quantity': 4}, format='json')
+        self.assertEqual(VendorStats.objects.get(vendor=self.vendor).low_stock, 2)
+        inventory.add_stock(a.id, 6)
+        self.assertEqual(VendorStats.objects.get(vendor=self.vendor).low_stock, 1)
+        self.assertMatchesRebuild()
+        # Deleting only deactivates; the product counts until it is archived.
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertMatchesRebuild()
+        self.assertEqual(archive.archive_products(after_days=0, pause=0), 1)
+        stats, _, _ = self.stored()
+        self.assertEqual((stats['products'], stats['low_stock'], stats['catalog_value']), (1, 1, Decimal('10.00')))
+        self.assertMatchesRebuild()
+
+    def test_rollups_are_built_on_first_read(self):
+        Product.objects.create(name='Seeded', vendor=self.vendor, retail_price=Decimal('5.00'),
+                               whole_sale_price=Decimal('4.00'), stock_quantity=3)
+        self.authenticate(self.vendor)
+        data = self.client.get(reverse('vendor-analytics')).json()
+        self.assertEqual(data['summary']['catalog_value'], '15.00')
+        self.assertEqual(len(data['buckets']), 24)
+
+    def test_rejects_bad_parameters(self):
+        self.authenticate(self.vendor)
+        url = reverse('vendor-analytics')
+        for params in ({'period': 'week'}, {'buckets': 'x'}, {'period': 'day', 'buckets': 400}):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+        self.authenticate(self.customer)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class FacetTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendors = [make_user('a@example.com', 'vendor'), make_user('b@example.com', 'vendor')]
+        cls.customer = make_user('customer@example.com', 'normal_customer')
+
+    def create_product(self, vendor, price, stock):
+        self.authenticate(vendor)
+        data = {'name': f'{price} x {stock}', 'retail_price': price, 'whole_sale_price': '1.00', 'stock_quantity': stock}
+        self.assertEqual(self.client.post(reverse('vendor-product-list-create'), data, format='json').status_code, 201)
+        return Product.objects.get(vendor=vendor, name=data['name'])
+
+    def facets(self, **params):
+        return self.client.get(reverse('product-facets'), params).json()
+
+    def counts(self, data, facet):
+        return {row['value']: row['count'] for row in data['facets'][facet]}
+
+    def assertConsistent(self):
+        # TestCase never commits, so the catalog generation isn't bumped.
+        cache.clear()
+        self.assertEqual(facets.verify(), [])
+        for params in ({}, {'price_band': '10-25'}, {'availability': 'low_stock', 'vendor': str(self.vendors[0].id)}):
+            listed = self.client.get(reverse('product-list-generic'), params).json()
+            self.assertEqual(self.facets(**params)['total'], len(listed))
+
+    def test_counts_follow_product_changes(self):
+        a, b = self.vendors
+        cheap = self.create_product(a, '5.00', 3)
+        mid = self.create_product(a, '20.00', 50)
+        self.create_product(b, '20.00', 2)
+        self.create_product(b, '300.00', 0)
+        self.assertConsistent()
+
+        self.authenticate(a)
+        url = reverse('vendor-product-detail-generic', kwargs={'id': cheap.id})
+        self.client.patch(url, {'retail_price': '15.00'}, format='json')
+        self.client.patch(reverse('vendor-product-detail-generic', kwargs={'id': mid.id}),
+                          {'stock_quantity': 4}, format='json')
+        self.assertConsistent()
+
+        self.authenticate(self.customer)
+        self.client.post(reverse('cart-view'), {'product_id': str(cheap.id), 'quantity': 3}, format='json')
+        self.client.post(reverse('checkout'))
+        self.assertConsistent()
+
+        self.authenticate(a)
+        self.client.delete(reverse('vendor-product-detail-generic', kwargs={'id': mid.id}))
+        self.assertConsistent()
+        self.assertEqual(self.facets()['total'], 1)
+
+    def test_each_facet_counts_under_the_other_filters(self):
+        a, b = self.vendors
+        self.create_product(a, '5.00', 3)
+        self.create_product(a, '20.00', 50)
+        self.create_product(b, '20.00', 2)
+        data = self.facets(vendor=str(a.id), price_band='10-25')
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(self.counts(data, 'vendor'), {str(a.id): 1, str(b.id): 1})
+        self.assertEqual(self.counts(data, 'price_band'), {'0-10': 1, '10-25': 1})
+        self.assertEqual(self.counts(data, 'availability'), {'in_stock': 1})
+        self.assertEqual(data['facets']['vendor'][0]['label'], a.full_name)
+
+    def test_rejects_unknown_values(self):
+        for params in ({'vendor': 'nope'}, {'price_band': '1-2'}, {'availability': 'soon'}):
+            self.assertEqual(self.client.get(reverse('product-list-generic'), params).status_code, 400)
+            self.assertEqual(self.client.get(reverse('product-facets'), params).status_code, 400)
+
+    def test_command_verifies_and_rebuilds(self):
+        self.create_product(self.vendors[0], '20.00', 50)
+        call_command('catalog_facets', 'verify', stdout=StringIO())
+        FacetCount.objects.update(count=7)
+        with self.assertRaisesMessage(CommandError, "1 facet counts disagree with the products."):
+            call_command('catalog_facets', 'verify', stdout=StringIO())
+        call_command('catalog_facets', 'rebuild', stdout=StringIO())
+        self.assertEqual(facets.verify(), [])
+
+    def test_seeded_catalog_is_indexed(self):
+        call_command('seed', '--customers', '6', '--vendors', '2', '--products-per-vendor', '10',
+                     '--product-distribution', 'fixed', '--cart-ratio', '1', stdout=StringIO())
+        self.assertEqual(facets.verify(), [])
+        self.assertEqual(cart_totals.check(), [])
+        self.assertEqual(VendorStats.objects.filter(vendor__email__endswith='@seed1.example.com').count(), 2)
+        listed = self.client.get(reverse('product-list-generic')).json()
+        self.assertTrue(listed)
+        self.assertEqual(self.facets()['total'], len(listed))
+
+
+class CartCleanupTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor')
+        cls.customers = [make_user(f'customer{i}@example.com', 'normal_customer') for i in range(5)]
+        cls.active, cls.inactive = Product.objects.bulk_create([
+            Product(name='Active', vendor=cls.vendor, retail_price=Decimal('10.00'),
+                    whole_sale_price=Decimal('8.00'), stock_quantity=50),
+            Product(name='Gone', vendor=cls.vendor, retail_price=Decimal('5.00'),
+                    whole_sale_price=Decimal('4.00'), stock_quantity=50, is_active=False),
+        ])
+
+    def setUp(self):
+        super().setUp()
+        self.carts = []
+        for customer in self.customers:
+            cart = Cart.objects.create(user=customer)
+            CartItem.objects.create(cart=cart, product=self.active, quantity=1)
+            CartItem.objects.create(cart=cart, product=self.inactive, quantity=2)
+            self.carts.append(cart)
+        cart_totals.rebuild([cart.id for cart in self.carts])
+        analytics.rebuild_vendors([self.vendor.id])
+        # The first two haven't changed for 40 days.
+        idle_since = timezone.now() - datetime.timedelta(days=40)
+        Cart.objects.filter(id__in=[cart.id for cart in self.carts[:2]]).update(updated_at=idle_since)
+
+    def test_sweeps_in_batches(self):
+        pauses = []
+        removed = cleanup.sweep(idle_days=30, batch_size=2, pause=0.25, sleep=pauses.append)
+        self.assertEqual(removed, {'inactive_items': 5, 'idle_carts': 2, 'idle_cart_items': 2})
+        # Three batches of inactive items, one of idle carts.
+        self.assertEqual(pauses, [0.25] * 4)
+        self.assertEqual(set(Cart.objects.values_list('id', flat=True)), {cart.id for cart in self.carts[2:]})
+        self.assertFalse(CartItem.objects.filter(product=self.inactive).exists())
+        self.assertEqual(cart_totals.check(), [])
+        stats = VendorStats.objects.get(vendor=self.vendor)
+        self.assertEqual(stats.units_in_carts, 3)
+        self.assertEqual(analytics.compute_vendors([self.vendor.id])[self.vendor.id]['units_in_carts'], 3)
+
+    def test_cart_changes_keep_a_cart_from_being_swept(self):
+        self.authenticate(self.customers[0])
+        self.client.post(reverse('cart-view'), {'product_id': str(self.active.id), 'quantity': 1}, format='json')
+        removed = cleanup.sweep(idle_days=30, pause=0)
+        self.assertEqual(removed['idle_carts'], 1)
+        self.assertTrue(Cart.objects.filter(user=self.customers[0]).exists())
+
+    def test_idle_carts_lock_their_items_first(self):
+        cutoff = timezone.now() - datetime.timedelta(days=30)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(cleanup.sweep_idle_carts(cutoff, 10, lambda: None), (2, 4))
+        # After the batch of cart ids, the way checkout takes them: items, then carts.
+        tables = [query['sql'].split(' FROM ', 1)[1].split()[0] for query in queries.captured_queries[1:]
+                  if query['sql'].startswith(('SELECT', 'DELETE'))]
+        self.assertEqual(tables[:2], ['"services_cartitem"', '"services_cart"'])
+        deletes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('DELETE')]
+        self.assertTrue(deletes[0].startswith('DELETE FROM "services_cartitem"'))
+        self.assertFalse(CartItem.objects.filter(cart_id__in=[cart.id for cart in self.carts[:2]]).exists())
+        self.assertEqual(Cart.objects.count(), 3)
+
+    def test_command_dry_run_removes_nothing(self):
+        out = StringIO()
+        call_command('sweep_carts', '--dry-run', '--sleep', '0', stdout=out)
+        self.assertIn("Would remove 5 items of inactive products and 2 idle carts holding 4 items.", out.getvalue())
+        self.assertEqual(CartItem.objects.count(), 10)
+
+
+class BulkUpdateTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor')
+        cls.other_vendor = make_user('other@example.com', 'vendor')
+        cls.customer = make_user('customer@example.com', 'normal_customer')
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.vendor)
+        for name, price in (('A', '10.00'), ('B', '20.00'), ('C', '30.00')):
+            data = {'name': name, 'retail_price': price, 'whole_sale_price': '5.00', 'stock_quantity': 10}
+            self.client.post(reverse('vendor-product-list-create'), data, format='json')
+        self.a, self.b, self.c = Product.objects.filter(vendor=self.vendor).order_by('name')
+        self.authenticate(self.customer)
+        self.client.post(reverse('cart-view'), {'product_id': str(self.a.id), 'quantity': 2}, format='json')
+        self.authenticate(self.vendor)
+
+    def sync(self, rows):
+        return self.client.patch(reverse('vendor-product-bulk-update'), {'products': rows}, format='json')
+
+    def test_applies_every_row(self):
+        inventory.add_stock(self.b.id, 4)
+        rows = [
+            {'id': str(self.a.id), 'retail_price': '32.00', 'whole_sale_price': '6.00'},
+            {'id': str(self.b.id), 'stock_quantity': 3},
+            {'id': str(self.c.id), 'retail_price': '30.00', 'stock_quantity': 10},
+        ]
+        emitted = OutboxEvent.objects.count()
+        response = self.sync(rows)
+        self.assertEqual(response.json(), {'updated': 2, 'repriced': 1, 'restocked': 1})
+        # One event for the feed and the cache.
+        self.assertEqual(OutboxEvent.objects.count(), emitted + 1)
+        event = OutboxEvent.objects.latest('id')
+        self.assertEqual((event.kind, event.payload), ('ProductChanged', {'products': {
+            str(self.a.id): {'retail_price': '32.00', 'whole_sale_price': '6.00'},
+            str(self.b.id): {'stock_quantity': 3},
+        }}))
+
+        prices = {name: (retail, wholesale, stock) for name, retail, wholesale, stock in Product.objects.values_list(
+            'name', 'retail_price', 'whole_sale_price', 'stock_quantity',
+        )}
+        self.assertEqual(prices, {
+            'A': (Decimal('32.00'), Decimal('6.00'), 10),
+            'B': (Decimal('20.00'), Decimal('5.00'), 3),
+            'C': (Decimal('30.00'), Decimal('5.00'), 10),
+        })
+        self.assertEqual(inventory.verify(), [])
+        # A's carts are repriced once the outbox runs, not in the request.
+        self.assertNotEqual(cart_totals.check(), [])
+        drain_outbox()
+        self.assertEqual(cart_totals.check(), [])
+        self.assertEqual(facets.verify(), [])
+        stored = VendorStats.objects.values('products', 'units_in_carts', 'low_stock', 'catalog_value').get(
+            vendor=self.vendor,
+        )
+        self.assertEqual(stored, analytics.compute_vendors([self.vendor.id])[self.vendor.id])
+
+    def test_rejects_the_whole_batch(self):
+        foreign = Product.objects.create(name='X', vendor=self.other_vendor, retail_price=Decimal('9.00'),
+                                         whole_sale_price=Decimal('1.00'), stock_quantity=1)
+        response = self.sync([
+            {'id': str(self.a.id), 'stock_quantity': 1},
+            {'id': str(self.b.id), 'whole_sale_price': '25.00'},
+            {'id': str(foreign.id), 'stock_quantity': 5},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual({row['id'] for row in response.json()['products']}, {str(self.b.id), str(foreign.id)})
+        self.assertEqual(Product.objects.get(id=self.a.id).stock_quantity, 10)
+
+        for rows in ([], [{'id': str(self.a.id)}], [{'id': str(self.a.id), 'stock_quantity': -1}],
+                     [{'id': str(self.a.id), 'stock_quantity': 1}, {'id': str(self.a.id), 'stock_quantity': 2}]):
+            with self.subTest(rows=rows):
+                self.assertEqual(self.sync(rows).status_code, 400)
+        with override_settings(PRODUCT_BULK_UPDATE={'MAX_ROWS': 1}):
+            self.assertEqual(self.sync([{'id': str(self.a.id), 'stock_quantity': 1}] * 2).status_code, 400)
+        self.authenticate(self.customer)
+        self.assertEqual(self.sync([{'id': str(self.a.id), 'stock_quantity': 1}]).status_code, 403)
+
+
+class ProductArchiveTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor')
+        cls.customer = make_user('customer@example.com', 'normal_customer')
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.vendor)
+        for i in range(6):
+            data = {'name': f'P{i}', 'retail_price': '10.00', 'whole_sale_price': '8.00', 'stock_quantity': 20}
+            self.assertEqual(
+                self.client.post(reverse('vendor-product-list-create'), data, format='json').status_code, 201,
+            )
+        self.products = list(Product.objects.filter(vendor=self.vendor).order_by('id'))
+        self.authenticate(self.customer)
+        for product in self.products:
+            self.client.post(reverse('cart-view'), {'product_id': str(product.id), 'quantity': 1}, format='json')
+        self.assertEqual(self.client.post(reverse('checkout')).status_code, 201)
+        for product in self.products:
+            self.client.post(reverse('cart-view'), {'product_id': str(product.id), 'quantity': 2}, format='json')
+        self.authenticate(self.vendor)
+        for product in self.products:
+            url = reverse('vendor-product-detail-generic', kwargs={'id': product.id})
+            self.assertEqual(self.client.delete(url).status_code, 204)
+        # All but the last were deleted 100 days ago.
+        long_ago = timezone.now() - datetime.timedelta(days=100)
+        Product.objects.filter(id__in=[product.id for product in self.products[:5]]).update(deactivated_at=long_ago)
+
+    def test_delete_deactivates(self):
+        product = Product.objects.get(id=self.products[0].id)
+        self.assertFalse(product.is_active)
+        self.assertIsNotNone(product.deactivated_at)
+        self.assertEqual(self.client.get(reverse('product-list-generic')).json(), [])
+        url = reverse('vendor-product-detail-generic', kwargs={'id': product.id})
+        self.assertFalse(self.client.get(url).json()['is_active'])
+
+    def test_archives_in_batches(self):
+        inventory.add_stock(self.products[0].id, 3)
+        pauses = []
+        self.assertEqual(archive.archive_products(after_days=90, batch_size=2, pause=0.25, sleep=pauses.append), 5)
+        self.assertEqual(pauses, [0.25] * 3)
+        self.assertEqual(list(Product.objects.filter(vendor=self.vendor)), [self.products[5]])
+        archived = ArchivedProduct.objects.get(id=self.products[0].id)
+        self.assertEqual((archived.name, archived.stock_quantity), (self.products[0].name, 22))
+        # Orders and the ledger keep pointing at the archived ids.
+        self.assertEqual(OrderItem.objects.filter(product_id=archived.id).count(), 1)
+        self.assertEqual(inventory.verify(), [])
+        self.assertEqual(CartItem.objects.filter(cart__user=self.customer).count(), 1)
+        self.assertEqual(cart_totals.check(), [])
+        stats = VendorStats.objects.values('products', 'units_in_carts').get(vendor=self.vendor)
+        activity = VendorActivity.objects.filter(vendor=self.vendor).order_by('period', 'bucket').values_list(
+            'period', 'bucket', 'orders', 'units_sold', 'revenue', 'units_restocked',
+        )
+        stored_activity = list(activity)
+        call_command('rebuild_analytics', stdout=StringIO())
+        self.assertEqual(stats, {'products': 1, 'units_in_carts': 2})
+        self.assertEqual(stats, VendorStats.objects.values('products', 'units_in_carts').get(vendor=self.vendor))
+        self.assertEqual(stored_activity, list(activity.all()))
+
+        url = reverse('vendor-product-detail-generic', kwargs={'id': archived.id})
+        response, _ = self.assertQueryBudget(4, lambda: self.client.get(url))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], str(archived.id))
+        self.assertFalse(response.json()['is_active'])
+        self.assertEqual(self.client.patch(url, {'stock_quantity': 1}, format='json').status_code, 404)
+        self.authenticate(self.customer)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_command_dry_run_archives_nothing(self):
+        out = StringIO()
+        call_command('archive_products', '--dry-run', '--sleep', '0', stdout=out)
+        self.assertIn("Would archive 5 inactive products.", out.getvalue())
+        self.assertFalse(ArchivedProduct.objects.exists())
+
+
+class AsyncReadViewTests(QueryBudgetTestCase):
+    """The async read endpoints must answer exactly like their sync versions."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor')
+        cls.vip = make_user('vip@example.com', 'vip_customer')
+        cls.product = Product.objects.create(
+            name='Widget', vendor=cls.vendor, retail_price=Decimal('10.00'),
+            whole_sale_price=Decimal('8.00'), stock_quantity=5,
+        )
+        cart = Cart.objects.create(user=cls.vip)
+        CartItem.objects.create(cart=cart, product=cls.product, quantity=2)
+
+    def assertSameResponse(self, sync_name, async_name):
+        sync_response = self.client.get(reverse(sync_name))
+        cache.clear()
+        async_response = self.client.get(reverse(async_name))
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.json(), sync_response.json())
+
+    def test_responses_match_sync_views(self):
+        self.assertSameResponse('product-list-generic', 'product-list-async')
+        self.authenticate(self.vip)
+        self.assertSameResponse('cart-view', 'cart-view-async')
+        self.authenticate(self.vendor)
+        self.assertSameResponse('vendor-product-list-create', 'vendor-product-list-async')
+
+    def test_errors_match_sync_views(self):
+        self.assertSameResponse('cart-view', 'cart-view-async')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer not-a-token')
+        self.assertSameResponse('cart-view', 'cart-view-async')
+        self.authenticate(self.vip)
+        self.assertSameResponse('vendor-product-list-create', 'vendor-product-list-async')
+        self.authenticate(self.vendor)
+        self.assertSameResponse('cart-view', 'cart-view-async')
+
+    def test_token_checks_match_sync_views(self):
+        # simplejwt's modules keep the api_settings they imported, so override_settings can't reach it.
+        with mock.patch.object(jwt_settings, 'CHECK_REVOKE_TOKEN', True):
+            self.authenticate(self.vip)
+            self.vip.set_password('An0ther@Secret')
+            self.vip.save(update_fields=['password'])
+            self.assertSameResponse('cart-view', 'cart-view-async')
+            response = self.client.get(reverse('cart-view-async'))
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response.json()['code'], 'password_changed')
+
+    async def test_views_throttle_classes_are_used(self):
+        class Closed:
+            def allow_request(self, request, view):
+                return False
+
+            def wait(self):
+                return 5
+
+        view = type('ClosedProductListView', (AsyncProductListView,), {'throttle_classes': [Closed]})
+        response = await view.as_view()(RequestFactory().get('/'))
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '5'))
+
+
+class FastSerializerTests(QueryBudgetTestCase):
+    """The values()-based serializers must render the same bytes as the DRF ones."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor', full_name='Vendör \u2028 "quoted"')
+        cls.customer = make_user('customer@example.com', 'normal_customer')
+        cls.vip = make_user('vip@example.com', 'vip_customer')
+        cls.products = Product.objects.bulk_create([
+            Product(name='Plain', vendor=cls.vendor, retail_price=Decimal('10.00'),
+                    whole_sale_price=Decimal('8.50'), stock_quantity=3),
+            Product(name='Ünïcode 漢字 \u2029', description='line\nbreak\ttab', vendor=cls.vendor,
+                    retail_price=Decimal('99999999.99'), whole_sale_price=Decimal('0.01'), stock_quantity=0,
+                    is_active=False),
+            Product(name='Cheap', description='', vendor=cls.vendor, retail_price=Decimal('0.10'),
+                    whole_sale_price=Decimal('0.05'), stock_quantity=1000000),
+        ])
+
+    def test_products_match_product_serializer(self):
+        for user in (AnonymousUser(), self.customer, self.vip, self.vendor):
+            with self.subTest(user=str(user)):
+                queryset = Product.objects.select_related('vendor').order_by('name')
+                context = {'request': SimpleNamespace(user=user)}
+                expected = JSONRenderer().render(ProductSerializer(queryset, many=True, context=context).data)
+                self.assertEqual(FastJSONRenderer().render(serialize_products(queryset, user)), expected)
+
+    def test_cart_matches_cart_serializer(self):
+        for user in (self.customer, self.vip):
+            with self.subTest(user_type=user.user_type):
+                cart = Cart.objects.create(user=user)
+                empty = JSONRenderer().render(CartSerializer(cart).data)
+                self.assertEqual(FastJSONRenderer().render(serialize_cart(cart)), empty)
+
+                for quantity, product in enumerate(self.products, 1):
+                    CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+                cart = Cart.objects.select_related('user').get(pk=cart.pk)
+                prefetch_related_objects([cart], Prefetch('items', queryset=CartItem.objects.select_related('product')))
+                expected = JSONRenderer().render(CartSerializer(cart).data)
+                self.assertEqual(FastJSONRenderer().render(serialize_cart(cart)), expected)
+
+
+class ProductFeedConsumerTests(QueryBudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = make_user('vendor@example.com', 'vendor')
+        cls.customer = make_user('customer@example.com', 'normal_customer')
+        cls.a, cls.b = [
+            Product.objects.create(name=name, vendor=cls.vendor, retail_price=Decimal('10.00'),
+                                   whole_sale_price=Decimal('8.00'), stock_quantity=5)
+            for name in ('A', 'B')
+        ]
+        cart = Cart.objects.create(user=cls.customer)
+        CartItem.objects.create(cart=cart, product=cls.a, quantity=1)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(ProductFeedConsumer.as_asgi(), '/ws/products/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    async def update(self, product, stock):
+        await get_channel_layer().group_send(product_group_name(product.id), {
+            'type': 'product.update', 'product_id': str(product.id), 'changes': {'stock_quantity': stock},
+        })
+
+    async def assertUpdated(self, communicator, product, stock):
+        self.assertEqual(await communicator.receive_json_from(), {
+            'type': 'product.update', 'product_id': str(product.id), 'changes': {'stock_quantity': stock},
+        })
+
+    async def test_follows_the_cart_and_explicit_subscriptions(self):
+        communicator, connected = await self.connect(self.customer)
+        self.assertTrue(connected)
+        a, b = str(self.a.id), str(self.b.id)
+
+        # Joined the cart's products on connect.
+        await self.update(self.a, 4)
+        await self.assertUpdated(communicator, self.a, 4)
+        await self.update(self.b, 3)
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.send_json_to({'type': 'subscribe', 'product_ids': [b, 'not-a-uuid']})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'subscriptions', 'product_ids': sorted([a, b])})
+        await self.update(self.b, 2)
+        await self.assertUpdated(communicator, self.b, 2)
+
+        await communicator.send_json_to({'type': 'unsubscribe', 'product_ids': [a]})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'subscriptions', 'product_ids': [b]})
+        await self.update(self.a, 1)
+        self.assertTrue(await communicator.receive_nothing())
+
+        # Cart changes reach the socket through the cart group.
+        await get_channel_layer().group_send(cart_group_name(self.customer.id), {
+            'type': 'cart.subscription', 'product_id': a, 'subscribed': True,
+        })
+        # The layer and the socket are separate queues; ask until the event is handled.
+        for _ in range(50):
+            await communicator.send_json_to({'type': 'subscribe', 'product_ids': []})
+            if a in (await communicator.receive_json_from())['product_ids']:
+                break
+        await self.update(self.a, 7)
+        await self.assertUpdated(communicator, self.a, 7)
+
+        await communicator.disconnect()
+        self.assertFalse(any(get_channel_layer().groups.values()))
+
+    async def test_anonymous_sockets_are_refused(self):
+        _, connected = await self.connect(AnonymousUser())
+        self.assertFalse(connected)
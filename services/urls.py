@@ -1,11 +1,20 @@
 
 from django.urls import path
-from .views import ProductListView, VendorProductListCreateView, VendorProductDetailView as GenericVendorProductDetailView , VendorProductsView, CartView, ManageCartProducts
+from .views import ProductListView, ProductFacetsView, VendorProductListCreateView, VendorProductDetailView as GenericVendorProductDetailView , VendorProductBulkUpdateView, VendorProductsView, CartView, CartSummaryView, CheckoutView, ManageCartProducts, VendorAnalyticsView
+from .async_views import AsyncProductListView, AsyncCartView, AsyncVendorProductListView
 
 urlpatterns = [
     path('cart/', CartView.as_view(), name='cart-view'),
     path('products/', ProductListView.as_view(), name='product-list-generic'),
+    path('products/facets/', ProductFacetsView.as_view(), name='product-facets'),
     path('vendor/products/', VendorProductListCreateView.as_view(), name='vendor-product-list-create'),
+    path('vendor/products/bulk/', VendorProductBulkUpdateView.as_view(), name='vendor-product-bulk-update'),
     path('vendor/products/<uuid:id>/', GenericVendorProductDetailView.as_view(), name='vendor-product-detail-generic'),
+    path('cart/summary/', CartSummaryView.as_view(), name='cart-summary'),
+    path('vendor/analytics/', VendorAnalyticsView.as_view(), name='vendor-analytics'),
+    path('checkout/', CheckoutView.as_view(), name='checkout'),
     path('manage-cart-products/', ManageCartProducts.as_view(), name='manage-cart-products'),
+    path('async/products/', AsyncProductListView.as_view(), name='product-list-async'),
+    path('async/cart/', AsyncCartView.as_view(), name='cart-view-async'),
+    path('async/vendor/products/', AsyncVendorProductListView.as_view(), name='vendor-product-list-async'),
 ]
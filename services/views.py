@@ -2,17 +2,24 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from .models import Product, Cart, CartItem 
-from .serializers import ProductSerializer, ProductCreateSerializer, CartItemSerializer, CartSerializer
+from rest_framework.renderers import BrowsableAPIRenderer
+from .models import ArchivedProduct, Product, Cart, CartItem 
+from .serializers import ArchivedProductSerializer, ProductBulkUpdateSerializer, ProductSerializer, ProductCreateSerializer, CartItemSerializer, dashboard_data, decimal_string, order_data, serialize_cart, serialize_products
 from authentication.models import User
 from rest_framework import generics, status
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from authentication.permissions import IsVendor
 from django.core.cache import cache
 from django.db import transaction
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 from Notifications.models import Notification
+from Notifications import outbox
+from SaaS_Practice.renderers import FastJSONRenderer
+from . import analytics, archive, bulk_update, cart_totals, events, facets
+from .catalog import (
+    PRODUCT_LIST_TIMEOUT, catalog_generation, product_facets_key, product_list_key,
+)
+from .checkout import EmptyCart, InsufficientStock, checkout
 
 
 
@@ -27,7 +34,7 @@ class VendorProductsView(APIView):
         except:
             return Response({"error": "User profile not found"}, status=404)
         
-        products = Product.objects.filter(vendor=user)
+        products = Product.objects.filter(vendor=user).select_related('vendor')
         serializer = ProductSerializer(products, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
     
@@ -48,9 +55,27 @@ class VendorProductsView(APIView):
 
 ## Removed duplicate APIView-based VendorProductDetailView; using generics-based below
 
+# For views whose payloads come from the fast serializers in serializers.py.
+FAST_RENDERERS = [FastJSONRenderer, BrowsableAPIRenderer]
+
+
+def get_cart(user):
+    cart, created = Cart.objects.get_or_create(user=user)
+    if created:
+        cart_totals.initialize(cart)
+    # Reuse the request's user instead of reloading it through cart.user.
+    cart.user = user
+    return cart
+
+
+def lock_quantity(cart_item):
+    """The item's committed quantity, with its row locked until the transaction ends."""
+    return CartItem.objects.select_for_update().values_list('quantity', flat=True).get(id=cart_item.id)
+
 
 class CartView(APIView):
     permission_classes = [IsAuthenticated]
+    renderer_classes = FAST_RENDERERS
     
     def get_user_profile(self, request):
         try:
@@ -66,9 +91,8 @@ class CartView(APIView):
         if error_response:
             return error_response
         
-        cart, created = Cart.objects.get_or_create(user=user)
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        cart = get_cart(user)
+        return Response(serialize_cart(cart), status=status.HTTP_200_OK)
     
     def post(self, request):
         
@@ -76,7 +100,7 @@ class CartView(APIView):
         if error_response:
             return error_response
         
-        cart, created = Cart.objects.get_or_create(user=user)
+        cart = get_cart(user)
         
         serializer = CartItemSerializer(data=request.data)
         if serializer.is_valid():
@@ -101,8 +125,12 @@ class CartView(APIView):
                             return Response({
                                 "error": f"Cannot add {quantity} more. Only {product.stock_quantity - cart_item.quantity} available"
                             }, status=400)
+                        cart_totals.apply_changes(cart, [(product, cart_item.quantity, new_quantity)])
                         cart_item.quantity = new_quantity
                         cart_item.save()
+                    else:
+                        cart_totals.apply_changes(cart, [(product, 0, quantity)])
+                        events.cart_changed([(user.id, product.id, True)])
                 
                 return Response(CartItemSerializer(cart_item).data, status=status.HTTP_201_CREATED)
                 
@@ -112,6 +140,49 @@ class CartView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class CartSummaryView(APIView):
+    """Item count and total of the cart from its stored totals, without reading the items."""
+    permission_classes = [IsAuthenticated]
+    get_user_profile = CartView.get_user_profile
+
+    def get(self, request):
+        user, error_response = self.get_user_profile(request)
+        if error_response:
+            return error_response
+
+        cart = get_cart(user)
+        totals = cart.stored_totals()
+        if totals is None:
+            # A cart from before totals were stored; materialize it once.
+            cart_totals.rebuild([cart.id])
+            totals = cart.stored_totals()
+        return Response({
+            "id": str(cart.id),
+            "total_items": totals.total_items,
+            "total_price": decimal_string(totals.total_price),
+            "price_type": totals.tier,
+        }, status=status.HTTP_200_OK)
+
+
+class CheckoutView(APIView):
+    permission_classes = [IsAuthenticated]
+    renderer_classes = FAST_RENDERERS
+    get_user_profile = CartView.get_user_profile
+
+    def post(self, request):
+        user, error_response = self.get_user_profile(request)
+        if error_response:
+            return error_response
+
+        try:
+            order, lines = checkout(user, get_cart(user))
+        except EmptyCart as exc:
+            return Response({"error": str(exc)}, status=400)
+        except InsufficientStock as exc:
+            return Response({"error": str(exc), "items": exc.lines}, status=400)
+        return Response(order_data(order, lines), status=status.HTTP_201_CREATED)
+
+
 
 
 
@@ -120,36 +191,67 @@ class CartView(APIView):
 
 class ProductListView(APIView):
     permission_classes = []
+    renderer_classes = FAST_RENDERERS
 
     def get(self, request):
-        cached_data = cache.get("product_list")
-        if cached_data:
+        # Optional facet filters: ?vendor=&price_band=&availability=
+        try:
+            filters = facets.parse_filters(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        key = product_list_key(catalog_generation(), facets.filters_key(filters))
+        cached_data = cache.get(key)
+        if cached_data is not None:
             return Response(cached_data, status=status.HTTP_200_OK)
 
-        products = Product.objects.filter(is_active=True, stock_quantity__gt=0)
-        serializer = ProductSerializer(products, many=True)
-        cache.set("product_list", serializer.data, timeout=300)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # The public list is always priced at retail, whoever asks.
+        products = facets.filter_products(Product.objects.filter(is_active=True, stock_quantity__gt=0), filters)
+        data = serialize_products(products)
+        cache.set(key, data, timeout=PRODUCT_LIST_TIMEOUT)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class ProductFacetsView(APIView):
+    """Facet counts for the product list under the same filters, from the facet index."""
+    permission_classes = []
+    renderer_classes = FAST_RENDERERS
+
+    def get(self, request):
+        try:
+            filters = facets.parse_filters(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        key = product_facets_key(catalog_generation(), facets.filters_key(filters))
+        data = cache.get(key)
+        if data is None:
+            data = facets.facet_counts(filters)
+            cache.set(key, data, timeout=PRODUCT_LIST_TIMEOUT)
+        return Response(data, status=status.HTTP_200_OK)
 
 
 class VendorProductListCreateView(generics.ListCreateAPIView):
    
     serializer_class = ProductSerializer
     permission_classes = [IsVendor]
+    renderer_classes = FAST_RENDERERS
     
     def get_queryset(self):
     
-        return Product.objects.filter(vendor=self.request.user)
+        return Product.objects.filter(vendor=self.request.user).select_related('vendor')
     
     def get_serializer_class(self):
        
         if self.request.method == 'POST':
             return ProductCreateSerializer
         return ProductSerializer
+
+    def list(self, request, *args, **kwargs):
+        return Response(serialize_products(self.get_queryset(), request.user))
     
     def perform_create(self, serializer):
         serializer.save(vendor=self.request.user)
-        cache.delete("product_list")
 
 
 class VendorProductDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -160,7 +262,7 @@ class VendorProductDetailView(generics.RetrieveUpdateDestroyAPIView):
     
     def get_queryset(self):
     
-        return Product.objects.filter(vendor=self.request.user)
+        return Product.objects.filter(vendor=self.request.user).select_related('vendor')
     
     def get_serializer_class(self):
         
@@ -168,45 +270,97 @@ class VendorProductDetailView(generics.RetrieveUpdateDestroyAPIView):
             return ProductSerializer
         return ProductCreateSerializer
     
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            # Archived products are still the vendor's, under the same id.
+            archived = get_object_or_404(
+                ArchivedProduct.objects.select_related('vendor'), vendor=request.user, id=kwargs['id'],
+            )
+            return Response(ArchivedProductSerializer(archived).data, status=status.HTTP_200_OK)
+
     def perform_destroy(self, instance):
-       
-        instance.is_active = False
-        instance.save()
-        cache.delete("product_list")
-    
+        archive.deactivate(instance)
+
     def destroy(self, request, *args, **kwargs):
-   
-     instance = self.get_object()
-    
-    # Perform the deletion
-     instance.delete()  
-    
-     return Response(
-        {"message": "Product deleted successfully"}, 
-        status=status.HTTP_204_NO_CONTENT  
-    )
+        # A soft delete: the product is deactivated, and archived later.
+        self.perform_destroy(self.get_object())
+        return Response(
+            {"message": "Product deleted successfully"},
+            status=status.HTTP_204_NO_CONTENT
+        )
 
     def perform_update(self, serializer):
+        # The serializer records the ProductChanged event with the diff.
         serializer.save()
-        cache.delete("product_list")
 
 
 
 
 
 
+class VendorProductBulkUpdateView(APIView):
+    """
+    Stock and prices of many of the vendor's products at once, e.g. from an
+    ERP sync: {"products": [{"id", "stock_quantity", "retail_price",
+    "whole_sale_price"}, ...]}, every field but id optional. All rows are
+    applied or none.
+    """
+    permission_classes = [IsVendor]
+    renderer_classes = FAST_RENDERERS
+
+    def patch(self, request):
+        rows = request.data.get('products') if isinstance(request.data, dict) else None
+        if not isinstance(rows, list) or not rows:
+            return Response({"error": "products must be a non-empty list"}, status=400)
+        max_rows = bulk_update.get_bulk_update_settings()['MAX_ROWS']
+        if len(rows) > max_rows:
+            return Response({"error": f"At most {max_rows} products per request"}, status=400)
+
+        serializer = ProductBulkUpdateSerializer(data=rows, many=True)
+        if not serializer.is_valid():
+            return Response({"error": "Invalid products", "products": serializer.errors}, status=400)
+        try:
+            counts = bulk_update.update_products(request.user, serializer.validated_data)
+        except bulk_update.BulkUpdateError as exc:
+            return Response({"error": str(exc), "products": exc.rows}, status=400)
+        return Response(counts, status=status.HTTP_200_OK)
+
+
 def send_notification_to_user(user_id, message):
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"user_{user_id}",
-        {
-            "type": "notify",
-            "message": message,
-        }
-    )
+    # Sent by the outbox dispatcher once the caller's transaction commits.
+    return outbox.emit('UserNotified', {'user_id': str(user_id), 'message': message})
+
+
+
 
 
+class VendorAnalyticsView(APIView):
+    """
+    The vendor's catalog gauges, the products most held in carts and their
+    sales and restocks per hour (?period=hour, the last 24 by default) or
+    per day (?period=day, the last 30), read from the analytics rollups.
+    """
+    permission_classes = [IsVendor]
+    renderer_classes = FAST_RENDERERS
+
+    DEFAULT_BUCKETS = {'hour': 24, 'day': 30}
+    MAX_BUCKETS = {'hour': 24 * 31, 'day': 366}
 
+    def get(self, request):
+        period = request.query_params.get('period', 'hour')
+        if period not in self.DEFAULT_BUCKETS:
+            return Response({"error": "period must be 'hour' or 'day'"}, status=400)
+        try:
+            buckets = int(request.query_params.get('buckets', self.DEFAULT_BUCKETS[period]))
+        except ValueError:
+            return Response({"error": "buckets must be an integer"}, status=400)
+        if not 1 <= buckets <= self.MAX_BUCKETS[period]:
+            return Response({"error": f"buckets must be between 1 and {self.MAX_BUCKETS[period]}"}, status=400)
+
+        data = analytics.dashboard(request.user, period, buckets)
+        return Response(dashboard_data(data), status=status.HTTP_200_OK)
 
 
 class ManageCartProducts(APIView ):
@@ -235,7 +389,7 @@ class ManageCartProducts(APIView ):
         if error_response:
             return error_response
 
-        cart, _ = Cart.objects.get_or_create(user=user)
+        cart = get_cart(user)
 
         cart_item_id = self._get_param(request, ['cart_item_id', 'cartItemId'])
         product_id = self._get_param(request, ['product_id', 'productId', 'id', 'product'])
@@ -253,7 +407,7 @@ class ManageCartProducts(APIView ):
         # If cart_item_id provided, resolve product via cart item
         if cart_item_id:
             try:
-                cart_item = CartItem.objects.get(id=cart_item_id, cart=cart)
+                cart_item = CartItem.objects.select_related('product').get(id=cart_item_id, cart=cart)
             except CartItem.DoesNotExist:
                 return Response({"error": "Item not found in cart"}, status=404)
             product = cart_item.product
@@ -268,16 +422,29 @@ class ManageCartProducts(APIView ):
                 cart_item = CartItem.objects.get(cart=cart, product=product)
             except CartItem.DoesNotExist:
                 return Response({"error": "Item not found in cart"}, status=404)
+            cart_item.product = product
+        cart_item.cart = cart
 
         if quantity == 0:
-            cart_item.delete()
+            try:
+                with transaction.atomic():
+                    cart_totals.apply_changes(cart, [(product, lock_quantity(cart_item), 0)])
+                    cart_item.delete()
+                    events.cart_changed([(user.id, product.id, False)])
+            except CartItem.DoesNotExist:
+                return Response({"error": "Item not found in cart"}, status=404)
             return Response({"message": "Item removed from cart"}, status=status.HTTP_200_OK)
 
         if product.stock_quantity < quantity:
             return Response({"error": "Insufficient stock"}, status=400)
 
-        cart_item.quantity = quantity
-        cart_item.save()
+        try:
+            with transaction.atomic():
+                cart_totals.apply_changes(cart, [(product, lock_quantity(cart_item), quantity)])
+                cart_item.quantity = quantity
+                cart_item.save()
+        except CartItem.DoesNotExist:
+            return Response({"error": "Item not found in cart"}, status=404)
         return Response(CartItemSerializer(cart_item).data, status=status.HTTP_200_OK)
 
     def delete(self, request, *args, **kwargs):
@@ -285,14 +452,14 @@ class ManageCartProducts(APIView ):
         if error_response:
             return error_response
 
-        cart, _ = Cart.objects.get_or_create(user=user)
+        cart = get_cart(user)
 
         cart_item_id = self._get_param(request, ['cart_item_id', 'cartItemId'])
         product_id = self._get_param(request, ['product_id', 'productId', 'id', 'product'])
 
         if cart_item_id:
             try:
-                cart_item = CartItem.objects.get(id=cart_item_id, cart=cart)
+                cart_item = CartItem.objects.select_related('product').get(id=cart_item_id, cart=cart)
             except CartItem.DoesNotExist:
                 return Response({"error": "Item not found in cart"}, status=404)
         else:
@@ -306,6 +473,13 @@ class ManageCartProducts(APIView ):
                 cart_item = CartItem.objects.get(cart=cart, product=product)
             except CartItem.DoesNotExist:
                 return Response({"error": "Item not found in cart"}, status=404)
+            cart_item.product = product
 
-        cart_item.delete()
+        try:
+            with transaction.atomic():
+                cart_totals.apply_changes(cart, [(cart_item.product, lock_quantity(cart_item), 0)])
+                cart_item.delete()
+                events.cart_changed([(user.id, cart_item.product_id, False)])
+        except CartItem.DoesNotExist:
+            return Response({"error": "Item not found in cart"}, status=404)
         return Response({"message": "Item removed from cart"}, status=status.HTTP_200_OK)
\ No newline at end of file